@@ -0,0 +1,120 @@
+"""Local classifier that picks the sub-agent for a request from the embeddings of previously logged requests."""
+import json
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+
+class RequestLog:
+    """Append-only JSON lines log of requests and the sub-agent that handled them."""
+    path: str
+    lock: threading.Lock
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def append(self, text: str, label: str):
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"input": text, "label": label}) + "\n")
+
+    def read(self) -> Tuple[List[str], List[str]]:
+        """Return the logged texts and labels."""
+        texts, labels = [], []
+        if not os.path.exists(self.path):
+            return texts, labels
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                texts.append(record["input"])
+                labels.append(record["label"])
+        return texts, labels
+
+
+class SubAgentClassifier:
+    """k-nearest-neighbour classifier over normalized request embeddings.
+
+    The examples are held in memory as one float32 matrix, so a prediction is a single matrix-vector product.
+    A prediction is only confident when the nearest example is similar enough and the neighbours mostly agree.
+    The embeddings should be local, like doc_indexes.backends.HashedNgramEmbeddings: the whole log is embedded
+    at startup and every request on the way in, before the agent runs.
+    """
+    embeddings: Embeddings
+    matrix: np.ndarray
+    labels: List[str]
+    k: int
+    min_similarity: float
+    min_confidence: float
+    predictions: int
+    confident_predictions: int
+    lock: threading.Lock
+
+    def __init__(self, embeddings: Embeddings, k: int = 5, min_similarity: float = 0.85, min_confidence: float = 0.8):
+        self.embeddings = embeddings
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.labels = []
+        self.k = k
+        self.min_similarity = min_similarity
+        self.min_confidence = min_confidence
+        self.predictions = 0
+        self.confident_predictions = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_log(cls, log: RequestLog, embeddings: Embeddings, **kwargs) -> "SubAgentClassifier":
+        """Train a classifier on every request in the log."""
+        classifier = cls(embeddings, **kwargs)
+        texts, labels = log.read()
+        if texts:
+            classifier.add_vectors(embeddings.embed_documents(texts), labels)
+        return classifier
+
+    def embed(self, text: str) -> np.ndarray:
+        return normalize(np.asarray(self.embeddings.embed_query(text), dtype=np.float32))
+
+    def add_vectors(self, vectors: List[List[float]], labels: List[str]):
+        """Add labelled examples to the matrix."""
+        rows = normalize(np.asarray(vectors, dtype=np.float32).reshape(len(labels), -1))
+        with self.lock:
+            self.matrix = rows if self.matrix.size == 0 else np.vstack([self.matrix, rows])
+            self.labels = self.labels + list(labels)
+
+    def predict_vector(self, vector: np.ndarray) -> Tuple[Optional[str], float]:
+        """Return the predicted label and its confidence, or (None, confidence) when it isn't confident."""
+        with self.lock:
+            matrix, labels = self.matrix, self.labels
+        if len(labels) < self.k:
+            return None, 0.0
+        similarities = matrix @ vector
+        k = min(self.k, len(labels))
+        nearest = np.argpartition(-similarities, k - 1)[:k]
+        if similarities[nearest].max() < self.min_similarity:
+            return None, 0.0
+        votes = {}
+        for i in nearest:
+            votes[labels[i]] = votes.get(labels[i], 0.0) + max(float(similarities[i]), 0.0)
+        label, score = max(votes.items(), key=lambda item: item[1])
+        confidence = score / (sum(votes.values()) or 1.0)
+        if confidence < self.min_confidence:
+            return None, confidence
+        return label, confidence
+
+    def predict(self, text: str) -> Tuple[Optional[str], float, np.ndarray]:
+        """Embed the text and predict its label. The vector is returned so it can be added once the label is known."""
+        vector = self.embed(text)
+        label, confidence = self.predict_vector(vector)
+        with self.lock:
+            self.predictions += 1
+            self.confident_predictions += label is not None
+        return label, confidence, vector
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
@@ -0,0 +1,136 @@
+"""Compact memory of a conversation, so follow-up requests can refer to what earlier requests found."""
+import json
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from tools.cache import FAILED_PREFIXES, normalize_input
+from tools.k8s_explorer.tool import KubernetesOpsModel, singular_resource_type
+
+RESOURCE_TYPES = KubernetesOpsModel.__fields__["available_resource_types"].default
+
+
+class ConversationMemory:
+    """What a conversation has established so far.
+
+    Holds a summary of older turns, the last few turns verbatim, the kubernetes objects resolved so far
+    as (namespace, kind, name), and the most recent tool observations, truncated.
+    Everything is plain data, so the memory can be sized in bytes and saved as JSON.
+    """
+    summary: str
+    turns: List[Tuple[str, str]]
+    entities: "OrderedDict[Tuple[str, str, str], None]"
+    observations: List[Tuple[str, str, str]]
+    max_turns: int
+    max_entities: int
+    max_observations: int
+    max_observation_chars: int
+
+    def __init__(self, max_turns: int = 3, max_entities: int = 30, max_observations: int = 6, max_observation_chars: int = 400):
+        self.summary = ""
+        self.turns = []
+        self.entities = OrderedDict()
+        self.observations = []
+        self.max_turns = max_turns
+        self.max_entities = max_entities
+        self.max_observations = max_observations
+        self.max_observation_chars = max_observation_chars
+
+    def remember(self, message: str, answer: str, observations: List[Tuple[str, str, str]]):
+        """Add a finished request, the agent's answer and the tool observations it made."""
+        for tool_name, tool_input, observation in observations:
+            if str(observation).startswith(FAILED_PREFIXES):
+                continue
+            for entity in entities_from_call(tool_name, tool_input, str(observation)):
+                self.entities.pop(entity, None)
+                self.entities[entity] = None
+            self.observations.append((tool_name, normalize_input(tool_input), truncate(str(observation), self.max_observation_chars)))
+        while len(self.entities) > self.max_entities:
+            self.entities.popitem(last=False)
+        self.observations = self.observations[-self.max_observations:]
+        self.turns.append((truncate(message, 300), truncate(answer, 600)))
+        # older turns are folded into the summary, one line each
+        while len(self.turns) > self.max_turns:
+            old_message, old_answer = self.turns.pop(0)
+            self.summary += f"User asked: {truncate(old_message, 120)} You answered: {truncate(old_answer, 200)}\n"
+
+    def context(self) -> str:
+        """Format the memory for the agent's prompt. Empty if nothing has been remembered yet."""
+        sections = []
+        if self.summary:
+            sections.append(f"Summary of earlier requests:\n{self.summary.strip()}")
+        if self.turns:
+            sections.append("Recent requests:\n" + "\n".join(
+                f"User: {message}\nYou: {answer}" for message, answer in self.turns))
+        if self.entities:
+            sections.append("Kubernetes objects already resolved (namespace, kind, name):\n" + "\n".join(
+                f"- {namespace}, {kind}, {name}" for namespace, kind, name in self.entities))
+        if self.observations:
+            sections.append("Recent tool observations:\n" + "\n".join(
+                f"- {tool_name}({tool_input}): {observation}" for tool_name, tool_input, observation in self.observations))
+        return "\n\n".join(sections)
+
+    def size_bytes(self) -> int:
+        return len(json.dumps(self.to_dict()).encode())
+
+    def trim(self, max_bytes: int):
+        """Drop the oldest observations, then the oldest entities, then the oldest turns and summary lines, until the memory fits."""
+        while self.size_bytes() > max_bytes:
+            if self.observations:
+                self.observations.pop(0)
+            elif self.entities:
+                self.entities.popitem(last=False)
+            elif len(self.turns) > 1:
+                self.turns.pop(0)
+            elif self.summary:
+                self.summary = self.summary.split("\n", 1)[1] if "\n" in self.summary.strip() else ""
+            elif self.turns:
+                # only the last turn is left, shorten it rather than forgetting it
+                message, answer = self.turns[0]
+                if len(message) < 40 and len(answer) < 40:
+                    break
+                self.turns[0] = (truncate(message, len(message) // 2), truncate(answer, len(answer) // 2))
+            else:
+                break
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "summary": self.summary,
+            "turns": [list(turn) for turn in self.turns],
+            "entities": [list(entity) for entity in self.entities],
+            "observations": [list(observation) for observation in self.observations],
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], **kwargs: Any) -> "ConversationMemory":
+        memory = cls(**kwargs)
+        memory.summary = d.get("summary", "")
+        memory.turns = [tuple(turn) for turn in d.get("turns", [])]
+        memory.entities = OrderedDict((tuple(entity), None) for entity in d.get("entities", []))
+        memory.observations = [tuple(observation) for observation in d.get("observations", [])]
+        return memory
+
+
+def entities_from_call(tool_name: str, tool_input: str, observation: str) -> List[Tuple[str, str, str]]:
+    """Return the (namespace, kind, name) objects a successful explorer tool call resolved."""
+    fields = normalize_input(tool_input).split(",")
+    if tool_name == "k8s_get_resource" and len(fields) == 3:
+        kind = singular_resource_type(fields[1], RESOURCE_TYPES)
+        return [(fields[0], kind, fields[2])] if kind else []
+    if tool_name == "k8s_get_object_names" and len(fields) == 2:
+        kind = singular_resource_type(fields[1], RESOURCE_TYPES)
+        names = [name.strip() for name in observation.split(",") if name.strip()]
+        # a long listing isn't a resolved object, the agent would still have to pick one
+        return [(fields[0], kind, name) for name in names] if kind and len(names) <= 5 else []
+    if tool_name == "k8s_get_pod_name_like" and len(fields) == 2:
+        return [(fields[0], "pod", observation.strip())]
+    if tool_name == "k8s_get_pod_logs" and len(fields) == 2:
+        return [(fields[0], "pod", fields[1])]
+    return []
+
+
+def truncate(text: str, max_chars: int) -> str:
+    text = text.strip()
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + " ..."
+
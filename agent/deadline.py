@@ -0,0 +1,139 @@
+"""Per-request deadlines, carried through agents, sub-agents and tool calls in a context variable."""
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain.chat_models import ChatOpenAI
+from langchain.schema import AgentAction
+
+# how long past the deadline a tool call may run, so sub-agents that stop cooperatively can still report what they found
+DEADLINE_GRACE_SECONDS = 2.0
+# kubernetes, gitlab and slack calls never get less than this, a zero timeout would fail without trying
+MIN_REQUEST_TIMEOUT_SECONDS = 0.5
+
+DEADLINE_OBSERVATION = "Error: the request ran out of time before {tool} could run."
+TIMEOUT_OBSERVATION = "Error: {tool} did not finish before the request's deadline and was abandoned."
+STOPPED_OUTPUT_PREFIX = "Agent stopped due to"
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+# set on the tool pool's threads, so the tool calls of a sub-agent running there don't wait on the pool again
+_on_tool_pool: contextvars.ContextVar[bool] = contextvars.ContextVar("on_tool_pool", default=False)
+
+# runs the blocking read tool calls of requests with a deadline; abandoned calls hold a thread until their client times out
+TOOL_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("K8S_TOOL_POOL_SIZE", "32")), thread_name_prefix="tool")
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[Optional[float]]:
+    """Give everything run inside the block at most seconds to finish. A nested scope can only shorten the deadline."""
+    if seconds is None:
+        yield _deadline.get()
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the deadline, or None if there is no deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def request_timeout(default: Optional[float] = None) -> Optional[float]:
+    """The timeout to give a client call: what is left of the deadline, or default if there is none."""
+    left = remaining()
+    if left is None:
+        return default
+    left = max(left, MIN_REQUEST_TIMEOUT_SECONDS)
+    return min(left, default) if default is not None else left
+
+
+class DeadlineChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose requests time out at the deadline of the request they're made for.
+
+    The timeout is taken on every call rather than when the LLM is created, since an agent's later calls have
+    less time left, and request_timeout is the longest any call may take.
+    """
+
+    @property
+    def _default_params(self) -> Dict[str, Any]:
+        return {**super()._default_params, "request_timeout": request_timeout(self.request_timeout)}
+
+
+def run_with_deadline(tool_name: str, run: Callable[[str], str], tool_input: str, write: bool = False) -> str:
+    """Run a tool, returning an error observation instead of waiting past the deadline.
+
+    Blocking calls can't be interrupted, so a read runs on TOOL_POOL, and is left to finish on its own when
+    abandoned; the clients are given request_timeout() so it doesn't run for long. A write is never abandoned,
+    the agent would take it for one that didn't happen and may run it again, so it runs inline, bounded by the
+    client timeouts alone.
+    """
+    left = remaining()
+    if left is None:
+        return run(tool_input)
+    if left <= 0:
+        return DEADLINE_OBSERVATION.format(tool=tool_name)
+    # a sub-agent on the pool waiting on the pool for its own tool calls could starve it, and its caller's wait
+    # already bounds them
+    if write or _on_tool_pool.get():
+        return run(tool_input)
+    context = contextvars.copy_context()
+
+    def target() -> str:
+        _on_tool_pool.set(True)
+        return run(tool_input)
+    future = TOOL_POOL.submit(context.run, target)
+    try:
+        return future.result(timeout=left + DEADLINE_GRACE_SECONDS)
+    except FutureTimeoutError:
+        # a call still waiting for a thread never runs
+        future.cancel()
+        return TIMEOUT_OBSERVATION.format(tool=tool_name)
+
+
+async def arun_with_deadline(tool_name: str, arun: Callable[[str], Awaitable[str]], tool_input: str, write: bool = False) -> str:
+    """Async version of run_with_deadline. Here an abandoned read is cancelled, and a write is never abandoned."""
+    left = remaining()
+    if left is None:
+        return await arun(tool_input)
+    if left <= 0:
+        return DEADLINE_OBSERVATION.format(tool=tool_name)
+    if write:
+        return await arun(tool_input)
+    try:
+        return await asyncio.wait_for(arun(tool_input), timeout=left + DEADLINE_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        return TIMEOUT_OBSERVATION.format(tool=tool_name)
+
+
+def partial_answer(intermediate_steps: List[Tuple[AgentAction, Any]], max_observation_chars: int = 500) -> str:
+    """Answer with what was found before the deadline, without another LLM call."""
+    steps = [(action, str(observation)) for action, observation in intermediate_steps
+             if not str(observation).startswith("Error")]
+    if not steps:
+        return "I ran out of time before I could find an answer. Please try again, or ask a narrower question."
+    lines = ["I ran out of time before finishing. This is what I found so far:"]
+    for action, observation in steps:
+        if len(observation) > max_observation_chars:
+            observation = observation[:max_observation_chars] + " ..."
+        lines.append(f"- {action.tool}({action.tool_input}):\n{observation.strip()}")
+    return "\n".join(lines)
@@ -1,29 +1,51 @@
 import base64
 import os
-from typing import Any, List
+from typing import Any, Dict, List
 import gitlab
 import googleapiclient.discovery
 from kubernetes import client
 from tempfile import NamedTemporaryFile
 
 from slack_sdk import WebClient
-from agent.toolkits.base import create_k8s_engineer_agent
+from slack_sdk.web.async_client import AsyncWebClient
+from agent.plan_execute.agent import PlanAndExecuteChain
+from agent.classifier import RequestLog, SubAgentClassifier
+from agent.deadline import DeadlineChatOpenAI, request_timeout
+from agent.metrics import REGISTRY, Family, current_run_metrics, family
+from agent.mkrl_chat.tool_selection import ToolSelector
+from agent.router import IntentRouter, RoutedChain
+from agent.tiering import TIER_STATS
+from agent.tracing import current_tracer, instrument_gitlab_client, instrument_kubernetes_client
+from agent.toolkits.base import create_k8s_engineer_agent, create_k8s_planner_agent
+from agent.toolkits.k8s_explorer.toolkit import K8sExplorerToolkit
+from agent.toolkits.k8s_sme.toolkit import KubernetesSMEToolkit
 from agent.toolkits.toolkit import K8sEngineerToolkit
+from doc_indexes.backends import HashedNgramEmbeddings
 from doc_indexes.k8s_index import KubernetesIndex
+from tools.aio import BLOCKING_POOL_STATS
+from tools.cache import TOOL_CACHE
 from tools.git_integrator.tool import GitModel
 from tools.gitlab_integration.tool import GitlabModel
+from tools.k8s_explorer.async_model import AsyncKubernetesOpsModel, async_client
 from tools.k8s_explorer.tool import KubernetesOpsModel
-from tools.k8s_sme.tools import KubernetesSMEModel
+from tools.k8s_sme.tools import KubernetesSchemaModel, KubernetesSMEModel
 from tools.slack_integration.tool import SlackModel
 from langchain.chat_models import ChatOpenAI
-from langchain.agents.agent import AgentExecutor
-from langchain.callbacks.base import CallbackManager, BaseCallbackHandler
+from langchain.embeddings import OpenAIEmbeddings
+from langchain.chains.base import Chain
+from langchain.callbacks.base import AsyncCallbackManager, BaseCallbackManager, CallbackManager, BaseCallbackHandler
 
 
 class AgentFactory:
-    def __init__(self, model_name: str = "gpt-4"):
+    def __init__(self, model_name: str = "gpt-4", max_parallel_actions: int = None, agent_mode: str = None):
+        cluster = get_cluster()
+        k8s_client = kubernetes_api(cluster)
         self.k8s_model = KubernetesOpsModel.from_k8s_client(
-            k8s_client=kubernetes_api(get_cluster()))
+            k8s_client=instrument_kubernetes_client(k8s_client), request_timeout=request_timeout)
+        # used by the explorer tools when agents run on the asyncio path
+        self.k8s_async_model = AsyncKubernetesOpsModel.from_configuration(
+            kubernetes_async_configuration(cluster), request_timeout=request_timeout,
+            instrument_client=instrument_kubernetes_client) if async_client is not None else None
 
         git_username = os.getenv("GIT_USERNAME", "k8s-engineer")
         git_password = os.getenv("GIT_PASSWORD", "dummy-password")
@@ -32,28 +54,181 @@ class AgentFactory:
         gitlab_private_token = os.getenv("GITLAB_PRIVATE_TOKEN", "dummy-token")
         gitlab_url = os.getenv("GITLAB_URL", "https://gitlab.com")
 
-        gl = gitlab.Gitlab(url=gitlab_url, private_token=gitlab_private_token)
-        self.gitlab_model = GitlabModel(gl=gl)
+        # client timeouts bound the calls a request abandons at its deadline, which can't be interrupted
+        client_timeout = float(os.getenv("K8S_CLIENT_TIMEOUT", "30"))
+        gl = gitlab.Gitlab(url=gitlab_url, private_token=gitlab_private_token, timeout=client_timeout)
+        self.gitlab_model = GitlabModel(gl=instrument_gitlab_client(gl))
 
         slack_token = os.environ["SLACK_BOT_TOKEN"]
-        slack_client = WebClient(token=slack_token)
+        slack_client = WebClient(token=slack_token, timeout=int(client_timeout))
         slack_channel = os.environ["SLACK_CHANNEL_ID"]
         self.slack_model = SlackModel(
-            client=slack_client, channel=slack_channel)
+            client=slack_client, async_client=AsyncWebClient(token=slack_token, timeout=int(client_timeout)), channel=slack_channel,
+            request_timeout=request_timeout)
 
         k8s_doc_url = os.getenv(
             "K8S_DOC_URL", "https://github.com/dohsimpson/kubernetes-doc-pdf/raw/master/PDFs/Reference.pdf")
         k8s_index = KubernetesIndex(doc_url=k8s_doc_url)
-        self.k8s_sme_model = KubernetesSMEModel(index=k8s_index)
+        self.k8s_sme_model = KubernetesSMEModel(index=k8s_index, schema_model=KubernetesSchemaModel.from_k8s_client(self.k8s_model.k8s_client))
 
-        self.llm = ChatOpenAI(
+        self.model_name = model_name
+        self.max_parallel_actions = max_parallel_actions or int(os.getenv("K8S_MAX_PARALLEL_ACTIONS", "1"))
+        # "react" runs the nested agent loops, "plan" runs a single plan-and-execute pass over the leaf tools
+        self.agent_mode = agent_mode or os.getenv("K8S_AGENT_MODE", "react")
+        self.router = IntentRouter.for_k8s(self.k8s_model)
+        # sub-agents run on a faster model when one is configured, and escalate to model_name when it struggles
+        sub_agent_model = os.getenv("K8S_SUB_AGENT_MODEL")
+        self.sub_agent_models = {
+            "k8s_explorer_agent": os.getenv("K8S_EXPLORER_MODEL", sub_agent_model),
+            "k8s_sme_agent": os.getenv("K8S_SME_MODEL", sub_agent_model),
+        }
+        # when set, the explorer prompt only describes the K8S_MAX_TOOLS tools most relevant to each request
+        max_tools = os.getenv("K8S_MAX_TOOLS")
+        self.tool_selector = ToolSelector(OpenAIEmbeddings(), k=int(max_tools), mandatory_tools=[
+            "k8s_get_available_namespaces", "k8s_get_available_resource_types"]) if max_tools else None
+        # requests answered by a single sub-agent are logged here, and used to route similar requests straight to it
+        request_log_path = os.getenv("K8S_REQUEST_LOG")
+        self.request_log = RequestLog(request_log_path) if request_log_path else None
+        # hashed n-grams are computed locally, so training on the log and classifying cost no API calls; they score
+        # paraphrases lower than a neural model would, hence the lower similarity threshold
+        self.classifier = SubAgentClassifier.from_log(
+            self.request_log, HashedNgramEmbeddings(),
+            min_similarity=float(os.getenv("K8S_CLASSIFIER_MIN_SIMILARITY", "0.6"))) if self.request_log else None
+        self.llm = DeadlineChatOpenAI(
             temperature=0, model_name=model_name, max_tokens=1024)
+        REGISTRY.add_collector(self.collect_metrics)
 
-    def new_k8s_engineer(self, handlers: List[BaseCallbackHandler], slack_channel: str = None, slack_thread_ts: str = None) -> AgentExecutor: 
-        cm = CallbackManager(handlers=handlers) if handlers else None
-        k8s_engineer_toolkit = K8sEngineerToolkit.from_llm(llm=self.llm, k8s_model=self.k8s_model, git_model=self.git_model, gitlab_model=self.gitlab_model,
-                                                           slack_model=self.slack_model, k8s_sme_model=self.k8s_sme_model, slack_channel=slack_channel, slack_thread_ts=slack_thread_ts, callback_manager=cm,  verbose=True)
-        return create_k8s_engineer_agent(llm=self.llm, toolkit=k8s_engineer_toolkit, callback_manager=cm, verbose=True)
+    def collect_metrics(self) -> List[Family]:
+        """Export the stats the router, the classifier, the model tiers, the tool cache and the SME answer cache keep for themselves."""
+        router = self.router.report()
+        families = [
+            family("k8s_router_requests_total", "counter", "Requests seen by the intent router.", [({}, router["requests"])]),
+            family("k8s_router_intent_hits_total", "counter", "Requests answered by an intent, without the LLM.",
+                   [({"intent": name}, intent["hits"]) for name, intent in router["intents"].items()]),
+            family("k8s_router_intent_fallthroughs_total", "counter", "Requests matching an intent whose handler failed.",
+                   [({"intent": name}, intent["fallthroughs"]) for name, intent in router["intents"].items()]),
+            family("k8s_tool_cache_requests_total", "counter", "Tool result cache lookups.",
+                   [({"result": "hit"}, TOOL_CACHE.hits), ({"result": "miss"}, TOOL_CACHE.misses)]),
+            family("k8s_tool_cache_entries", "gauge", "Entries in the tool result cache.", [({}, len(TOOL_CACHE.entries))]),
+            family("k8s_blocking_pool_queued", "gauge", "Calls waiting for a thread of the blocking pool.",
+                   [({}, BLOCKING_POOL_STATS.queued)]),
+            family("k8s_blocking_pool_active", "gauge", "Calls running on a thread of the blocking pool.",
+                   [({}, BLOCKING_POOL_STATS.active)]),
+        ]
+        with TIER_STATS.lock:
+            families.append(family("k8s_sub_agent_calls_total", "counter", "Sub-agent runs per model tier.",
+                                   [({"agent": agent, "tier": tier}, calls) for (agent, tier), calls in TIER_STATS.calls.items()]))
+            families.append(family("k8s_sub_agent_seconds_total", "counter", "Time spent in sub-agent runs per model tier.",
+                                   [({"agent": agent, "tier": tier}, seconds) for (agent, tier), seconds in TIER_STATS.seconds.items()]))
+            families.append(family("k8s_sub_agent_escalations_total", "counter", "Sub-agent runs escalated to the strong model.",
+                                   [({"agent": agent, "reason": reason}, count) for (agent, reason), count in TIER_STATS.escalations.items()]))
+        answer_cache = self.k8s_sme_model.answer_cache
+        if answer_cache is not None:
+            with answer_cache.lock:
+                families.append(family("k8s_sme_answer_cache_requests_total", "counter", "SME answer cache lookups.",
+                                       [({"result": "hit"}, answer_cache.hits), ({"result": "miss"}, answer_cache.misses)]))
+                families.append(family("k8s_sme_answer_cache_entries", "gauge", "Answers in the SME answer cache.",
+                                       [({}, len(answer_cache.entries))]))
+        if self.classifier is not None:
+            with self.classifier.lock:
+                families.append(family("k8s_classifier_predictions_total", "counter", "Sub-agent classifier predictions.", [
+                    ({"result": "confident"}, self.classifier.confident_predictions),
+                    ({"result": "unsure"}, self.classifier.predictions - self.classifier.confident_predictions)]))
+                families.append(family("k8s_classifier_examples", "gauge", "Requests the classifier has learned from.",
+                                       [({}, len(self.classifier.labels))]))
+        return families
+
+    def new_llm(self, callback_manager: BaseCallbackManager = None, model_name: str = None) -> ChatOpenAI:
+        """Create an LLM that streams its tokens to the request's callback handlers.
+
+        Inside a deadline scope, each of the LLM's requests times out at the deadline.
+        """
+        if callback_manager is None and model_name is None:
+            return self.llm
+        model_name = model_name or self.model_name
+        return DeadlineChatOpenAI(temperature=0, model_name=model_name, max_tokens=1024, streaming=callback_manager is not None,
+                                  callback_manager=model_callback_manager(callback_manager, model_name))
+
+    def new_k8s_engineer(self, handlers: List[BaseCallbackHandler], slack_channel: str = None, slack_thread_ts: str = None, asynchronous: bool = False) -> Chain: 
+        """Create the agent for a request, behind the fast path router for requests that don't need the LLM.
+
+        Set asynchronous when the agent will be run with acall, so the handlers are awaited on the event loop.
+        """
+        cm = new_callback_manager(handlers, asynchronous)
+        if self.agent_mode == "plan":
+            return RoutedChain(router=self.router, agent=self.new_k8s_planner(handlers, asynchronous), callback_manager=cm)
+        llm = self.new_llm(cm)
+        sub_agent_llms = {name: self.new_llm(cm, model_name) for name, model_name in self.sub_agent_models.items()
+                          if model_name and model_name != self.model_name}
+        k8s_engineer_toolkit = K8sEngineerToolkit.from_llm(llm=llm, k8s_model=self.k8s_model, git_model=self.git_model, gitlab_model=self.gitlab_model,
+                                                           slack_model=self.slack_model, k8s_sme_model=self.k8s_sme_model, k8s_async_model=self.k8s_async_model, slack_channel=slack_channel, slack_thread_ts=slack_thread_ts, callback_manager=cm, max_parallel_actions=self.max_parallel_actions, tool_selector=self.tool_selector, sub_agent_llms=sub_agent_llms, verbose=True)
+        agent = create_k8s_engineer_agent(llm=llm, toolkit=k8s_engineer_toolkit, callback_manager=cm, verbose=True)
+        sub_agents = {
+            "k8s_explorer_agent": k8s_engineer_toolkit.k8s_explorer_agent,
+            "gitlab_agent": k8s_engineer_toolkit.gitlab_agent,
+            "k8s_sme_agent": k8s_engineer_toolkit.k8s_sme_agent,
+        }
+        return RoutedChain(router=self.router, agent=agent, classifier=self.classifier, sub_agents=sub_agents,
+                           request_log=self.request_log, callback_manager=cm)
+
+    def new_k8s_planner(self, handlers: List[BaseCallbackHandler], asynchronous: bool = False) -> PlanAndExecuteChain:
+        cm = new_callback_manager(handlers, asynchronous)
+        tools = K8sExplorerToolkit(model=self.k8s_model, async_model=self.k8s_async_model, callback_manager=cm).get_tools() + \
+            KubernetesSMEToolkit(model=self.k8s_sme_model, callback_manager=cm).get_tools()
+        return create_k8s_planner_agent(llm=self.new_llm(cm), tools=tools, callback_manager=cm,
+                                        max_parallel_tools=max(self.max_parallel_actions, 4), verbose=True)
+
+
+def new_callback_manager(handlers: List[BaseCallbackHandler], asynchronous: bool = False) -> BaseCallbackManager:
+    """Callback manager for a request's handlers, plus the handlers recording its metrics and its trace."""
+    handlers = list(handlers or [])
+    run = current_run_metrics()
+    if run is not None:
+        handlers.append(run.handler(asynchronous))
+    tracer = current_tracer()
+    if tracer is not None:
+        handlers.append(tracer.handler(asynchronous))
+    if not handlers:
+        return None
+    if asynchronous:
+        return AsyncCallbackManager(handlers=handlers)
+    return CallbackManager(handlers=handlers)
+
+
+class ModelCallbackManager(CallbackManager):
+    """Callback manager of one LLM, reporting its model to on_llm_start instead of the LLM's class name."""
+    model_name: str
+
+    def __init__(self, handlers: List[BaseCallbackHandler], model_name: str):
+        super().__init__(handlers)
+        self.model_name = model_name
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        super().on_llm_start({**serialized, "name": self.model_name}, prompts, **kwargs)
+
+
+class AsyncModelCallbackManager(AsyncCallbackManager):
+    """Async version of ModelCallbackManager."""
+    model_name: str
+
+    def __init__(self, handlers: List[BaseCallbackHandler], model_name: str):
+        super().__init__(handlers)
+        self.model_name = model_name
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        await super().on_llm_start({**serialized, "name": self.model_name}, prompts, **kwargs)
+
+
+def model_callback_manager(callback_manager: BaseCallbackManager, model_name: str) -> BaseCallbackManager:
+    """The request's callback manager for an LLM of model_name, so metrics and traces are labelled with the model.
+
+    It shares the request's handlers, rather than copying them.
+    """
+    if callback_manager is None:
+        return None
+    if isinstance(callback_manager, AsyncCallbackManager):
+        return AsyncModelCallbackManager(callback_manager.handlers, model_name)
+    return ModelCallbackManager(callback_manager.handlers, model_name)
 
 
 def gcp_token(*scopes):
@@ -81,6 +256,23 @@ def kubernetes_api(cluster):
     return api
 
 
+def kubernetes_async_configuration(cluster):
+    """Configuration for the kubernetes_asyncio client. All conversations share one pool of at most K8S_CONNECTION_POOL_SIZE connections."""
+    config = async_client.Configuration()
+    config.host = f'https://{cluster["endpoint"]}'
+
+    config.api_key_prefix['authorization'] = 'Bearer'
+    config.api_key['authorization'] = gcp_token('cloud-platform')
+
+    with NamedTemporaryFile(delete=False) as cert:
+        cert.write(base64.decodebytes(
+            cluster['masterAuth']['clusterCaCertificate'].encode()))
+        config.ssl_ca_cert = cert.name
+
+    config.connection_pool_maxsize = int(os.getenv("K8S_CONNECTION_POOL_SIZE", "32"))
+    return config
+
+
 def get_cluster():
     project_id = os.getenv("GOOGLE_PROJECT_ID")
     zone = os.getenv("GOOGLE_REGION")
@@ -0,0 +1,514 @@
+"""Process wide metrics, served in the Prometheus text exposition format.
+
+Counters, gauges and histograms keep one cell per thread, so recording a value never waits on a lock held by
+another worker; the cells are summed when the metrics are scraped. Stats kept elsewhere, like the router's
+or the tool cache's, are exported by collectors that read them at scrape time.
+"""
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.schema import AgentAction, AgentFinish, LLMResult
+
+from tools.aio import task_scope
+
+# a family is (name, type, help, [(labels, value)]), histogram families use the sample name suffixes in the labels' "__suffix__"
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+TOKEN_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+class Metric:
+    """A metric with a fixed set of label names. Each distinct set of label values gets its own child."""
+    name: str
+    help: str
+    type: str
+    labelnames: Tuple[str, ...]
+    children: Dict[Tuple[str, ...], Any]
+    lock: threading.Lock
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values: Any) -> Any:
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {key}")
+            with self.lock:
+                child = self.children.setdefault(key, self.new_child())
+        return child
+
+    def new_child(self) -> Any:
+        raise NotImplementedError
+
+    def samples(self) -> List[Tuple[Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def collect(self) -> Family:
+        return self.name, self.type, self.help, self.samples()
+
+
+class ShardedValue:
+    """A float that each thread adds to its own cell. Only the owning thread writes a cell, so adding takes no lock.
+
+    The cells of finished threads are folded into retired when the value is read, since the slack listener
+    starts a thread per message.
+    """
+    cells: List[Tuple[threading.Thread, List[float]]]
+    retired: float
+    local: threading.local
+    lock: threading.Lock
+
+    def __init__(self):
+        self.cells = []
+        self.retired = 0.0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def add(self, amount: float):
+        cell = getattr(self.local, "cell", None)
+        if cell is None:
+            cell = self.local.cell = [0.0]
+            with self.lock:
+                self.cells.append((threading.current_thread(), cell))
+        cell[0] += amount
+
+    def value(self) -> float:
+        with self.lock:
+            self.retired += sum(cell[0] for thread, cell in self.cells if not thread.is_alive())
+            self.cells = [(thread, cell) for thread, cell in self.cells if thread.is_alive()]
+            return self.retired + sum(cell[0] for _, cell in self.cells)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def new_child(self) -> ShardedValue:
+        return ShardedValue()
+
+    def inc(self, amount: float = 1.0):
+        """Increment the counter without labels."""
+        self.labels().add(amount)
+
+    def samples(self) -> List[Tuple[Dict[str, str], float]]:
+        return [(dict(zip(self.labelnames, key)), child.value()) for key, child in list(self.children.items())]
+
+
+class Gauge(Counter):
+    """A value that goes up and down, like the number of requests in progress."""
+    type = "gauge"
+
+    def dec(self, amount: float = 1.0):
+        self.labels().add(-amount)
+
+
+class HistogramShard:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class HistogramChild:
+    """The buckets of one histogram child, sharded per thread like ShardedValue."""
+    bounds: Tuple[float, ...]
+    shards: List[Tuple[threading.Thread, HistogramShard]]
+    retired: HistogramShard
+    local: threading.local
+    lock: threading.Lock
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.shards = []
+        self.retired = HistogramShard(len(bounds) + 1)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.local.shard = HistogramShard(len(self.bounds) + 1)
+            with self.lock:
+                self.shards.append((threading.current_thread(), shard))
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        shard.buckets[i] += 1
+        shard.sum += value
+        shard.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self.lock:
+            for thread, shard in self.shards:
+                if not thread.is_alive():
+                    add_shard(self.retired, shard)
+            self.shards = [(thread, shard) for thread, shard in self.shards if thread.is_alive()]
+            total = HistogramShard(len(self.bounds) + 1)
+            for shard in [self.retired] + [shard for _, shard in self.shards]:
+                add_shard(total, shard)
+        return total.buckets, total.sum, total.count
+
+
+def add_shard(into: HistogramShard, shard: HistogramShard):
+    for i, n in enumerate(shard.buckets):
+        into.buckets[i] += n
+    into.sum += shard.sum
+    into.count += shard.count
+
+
+class Histogram(Metric):
+    type = "histogram"
+    buckets: Tuple[float, ...]
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        """Observe a value on the histogram without labels."""
+        self.labels().observe(value)
+
+    def samples(self) -> List[Tuple[Dict[str, str], float]]:
+        samples = []
+        for key, child in list(self.children.items()):
+            labels = dict(zip(self.labelnames, key))
+            buckets, total, count = child.snapshot()
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), buckets):
+                cumulative += n
+                samples.append(({**labels, "le": format_value(bound), "__suffix__": "_bucket"}, cumulative))
+            samples.append(({**labels, "__suffix__": "_sum"}, total))
+            samples.append(({**labels, "__suffix__": "_count"}, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Holds the process's metrics and collectors, and renders them for a scrape."""
+    metrics: Dict[str, Metric]
+    collectors: List[Callable[[], Iterable[Family]]]
+    lock: threading.Lock
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """Add the metric, or return the one already registered under its name."""
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]):
+        """Add a function returning metric families, called on every scrape."""
+        with self.lock:
+            self.collectors.append(collector)
+
+    def collect(self) -> List[Family]:
+        with self.lock:
+            metrics, collectors = list(self.metrics.values()), list(self.collectors)
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        return families
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, type, help, samples in self.collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for labels, value in samples:
+                labels = dict(labels)
+                suffix = labels.pop("__suffix__", "")
+                lines.append(f"{name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def family(name: str, type: str, help: str, samples: Iterable[Tuple[Dict[str, str], float]]) -> Family:
+    return name, type, help, list(samples)
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram("k8s_request_duration_seconds", "Time to answer a request.", ["listener"])
+REQUESTS_IN_PROGRESS = REGISTRY.gauge("k8s_requests_in_progress", "Requests being answered.", ["listener"])
+REQUESTS_QUEUED = REGISTRY.gauge("k8s_requests_queued", "Requests waiting for a free worker.", ["listener"])
+REQUEST_ERRORS = REGISTRY.counter("k8s_request_errors_total", "Requests that failed with an exception.", ["listener"])
+RUN_LLM_CALLS = REGISTRY.histogram("k8s_run_llm_calls", "LLM calls made to answer one request.", ["listener"], COUNT_BUCKETS)
+RUN_LLM_TOKENS = REGISTRY.histogram("k8s_run_llm_tokens", "LLM tokens used to answer one request.", ["listener"], TOKEN_BUCKETS)
+LLM_CALLS = REGISTRY.counter("k8s_llm_calls_total", "LLM calls.", ["model"])
+LLM_TOKENS = REGISTRY.counter("k8s_llm_tokens_total", "LLM tokens, by prompt and completion.", ["model", "type"])
+LLM_SECONDS = REGISTRY.histogram("k8s_llm_duration_seconds", "LLM call latency.", ["model"])
+TOOL_SECONDS = REGISTRY.histogram("k8s_tool_duration_seconds", "Tool call latency, including observations reused from the run memo.", ["tool"])
+TOOL_ERRORS = REGISTRY.counter("k8s_tool_errors_total", "Tool calls whose observation is an error.", ["tool"])
+APISERVER_REQUESTS = REGISTRY.counter("k8s_apiserver_requests_total", "Kubernetes apiserver requests.", ["verb", "resource", "code"])
+APISERVER_SECONDS = REGISTRY.histogram("k8s_apiserver_request_duration_seconds", "Kubernetes apiserver request latency.", ["verb", "resource"])
+GITLAB_REQUESTS = REGISTRY.counter("k8s_gitlab_requests_total", "GitLab API requests.", ["verb", "code"])
+GITLAB_SECONDS = REGISTRY.histogram("k8s_gitlab_request_duration_seconds", "GitLab API request latency.", ["verb"])
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+    registry: MetricsRegistry
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    server: MetricsServer
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any):
+        # scrapes every few seconds would drown the listener's output
+        pass
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None, registry: MetricsRegistry = REGISTRY) -> Optional[MetricsServer]:
+    """Serve /metrics on a daemon thread. The port defaults to K8S_METRICS_PORT; without one, nothing is served."""
+    port = port or int(os.getenv("K8S_METRICS_PORT", "0"))
+    if not port:
+        return None
+    server = MetricsServer((host or os.getenv("K8S_METRICS_HOST", "127.0.0.1"), port), MetricsHandler)
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+class RunMetrics:
+    """LLM usage of one request, counted by its callback handler and observed when the request ends."""
+    listener: str
+    llm_calls: int
+    tokens: int
+    starts: Dict[int, Tuple[float, str, int]]
+    lock: threading.Lock
+
+    def __init__(self, listener: str):
+        self.listener = listener
+        self.llm_calls = 0
+        self.tokens = 0
+        self.starts = {}
+        self.lock = threading.Lock()
+
+    def handler(self, asynchronous: bool = False) -> BaseCallbackHandler:
+        return AsyncMetricsCallbackHandler(self) if asynchronous else MetricsCallbackHandler(self)
+
+    def llm_start(self, model: str, prompts: List[str]):
+        with self.lock:
+            self.llm_calls += 1
+            self.starts[task_scope()] = (time.perf_counter(), model, sum(len(prompt) for prompt in prompts))
+        LLM_CALLS.labels(model).add(1)
+
+    def llm_end(self, response: Optional[LLMResult] = None):
+        with self.lock:
+            start, model, prompt_chars = self.starts.pop(task_scope(), (None, "unknown", 0))
+        if start is not None:
+            LLM_SECONDS.labels(model).observe(time.perf_counter() - start)
+        if response is None:
+            return
+        # streaming completions don't report token usage, so fall back to an estimate of ~4 characters per token
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or prompt_chars // 4
+        completion_tokens = usage.get("completion_tokens") or sum(
+            len(generation.text) // 4 for generations in response.generations for generation in generations)
+        LLM_TOKENS.labels(model, "prompt").add(prompt_tokens)
+        LLM_TOKENS.labels(model, "completion").add(completion_tokens)
+        with self.lock:
+            self.tokens += prompt_tokens + completion_tokens
+
+
+_run_metrics: contextvars.ContextVar[Optional[RunMetrics]] = contextvars.ContextVar("run_metrics", default=None)
+
+
+def current_run_metrics() -> Optional[RunMetrics]:
+    return _run_metrics.get()
+
+
+@contextmanager
+def measure_request(listener: str) -> Iterator[RunMetrics]:
+    """Count the request as in progress, and record its latency and LLM usage when it ends."""
+    run = RunMetrics(listener)
+    token = _run_metrics.set(run)
+    REQUESTS_IN_PROGRESS.labels(listener).add(1)
+    start = time.perf_counter()
+    try:
+        yield run
+    except BaseException:
+        REQUEST_ERRORS.labels(listener).add(1)
+        raise
+    finally:
+        REQUESTS_IN_PROGRESS.labels(listener).add(-1)
+        REQUEST_SECONDS.labels(listener).observe(time.perf_counter() - start)
+        RUN_LLM_CALLS.labels(listener).observe(run.llm_calls)
+        RUN_LLM_TOKENS.labels(listener).observe(run.tokens)
+        _run_metrics.reset(token)
+
+
+@contextmanager
+def queued(listener: str) -> Iterator[None]:
+    """Count a request as waiting for a worker while inside the block."""
+    REQUESTS_QUEUED.labels(listener).add(1)
+    try:
+        yield
+    finally:
+        REQUESTS_QUEUED.labels(listener).add(-1)
+
+
+def observe_tool(tool_name: str, seconds: float, observation: Any):
+    TOOL_SECONDS.labels(tool_name).observe(seconds)
+    if isinstance(observation, str) and observation.startswith("Error"):
+        TOOL_ERRORS.labels(tool_name).add(1)
+
+
+def apiserver_resource(path: str) -> str:
+    """The resource type an apiserver path is about, e.g. pods for /api/v1/namespaces/default/pods/web."""
+    parts = [part for part in path.split("/") if part]
+    # /api/v1/... or /apis/<group>/<version>/...
+    parts = parts[2:] if parts[:1] == ["api"] else parts[3:]
+    if len(parts) > 2 and parts[0] == "namespaces":
+        parts = parts[2:]
+    if not parts:
+        return "unknown"
+    # subresources like pods/log
+    return f"{parts[0]}/{parts[2]}" if len(parts) > 2 else parts[0]
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Counts the LLM calls of a request into its RunMetrics."""
+    run: RunMetrics
+
+    def __init__(self, run: RunMetrics):
+        self.run = run
+
+    @property
+    def always_verbose(self) -> bool:
+        return True
+
+    @property
+    def ignore_chain(self) -> bool:
+        return True
+
+    @property
+    def ignore_agent(self) -> bool:
+        return True
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> Any:
+        self.run.llm_start(serialized.get("name", "llm"), prompts)
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> Any:
+        """Run on new LLM token. Only available when streaming is enabled."""
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+        self.run.llm_end(response)
+
+    def on_llm_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> Any:
+        self.run.llm_end()
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any) -> Any:
+        """Run when chain starts running."""
+
+    def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> Any:
+        """Run when chain ends running."""
+
+    def on_chain_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> Any:
+        """Run when chain errors."""
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> Any:
+        """Run when tool starts running."""
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> Any:
+        """Run when tool ends running."""
+
+    def on_tool_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> Any:
+        """Run when tool errors."""
+
+    def on_text(self, text: str, **kwargs: Any) -> Any:
+        """Run on arbitrary text."""
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
+        """Run on agent action."""
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> Any:
+        """Run on agent end."""
+
+
+class AsyncMetricsCallbackHandler(AsyncCallbackHandler):
+    """Async version of MetricsCallbackHandler, so the events of concurrent LLM calls keep their task scope."""
+    run: RunMetrics
+
+    def __init__(self, run: RunMetrics):
+        self.run = run
+
+    @property
+    def always_verbose(self) -> bool:
+        return True
+
+    @property
+    def ignore_chain(self) -> bool:
+        return True
+
+    @property
+    def ignore_agent(self) -> bool:
+        return True
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self.run.llm_start(serialized.get("name", "llm"), prompts)
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.run.llm_end(response)
+
+    async def on_llm_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        self.run.llm_end()
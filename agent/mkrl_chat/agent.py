@@ -1,4 +1,5 @@
-from typing import List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from langchain.agents.agent import AgentOutputParser
 from langchain.agents.mrkl.base import ZeroShotAgent
 from langchain.agents.tools import Tool
 from langchain.callbacks.base import BaseCallbackManager
@@ -7,9 +8,59 @@ from langchain.llms.base import BaseLLM
 from langchain.prompts import PromptTemplate, ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 from langchain.tools.base import BaseTool
 from langchain.agents.mrkl.prompt import FORMAT_INSTRUCTIONS, PREFIX, SUFFIX
+from langchain.schema import AgentAction
+from pydantic import Field, PrivateAttr
+
+from agent.mkrl_chat.output_parser import MultiActionOutputParser
+from agent.mkrl_chat.prompt import MULTI_ACTION_FORMAT_INSTRUCTIONS
+from agent.mkrl_chat.scratchpad import ScratchpadManager
+from agent.mkrl_chat.tool_selection import ToolSelector
+from tools.aio import run_blocking
 
 
 class ZeroShotChatAgent(ZeroShotAgent):
+    scratchpad_manager: Optional[ScratchpadManager] = Field(default_factory=ScratchpadManager)
+    # when set, each request only sees the tools the selector picks for it, instead of every tool
+    tool_selector: Optional[ToolSelector] = None
+    tools: List[BaseTool] = []
+    prompt_kwargs: Dict[str, str] = {}
+    _chains: Dict[Tuple[str, ...], LLMChain] = PrivateAttr(default_factory=dict)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def plan(self, intermediate_steps: List[Tuple[AgentAction, str]], **kwargs: Any):
+        """Decide what to do, using the prompt for the tool subset selected for this input."""
+        if self.tool_selector is None or not self.tools:
+            return super().plan(intermediate_steps, **kwargs)
+        llm_chain = self.selected_chain(self.tool_selector.select(kwargs["input"], self.tools))
+        full_inputs = self.get_full_inputs(intermediate_steps, **kwargs)
+        return self.output_parser.parse(llm_chain.predict(**full_inputs))
+
+    async def aplan(self, intermediate_steps: List[Tuple[AgentAction, str]], **kwargs: Any):
+        """Async version of plan. Tool selection embeds the request, so it runs off the event loop."""
+        if self.tool_selector is None or not self.tools:
+            return await super().aplan(intermediate_steps, **kwargs)
+        selection = await run_blocking(self.tool_selector.select, kwargs["input"], self.tools)
+        llm_chain = self.selected_chain(selection)
+        full_inputs = self.get_full_inputs(intermediate_steps, **kwargs)
+        return self.output_parser.parse(await llm_chain.apredict(**full_inputs))
+
+    def selected_chain(self, selection: Tuple[str, ...]) -> LLMChain:
+        """Return the LLMChain prompting with only the selected tools."""
+        llm_chain = self._chains.get(selection)
+        if llm_chain is None:
+            prompt = self.tool_selector.prompt(self.create_chat_prompt, self.tools, selection, **self.prompt_kwargs)
+            llm_chain = LLMChain(llm=self.llm_chain.llm, prompt=prompt, callback_manager=self.llm_chain.callback_manager)
+            self._chains[selection] = llm_chain
+        return llm_chain
+
+    def get_full_inputs(self, intermediate_steps: List[Tuple[AgentAction, str]], **kwargs: Any) -> Dict[str, Any]:
+        """Create the full inputs for the LLMChain, compacting old observations to stay under the token budget."""
+        if self.scratchpad_manager is not None:
+            intermediate_steps = self.scratchpad_manager.compact(intermediate_steps)
+        return super().get_full_inputs(intermediate_steps, **kwargs)
+
     @classmethod
     def create_chat_prompt(
         cls,
@@ -41,4 +92,42 @@ class ZeroShotChatAgent(ZeroShotAgent):
             input_variables = ["input", "agent_scratchpad"]
             return ChatPromptTemplate.from_messages(
                 [system_message_template, human_message_template],
-            )
\ No newline at end of file
+            )
+
+
+class MultiActionZeroShotChatAgent(ZeroShotChatAgent):
+    """ZeroShotChatAgent that may emit several independent actions in one step.
+
+    Use with ParallelAgentExecutor so the actions run concurrently.
+    """
+    output_parser: AgentOutputParser = Field(default_factory=MultiActionOutputParser)
+
+    @classmethod
+    def _get_default_output_parser(cls, **kwargs) -> AgentOutputParser:
+        return MultiActionOutputParser()
+
+    @classmethod
+    def create_chat_prompt(cls, tools: Sequence[BaseTool], prefix: str = PREFIX, suffix: str = SUFFIX,
+                           format_instructions: str = MULTI_ACTION_FORMAT_INSTRUCTIONS,
+                           input_variables: Optional[List[str]] = None) -> ChatPromptTemplate:
+        return super().create_chat_prompt(tools=tools, prefix=prefix, suffix=suffix,
+                                          format_instructions=format_instructions, input_variables=input_variables)
+
+    def _construct_scratchpad(self, intermediate_steps: List[Tuple[AgentAction, str]]) -> str:
+        """Construct the scratchpad, writing the actions of one step once followed by their numbered observations."""
+        thoughts = ""
+        i = 0
+        while i < len(intermediate_steps):
+            action, observation = intermediate_steps[i]
+            group = [(action, observation)]
+            while i + len(group) < len(intermediate_steps) and intermediate_steps[i + len(group)][0].log == action.log:
+                group.append(intermediate_steps[i + len(group)])
+            thoughts += action.log
+            if len(group) == 1:
+                thoughts += f"\n{self.observation_prefix}{observation}\n{self.llm_prefix}"
+            else:
+                for n, (grouped_action, grouped_observation) in enumerate(group, start=1):
+                    thoughts += f"\nObservation {n} ({grouped_action.tool}): {grouped_observation}"
+                thoughts += f"\n{self.llm_prefix}"
+            i += len(group)
+        return thoughts
@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+from langchain.agents.tools import InvalidTool
+from langchain.schema import AgentAction, AgentFinish
+from langchain.tools.base import BaseTool
+
+from agent.run_memo import MemoizedAgentExecutor
+from tools.aio import emit, enter_task_scope, in_task_scope
+
+
+class ParallelAgentExecutor(MemoizedAgentExecutor):
+    """AgentExecutor that runs the actions of a multi action step concurrently.
+
+    Observations are returned together, in the order the model emitted the actions.
+    """
+    max_parallel_actions: int = 4
+
+    def _take_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+    ) -> Union[AgentFinish, List[Tuple[AgentAction, str]]]:
+        output = self.agent.plan(intermediate_steps, **inputs)
+        if isinstance(output, AgentFinish):
+            return output
+        actions = [output] if isinstance(output, AgentAction) else output
+        for agent_action in actions:
+            self.callback_manager.on_agent_action(agent_action, verbose=self.verbose, color="green")
+        if len(actions) == 1:
+            return [(actions[0], self._run_action(actions[0], name_to_tool_map, color_mapping))]
+        # each action runs in a copy of this context, so the run memo and other context state is shared
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel_actions, len(actions))) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, in_task_scope, self._run_action, agent_action, name_to_tool_map, color_mapping)
+                       for agent_action in actions]
+            return [(agent_action, future.result()) for agent_action, future in zip(actions, futures)]
+
+    def _run_action(self, agent_action: AgentAction, name_to_tool_map: Dict[str, BaseTool], color_mapping: Dict[str, str]) -> str:
+        """Run a single action and return its observation."""
+        tool_run_kwargs = self.agent.tool_run_logging_kwargs()
+        if agent_action.tool not in name_to_tool_map:
+            return InvalidTool().run(agent_action.tool, verbose=self.verbose, color=None, **tool_run_kwargs)
+        tool = name_to_tool_map[agent_action.tool]
+        if tool.return_direct:
+            tool_run_kwargs["llm_prefix"] = ""
+        try:
+            return tool.run(agent_action.tool_input, verbose=self.verbose, color=color_mapping[agent_action.tool], **tool_run_kwargs)
+        except Exception as e:
+            # one failed action shouldn't throw away the observations of the others
+            return f"Error: {e}"
+
+    async def _atake_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+    ) -> Union[AgentFinish, List[Tuple[AgentAction, str]]]:
+        output = await self.agent.aplan(intermediate_steps, **inputs)
+        if isinstance(output, AgentFinish):
+            return output
+        actions = [output] if isinstance(output, AgentAction) else output
+        for agent_action in actions:
+            await emit(self.callback_manager, "on_agent_action", agent_action, verbose=self.verbose, color="green")
+        # the actions run as tasks on the loop, at most max_parallel_actions at a time
+        semaphore = asyncio.Semaphore(self.max_parallel_actions)
+
+        async def run(agent_action: AgentAction) -> str:
+            enter_task_scope()
+            async with semaphore:
+                return await self._arun_action(agent_action, name_to_tool_map, color_mapping)
+        observations = await asyncio.gather(*[run(agent_action) for agent_action in actions])
+        return list(zip(actions, observations))
+
+    async def _arun_action(self, agent_action: AgentAction, name_to_tool_map: Dict[str, BaseTool], color_mapping: Dict[str, str]) -> str:
+        """Async version of _run_action."""
+        tool_run_kwargs = self.agent.tool_run_logging_kwargs()
+        if agent_action.tool not in name_to_tool_map:
+            return await InvalidTool().arun(agent_action.tool, verbose=self.verbose, color=None, **tool_run_kwargs)
+        tool = name_to_tool_map[agent_action.tool]
+        if tool.return_direct:
+            tool_run_kwargs["llm_prefix"] = ""
+        try:
+            return await tool.arun(agent_action.tool_input, verbose=self.verbose, color=color_mapping[agent_action.tool], **tool_run_kwargs)
+        except Exception as e:
+            return f"Error: {e}"
@@ -0,0 +1,31 @@
+import re
+from typing import List, Union
+
+from langchain.agents.mrkl.output_parser import FINAL_ANSWER_ACTION, MRKLOutputParser
+from langchain.schema import AgentAction, AgentFinish
+
+MULTI_ACTION_REGEX = r"Action\s*\d*\s*:[\s]*(.*?)[\s]*Action\s*\d*\s*Input\s*\d*\s*:[\s]*(.*?)(?=\n\s*Action\s*\d*\s*:|\n\s*(?:Observation|Thought)\s*:|\Z)"
+
+
+class MultiActionOutputParser(MRKLOutputParser):
+    """Parses one or more Action/Action Input pairs out of a single LLM output.
+
+    Falls back to the single action MRKL parser when the model only emits one action.
+    """
+
+    def parse(self, text: str) -> Union[List[AgentAction], AgentAction, AgentFinish]:
+        if FINAL_ANSWER_ACTION in text:
+            return super().parse(text)
+        actions = []
+        seen = set()
+        for match in re.finditer(MULTI_ACTION_REGEX, text, re.DOTALL):
+            tool = match.group(1).strip()
+            tool_input = match.group(2).strip().strip(" ").strip('"')
+            if (tool, tool_input) in seen:
+                continue
+            seen.add((tool, tool_input))
+            # every action keeps the full output as its log, so the scratchpad can group them again
+            actions.append(AgentAction(tool, tool_input, text))
+        if len(actions) <= 1:
+            return super().parse(text)
+        return actions
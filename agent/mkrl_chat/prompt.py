@@ -0,0 +1,13 @@
+MULTI_ACTION_FORMAT_INSTRUCTIONS = """Use the following format:
+
+Question: the input question you must answer
+Thought: you should always think about what to do
+Action: the action to take, should be one of [{tool_names}]
+Action Input: the input to the action
+Observation: the result of the action
+... (this Thought/Action/Action Input/Observation can repeat N times)
+Thought: I now know the final answer
+Final Answer: the final answer to the original input question
+
+If you need several pieces of information that do not depend on each other, you may list several Action/Action Input pairs one after another before the Observation.
+They will be run at the same time, and their results will come back together as numbered Observations."""
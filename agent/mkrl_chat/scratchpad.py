@@ -0,0 +1,66 @@
+"""Keeps the agent scratchpad under a token budget by digesting old observations."""
+from functools import lru_cache
+from typing import List, Tuple
+
+from langchain.schema import AgentAction
+from pydantic import BaseModel
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # tiktoken is optional, fall back to the usual ~4 characters per token estimate
+    _encoding = None
+
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1024)
+def count_tokens(text: str) -> int:
+    """Count tokens with the local tokenizer. Cached, since the same observations are counted on every iteration."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate(text: str, head_tokens: int, tail_tokens: int) -> str:
+    """Keep the first head_tokens and last tail_tokens of the text."""
+    total = count_tokens(text)
+    if total <= head_tokens + tail_tokens:
+        return text
+    omitted = total - head_tokens - tail_tokens
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        head = _encoding.decode(tokens[:head_tokens])
+        tail = _encoding.decode(tokens[-tail_tokens:]) if tail_tokens else ""
+    else:
+        head = text[:head_tokens * CHARS_PER_TOKEN]
+        tail = text[-tail_tokens * CHARS_PER_TOKEN:] if tail_tokens else ""
+    return f"{head}\n... [{omitted} tokens omitted from this earlier observation] ...\n{tail}"
+
+
+class ScratchpadManager(BaseModel):
+    """Compacts intermediate steps before they are written into the scratchpad.
+
+    The most recent observations are kept verbatim. Older ones are replaced by digests, oldest first,
+    until the observations fit in max_tokens.
+    """
+    max_tokens: int = 3000
+    keep_recent: int = 2
+    digest_head_tokens: int = 120
+    digest_tail_tokens: int = 40
+
+    def compact(self, intermediate_steps: List[Tuple[AgentAction, str]]) -> List[Tuple[AgentAction, str]]:
+        counts = [count_tokens(str(observation)) for _, observation in intermediate_steps]
+        total = sum(counts)
+        if total <= self.max_tokens:
+            return intermediate_steps
+        steps = list(intermediate_steps)
+        for i in range(max(len(steps) - self.keep_recent, 0)):
+            if total <= self.max_tokens:
+                break
+            action, observation = steps[i]
+            digest = truncate(str(observation), self.digest_head_tokens, self.digest_tail_tokens)
+            total += count_tokens(digest) - counts[i]
+            steps[i] = (action, digest)
+        return steps
@@ -0,0 +1,75 @@
+"""Per-request selection of the tools shown to the agent, so system prompts only describe relevant tools."""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.prompts import ChatPromptTemplate
+from langchain.tools.base import BaseTool
+
+
+class ToolSelector:
+    """Ranks tools by the similarity of their descriptions to the request.
+
+    Description embeddings are computed once per description and shared across requests,
+    and prompt templates are cached per tool subset, so selecting a prompt does no formatting.
+    """
+    embeddings: Embeddings
+    k: int
+    mandatory_tools: List[str]
+    vectors: Dict[str, np.ndarray]
+    selections: "OrderedDict[Tuple[str, Tuple[str, ...]], Tuple[str, ...]]"
+    prompts: Dict[Tuple[Any, ...], ChatPromptTemplate]
+    max_cached_selections: int
+    lock: threading.Lock
+
+    def __init__(self, embeddings: Embeddings, k: int = 4, mandatory_tools: List[str] = None, max_cached_selections: int = 256):
+        self.embeddings = embeddings
+        self.k = k
+        self.mandatory_tools = mandatory_tools or []
+        self.vectors = {}
+        self.selections = OrderedDict()
+        self.prompts = {}
+        self.max_cached_selections = max_cached_selections
+        self.lock = threading.Lock()
+
+    def index(self, tools: Sequence[BaseTool]):
+        """Embed the descriptions of any tools that haven't been seen yet, in one batch."""
+        missing = [tool.description for tool in tools if tool.description not in self.vectors]
+        if not missing:
+            return
+        for description, vector in zip(missing, self.embeddings.embed_documents(missing)):
+            vector = np.asarray(vector, dtype=np.float32)
+            self.vectors[description] = vector / (np.linalg.norm(vector) or 1.0)
+
+    def select(self, query: str, tools: Sequence[BaseTool]) -> Tuple[str, ...]:
+        """Return the names of the mandatory tools plus the top k most relevant ones, in toolkit order."""
+        names = tuple(tool.name for tool in tools)
+        if len(tools) <= self.k:
+            return names
+        key = (query, names)
+        with self.lock:
+            if key in self.selections:
+                self.selections.move_to_end(key)
+                return self.selections[key]
+        self.index(tools)
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        matrix = np.stack([self.vectors[tool.description] for tool in tools])
+        ranked = np.argsort(-(matrix @ query_vector))[:self.k]
+        chosen = set(names[i] for i in ranked) | set(self.mandatory_tools)
+        selection = tuple(name for name in names if name in chosen)
+        with self.lock:
+            self.selections[key] = selection
+            while len(self.selections) > self.max_cached_selections:
+                self.selections.popitem(last=False)
+        return selection
+
+    def prompt(self, create_prompt: Callable[..., ChatPromptTemplate], tools: Sequence[BaseTool], selection: Tuple[str, ...], **prompt_kwargs: str) -> ChatPromptTemplate:
+        """Return the cached prompt template for the tool subset, building it on first use."""
+        key = (create_prompt, selection) + tuple(sorted(prompt_kwargs.items()))
+        prompt = self.prompts.get(key)
+        if prompt is None:
+            prompt = create_prompt(tools=[tool for tool in tools if tool.name in selection], **prompt_kwargs)
+            self.prompts[key] = prompt
+        return prompt
@@ -0,0 +1 @@
+"""Plan-and-execute agent: one LLM call plans a DAG of tool calls, which run in parallel, and one LLM call answers."""
\ No newline at end of file
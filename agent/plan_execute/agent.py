@@ -0,0 +1,299 @@
+import asyncio
+import contextvars
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Sequence, Tuple
+
+from langchain.chains.base import Chain
+from langchain.chains.llm import LLMChain
+from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+from langchain.schema import AgentAction, AgentFinish, SystemMessage
+from langchain.tools.base import BaseTool
+from pydantic import BaseModel
+
+from agent.deadline import expired, partial_answer
+from agent.run_memo import run_memo
+from agent.plan_execute.prompt import PLANNER_PREFIX, PLANNER_SUFFIX, REPLAN_CONTEXT, SYNTHESIZER_PREFIX, SYNTHESIZER_SUFFIX
+from tools.aio import emit, enter_task_scope, in_task_scope
+from tools.cache import FAILED_PREFIXES
+
+STEP_REFERENCE_REGEX = r"\{(\w+)\}"
+
+
+class PlanStep(BaseModel):
+    """A single tool call in a plan."""
+    id: str
+    tool: str
+    input: str = "None"
+    depends_on: List[str] = []
+
+    def references(self) -> List[str]:
+        """Return the ids of the steps whose results this step's input uses."""
+        return re.findall(STEP_REFERENCE_REGEX, self.input)
+
+
+class PlanError(Exception):
+    """Raised when the planner output is not a valid plan."""
+
+
+def parse_plan(text: str, tool_names: Sequence[str], known_ids: Sequence[str] = ()) -> List[PlanStep]:
+    """Parse the planner output into steps, validating tools, dependencies and acyclicity."""
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end == -1:
+        raise PlanError(f"Could not find a JSON list in the plan: `{text}`")
+    try:
+        raw_steps = json.loads(text[start:end + 1])
+        steps = [PlanStep(**raw_step) for raw_step in raw_steps]
+    except Exception as e:
+        raise PlanError(f"Could not parse the plan: {e}")
+    ids = set(known_ids)
+    for step in steps:
+        if step.tool not in tool_names:
+            raise PlanError(f"Step {step.id} uses unknown tool {step.tool}")
+        if step.id in ids:
+            raise PlanError(f"Duplicate step id {step.id}")
+        ids.add(step.id)
+        step.input = str(step.input)
+        step.depends_on = list(dict.fromkeys(step.depends_on + step.references()))
+    for step in steps:
+        missing = [dependency for dependency in step.depends_on if dependency not in ids]
+        if missing:
+            raise PlanError(f"Step {step.id} depends on unknown steps {missing}")
+    # steps only ever reference known ids, so the plan is acyclic iff it can be topologically ordered
+    resolved = set(known_ids)
+    pending = list(steps)
+    while pending:
+        ready = [step for step in pending if all(dependency in resolved for dependency in step.depends_on)]
+        if not ready:
+            raise PlanError(f"The plan has a dependency cycle between {[step.id for step in pending]}")
+        resolved.update(step.id for step in ready)
+        pending = [step for step in pending if step not in ready]
+    return steps
+
+
+class PlanExecutor(BaseModel):
+    """Deterministically runs a plan, starting every step as soon as its dependencies have succeeded."""
+    tools: Dict[str, BaseTool]
+    max_workers: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def run(self, steps: List[PlanStep], results: Dict[str, str], on_step=None) -> Dict[str, str]:
+        """Run the steps and return the observations of the failed ones.
+
+        Successful observations are added to results. Steps depending on a failed step are not run.
+        """
+        failed: Dict[str, str] = {}
+        pending = list(steps)
+        running: Dict[Future, PlanStep] = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for step, tool_input in self.ready_steps(pending, results, failed):
+                    if on_step is not None:
+                        on_step(step, tool_input)
+                    running[pool.submit(contextvars.copy_context().run, in_task_scope, self.run_step, step.tool, tool_input)] = step
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    ok, observation = future.result()
+                    if ok:
+                        results[step.id] = observation
+                    else:
+                        failed[step.id] = observation
+        return failed
+
+    async def arun(self, steps: List[PlanStep], results: Dict[str, str], on_step=None) -> Dict[str, str]:
+        """Async version of run. Steps run as tasks on the loop, at most max_workers at a time, and on_step is awaited."""
+        failed: Dict[str, str] = {}
+        pending = list(steps)
+        running: Dict[asyncio.Task, PlanStep] = {}
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def run_step(tool_name: str, tool_input: str) -> Tuple[bool, str]:
+            enter_task_scope()
+            async with semaphore:
+                return await self.arun_step(tool_name, tool_input)
+        while pending or running:
+            for step, tool_input in self.ready_steps(pending, results, failed):
+                if on_step is not None:
+                    await on_step(step, tool_input)
+                running[asyncio.ensure_future(run_step(step.tool, tool_input))] = step
+            if not running:
+                break
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                step = running.pop(task)
+                ok, observation = task.result()
+                if ok:
+                    results[step.id] = observation
+                else:
+                    failed[step.id] = observation
+        return failed
+
+    def ready_steps(self, pending: List[PlanStep], results: Dict[str, str], failed: Dict[str, str]) -> List[Tuple[PlanStep, str]]:
+        """Remove the steps that can start from pending, and return them with their resolved inputs.
+
+        Steps depending on a failed step are removed too, and recorded as failed.
+        """
+        for step in [step for step in pending if any(dependency in failed for dependency in step.depends_on)]:
+            failed[step.id] = "Skipped because a step it depends on failed."
+            pending.remove(step)
+        ready = []
+        for step in [step for step in pending if all(dependency in results for dependency in step.depends_on)]:
+            pending.remove(step)
+            tool_input = re.sub(STEP_REFERENCE_REGEX, lambda m: results.get(m.group(1), m.group(0)).strip(), step.input)
+            ready.append((step, tool_input))
+        return ready
+
+    def run_step(self, tool_name: str, tool_input: str) -> Tuple[bool, str]:
+        try:
+            observation = self.tools[tool_name].run(tool_input)
+        except Exception as e:
+            return False, f"Error: {e}"
+        return step_result(observation)
+
+    async def arun_step(self, tool_name: str, tool_input: str) -> Tuple[bool, str]:
+        try:
+            observation = await self.tools[tool_name].arun(tool_input)
+        except Exception as e:
+            return False, f"Error: {e}"
+        return step_result(observation)
+
+
+def step_result(observation: str) -> Tuple[bool, str]:
+    # the tools in this repo report failures as observations rather than raising
+    return not observation.startswith(FAILED_PREFIXES), observation
+
+
+class PlanAndExecuteChain(Chain):
+    """Answers a question with one planning LLM call, a parallel tool run, and one answering LLM call.
+
+    The planner is only called again when steps fail, at most max_replans times.
+    Past the request's deadline it stops replanning, and answers with the results it has without the LLM.
+    """
+    planner_chain: LLMChain
+    synthesizer_chain: LLMChain
+    executor: PlanExecutor
+    max_replans: int = 1
+    input_key: str = "input"
+    output_key: str = "output"
+
+    @property
+    def input_keys(self) -> List[str]:
+        return [self.input_key]
+
+    @property
+    def output_keys(self) -> List[str]:
+        return [self.output_key]
+
+    def _call(self, inputs: Dict[str, str]) -> Dict[str, Any]:
+        with run_memo():
+            return self._plan_and_execute(inputs[self.input_key])
+
+    async def _acall(self, inputs: Dict[str, str]) -> Dict[str, Any]:
+        with run_memo():
+            return await self._aplan_and_execute(inputs[self.input_key])
+
+    def _plan_and_execute(self, question: str) -> Dict[str, Any]:
+        steps: Dict[str, PlanStep] = {}
+        results: Dict[str, str] = {}
+        failed: Dict[str, str] = {}
+        for attempt in range(self.max_replans + 1):
+            replan_context = ""
+            if attempt > 0 and expired():
+                break
+            if attempt > 0:
+                replan_context = REPLAN_CONTEXT.format(
+                    completed=format_results(steps, results) or "None",
+                    failed=format_results(steps, failed) or "None")
+            plan_output = self.planner_chain.predict(input=question, replan_context=replan_context)
+            try:
+                plan = parse_plan(plan_output, list(self.executor.tools.keys()), known_ids=list(results.keys()))
+            except PlanError as e:
+                failed["plan"] = str(e)
+                continue
+            steps.update({step.id: step for step in plan})
+            failed = self.executor.run(plan, results, on_step=self._on_step)
+            if not failed:
+                break
+        if expired():
+            output = partial_answer([(AgentAction(step.tool, step.input, ""), results[step_id])
+                                     for step_id, step in steps.items() if step_id in results])
+        else:
+            output = self.synthesizer_chain.predict(
+                input=question,
+                results=format_results(steps, {**results, **failed}) or "No tool results.")
+        self.callback_manager.on_agent_finish(
+            AgentFinish({self.output_key: output}, output), color="green", verbose=self.verbose)
+        return {self.output_key: output}
+
+    async def _aplan_and_execute(self, question: str) -> Dict[str, Any]:
+        steps: Dict[str, PlanStep] = {}
+        results: Dict[str, str] = {}
+        failed: Dict[str, str] = {}
+        for attempt in range(self.max_replans + 1):
+            replan_context = ""
+            if attempt > 0 and expired():
+                break
+            if attempt > 0:
+                replan_context = REPLAN_CONTEXT.format(
+                    completed=format_results(steps, results) or "None",
+                    failed=format_results(steps, failed) or "None")
+            plan_output = await self.planner_chain.apredict(input=question, replan_context=replan_context)
+            try:
+                plan = parse_plan(plan_output, list(self.executor.tools.keys()), known_ids=list(results.keys()))
+            except PlanError as e:
+                failed["plan"] = str(e)
+                continue
+            steps.update({step.id: step for step in plan})
+            failed = await self.executor.arun(plan, results, on_step=self._aon_step)
+            if not failed:
+                break
+        if expired():
+            output = partial_answer([(AgentAction(step.tool, step.input, ""), results[step_id])
+                                     for step_id, step in steps.items() if step_id in results])
+        else:
+            output = await self.synthesizer_chain.apredict(
+                input=question,
+                results=format_results(steps, {**results, **failed}) or "No tool results.")
+        await emit(self.callback_manager, "on_agent_finish",
+                   AgentFinish({self.output_key: output}, output), color="green", verbose=self.verbose)
+        return {self.output_key: output}
+
+    def _on_step(self, step: PlanStep, tool_input: str):
+        action = AgentAction(step.tool, tool_input, f"Step {step.id}: {step.tool} {tool_input}")
+        self.callback_manager.on_agent_action(action, verbose=self.verbose, color="green")
+
+    async def _aon_step(self, step: PlanStep, tool_input: str):
+        action = AgentAction(step.tool, tool_input, f"Step {step.id}: {step.tool} {tool_input}")
+        await emit(self.callback_manager, "on_agent_action", action, verbose=self.verbose, color="green")
+
+    @property
+    def _chain_type(self) -> str:
+        return "plan_and_execute"
+
+
+def format_results(steps: Dict[str, PlanStep], results: Dict[str, str]) -> str:
+    """Format step observations for the planner and synthesizer prompts."""
+    lines = []
+    for step_id, observation in results.items():
+        step = steps.get(step_id)
+        header = f"[{step_id}] {step.tool}({step.input})" if step else f"[{step_id}]"
+        lines.append(f"{header}:\n{observation}")
+    return "\n\n".join(lines)
+
+
+def create_planner_prompt(tools: Sequence[BaseTool], prefix: str = PLANNER_PREFIX, suffix: str = PLANNER_SUFFIX) -> ChatPromptTemplate:
+    """Create the planner prompt. The tool list is formatted once, so descriptions may safely contain braces."""
+    tool_strings = "\n".join([f"{tool.name}: {tool.description}" for tool in tools])
+    tool_names = ", ".join([tool.name for tool in tools])
+    system_message = SystemMessage(content=prefix.format(tool_strings=tool_strings, tool_names=tool_names))
+    return ChatPromptTemplate.from_messages([system_message, HumanMessagePromptTemplate.from_template(suffix)])
+
+
+def create_synthesizer_prompt(prefix: str = SYNTHESIZER_PREFIX, suffix: str = SYNTHESIZER_SUFFIX) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([SystemMessage(content=prefix), HumanMessagePromptTemplate.from_template(suffix)])
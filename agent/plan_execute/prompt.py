@@ -0,0 +1,37 @@
+PLANNER_PREFIX = """You are an agent designed to plan the tool calls needed to answer a question about a Kubernetes cluster.
+
+You have access to the following tools:
+
+{tool_strings}
+
+Do not answer the question. Instead, write a plan: a JSON list of steps, where each step looks like
+{{"id": "s1", "tool": "<one of [{tool_names}]>", "input": "<the tool input>", "depends_on": ["<ids of earlier steps>"]}}
+
+Steps that don't depend on each other will be run at the same time, so only add a dependency when a step needs another step's result.
+To use the result of an earlier step in an input, write its id in curly braces, e.g. "test-bed,{{s1}}". Referenced steps are added to depends_on automatically.
+Only use the exact input format described by each tool. If no input makes sense, use None.
+Output only the JSON list, nothing else.
+"""
+
+PLANNER_SUFFIX = """Question: {input}
+{replan_context}"""
+
+REPLAN_CONTEXT = """A previous plan was run, but some steps failed.
+Steps that already succeeded:
+{completed}
+Steps that failed:
+{failed}
+Write a new plan for the remaining work only. You may reference the ids of steps that already succeeded."""
+
+SYNTHESIZER_PREFIX = """You are an agent designed to do engineering tasks related to Kubernetes on behalf of a user.
+
+Answer the question using only the tool results below. If the results don't contain the answer, say you don't know. Do not make up an answer.
+If you are asked for logs, output the full text of the logs in your answer.
+"""
+
+SYNTHESIZER_SUFFIX = """Question: {input}
+
+Tool results:
+{results}
+
+Answer:"""
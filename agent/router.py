@@ -0,0 +1,269 @@
+"""Deterministic fast path for common read-only requests, answered without calling the LLM."""
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.chains.base import Chain
+from langchain.schema import AgentAction, AgentFinish
+from pydantic import BaseModel
+
+from agent.classifier import RequestLog, SubAgentClassifier
+from agent.toolkits.prompt import CONVERSATION_CONTEXT
+from tools.aio import emit, run_blocking
+from tools.cache import FAILED_PREFIXES
+from tools.k8s_explorer.tool import KubernetesOpsModel, singular_resource_type
+
+NAME = r"[a-z0-9]([-a-z0-9.]*[a-z0-9])?"
+
+
+class Intent(BaseModel):
+    """A request shape the router can answer directly."""
+    name: str
+    pattern: re.Pattern
+    handler: Callable[..., str]
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+class IntentStats:
+    """Hit counts and latency for one intent."""
+    hits: int
+    fallthroughs: int
+    total_seconds: float
+    max_seconds: float
+
+    def __init__(self):
+        self.hits = 0
+        self.fallthroughs = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "fallthroughs": self.fallthroughs,
+            "avg_ms": 1000 * self.total_seconds / self.hits if self.hits else 0.0,
+            "max_ms": 1000 * self.max_seconds,
+        }
+
+
+class IntentRouter:
+    """Matches requests against high confidence intents and answers them from the KubernetesOpsModel.
+
+    Requests that match no intent, or whose handler fails or answers nothing, fall through to the agent.
+    """
+    intents: List[Intent]
+    stats: Dict[str, IntentStats]
+    requests: int
+    lock: threading.Lock
+
+    def __init__(self, intents: List[Intent]):
+        self.intents = intents
+        self.stats = {intent.name: IntentStats() for intent in intents}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_k8s(cls, model: KubernetesOpsModel) -> "IntentRouter":
+        """Create a router for the read-only requests in the README examples."""
+        def resource_type(value: str) -> Optional[str]:
+            return singular_resource_type(value, model.available_resource_types)
+
+        def list_namespaces() -> str:
+            return model.get_namespaces()
+
+        def list_objects(kind: str, namespace: str) -> str:
+            kind = resource_type(kind)
+            if kind is None:
+                return "Invalid resource type"
+            names = model.get_resource_names(namespace, kind)
+            # an empty listing is an answer too, but an empty reply isn't one the user can read
+            return names if names.strip() else f"No {kind}s found in {namespace}."
+
+        def get_object(name: str, kind: str, namespace: str) -> str:
+            kind = resource_type(kind)
+            if kind is None:
+                return "Invalid resource type"
+            return model.get_resource(namespace, kind, name)
+
+        def get_logs(pod: str, namespace: str) -> str:
+            pods = model.get_resource_list(namespace, "pods")
+            if isinstance(pods, str):
+                return pods
+            names = [name for name in model.get_running_pod_names(pods).split(",") if name.startswith(pod)]
+            if not names:
+                return f"No running pod found with name like: {pod}"
+            return model.get_logs(namespace, names[0])
+
+        in_namespace = rf"in (the )?(?P<namespace>{NAME})( namespace)?"
+        return cls([
+            Intent(name="list_namespaces",
+                   pattern=re.compile(r"^(list|get|show)( me)?( all)?( the)? namespaces$"),
+                   handler=list_namespaces),
+            Intent(name="get_logs",
+                   pattern=re.compile(rf"^(get|show)( me)? (the )?logs (for|of) (the )?(pod )?(?P<pod>{NAME}) {in_namespace}$"),
+                   handler=get_logs),
+            Intent(name="list_objects",
+                   pattern=re.compile(rf"^(list|get|show)( me)?( all)?( the)? (?P<kind>[a-z]+) {in_namespace}$"),
+                   handler=list_objects),
+            Intent(name="get_object",
+                   pattern=re.compile(rf"^(get|show)( me)? (the )?(?P<name>{NAME}) (?P<kind>[a-z]+) {in_namespace}$"),
+                   handler=get_object),
+        ])
+
+    def route(self, message: str) -> Optional[str]:
+        """Return the answer for the message, or None if the agent should handle it."""
+        text = normalize_message(message)
+        with self.lock:
+            self.requests += 1
+        for intent in self.intents:
+            match = intent.pattern.match(text)
+            if match is None:
+                continue
+            start = time.perf_counter()
+            try:
+                result = intent.handler(**match.groupdict())
+            except Exception as e:
+                result = f"Error: {e}"
+            elapsed = time.perf_counter() - start
+            stats = self.stats[intent.name]
+            with self.lock:
+                if not isinstance(result, str) or not result.strip() or result.startswith(FAILED_PREFIXES):
+                    stats.fallthroughs += 1
+                    return None
+                stats.hits += 1
+                stats.total_seconds += elapsed
+                stats.max_seconds = max(stats.max_seconds, elapsed)
+            return result
+        return None
+
+    def hit_rate(self) -> float:
+        with self.lock:
+            hits = sum(stats.hits for stats in self.stats.values())
+            return hits / self.requests if self.requests else 0.0
+
+    def report(self) -> Dict[str, Any]:
+        """Return hit rate and per intent counts and latency."""
+        with self.lock:
+            intents = {name: stats.to_dict() for name, stats in self.stats.items()}
+            requests = self.requests
+        return {"requests": requests, "hit_rate": self.hit_rate(), "intents": intents}
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase the message, collapse whitespace and drop trailing punctuation and quotes."""
+    text = " ".join(message.lower().split())
+    return text.strip(" .?!\"'`")
+
+
+class RoutedChain(Chain):
+    """Tries the IntentRouter first, then the sub-agent classifier, and falls through to the agent.
+
+    When the classifier is confident, the request goes straight to the sub-agent, skipping the top-level LLM hop.
+    Requests the agent handles with a single sub-agent are logged and learned from.
+    An optional "conversation" input holds what earlier requests in the conversation established. Routing only
+    looks at the request itself, and the agents get the request with the conversation around it.
+    """
+    router: IntentRouter
+    agent: Chain
+    classifier: Optional[SubAgentClassifier] = None
+    sub_agents: Dict[str, Chain] = {}
+    request_log: Optional[RequestLog] = None
+    conversation_key: str = "conversation"
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def input_keys(self) -> List[str]:
+        return self.agent.input_keys
+
+    @property
+    def output_keys(self) -> List[str]:
+        return self.agent.output_keys
+
+    def _call(self, inputs: Dict[str, str]) -> Dict[str, Any]:
+        message = inputs[self.agent.input_keys[0]]
+        result = self.router.route(message)
+        if result is not None:
+            return self._finish(result)
+        vector = None
+        if self.classifier is not None and self.sub_agents:
+            label, _, vector = self.classifier.predict(message)
+            if label in self.sub_agents:
+                return self._dispatch(label, with_conversation(message, inputs, self.conversation_key))
+        agent_inputs = {**inputs, self.agent.input_keys[0]: with_conversation(message, inputs, self.conversation_key)}
+        agent_inputs.pop(self.conversation_key, None)
+        outputs = self.agent(agent_inputs, return_only_outputs=True)
+        self._learn(message, vector, outputs.get("intermediate_steps"))
+        return outputs
+
+    async def _acall(self, inputs: Dict[str, str]) -> Dict[str, Any]:
+        message = inputs[self.agent.input_keys[0]]
+        # the intents and the classifier use blocking clients, so they run off the event loop
+        result = await run_blocking(self.router.route, message)
+        if result is not None:
+            return await self._afinish(result)
+        vector = None
+        if self.classifier is not None and self.sub_agents:
+            label, _, vector = await run_blocking(self.classifier.predict, message)
+            if label in self.sub_agents:
+                return await self._adispatch(label, with_conversation(message, inputs, self.conversation_key))
+        agent_inputs = {**inputs, self.agent.input_keys[0]: with_conversation(message, inputs, self.conversation_key)}
+        agent_inputs.pop(self.conversation_key, None)
+        outputs = await self.agent.acall(agent_inputs, return_only_outputs=True)
+        await run_blocking(self._learn, message, vector, outputs.get("intermediate_steps"))
+        return outputs
+
+    def _finish(self, result: str, steps: List[Any] = None) -> Dict[str, Any]:
+        self.callback_manager.on_agent_finish(AgentFinish({"output": result}, result), color="green", verbose=self.verbose)
+        outputs = {key: [] for key in self.output_keys}
+        outputs[self.output_keys[0]] = result
+        if steps and "intermediate_steps" in outputs:
+            outputs["intermediate_steps"] = steps
+        return outputs
+
+    def _dispatch(self, label: str, message: str) -> Dict[str, Any]:
+        action = AgentAction(label, message, f"Action: {label}\nAction Input: {message}")
+        self.callback_manager.on_agent_action(action, verbose=self.verbose, color="green")
+        result = self.sub_agents[label].run(message)
+        return self._finish(result, [(action, result)])
+
+    async def _afinish(self, result: str, steps: List[Any] = None) -> Dict[str, Any]:
+        await emit(self.callback_manager, "on_agent_finish", AgentFinish({"output": result}, result), color="green", verbose=self.verbose)
+        outputs = {key: [] for key in self.output_keys}
+        outputs[self.output_keys[0]] = result
+        if steps and "intermediate_steps" in outputs:
+            outputs["intermediate_steps"] = steps
+        return outputs
+
+    async def _adispatch(self, label: str, message: str) -> Dict[str, Any]:
+        action = AgentAction(label, message, f"Action: {label}\nAction Input: {message}")
+        await emit(self.callback_manager, "on_agent_action", action, verbose=self.verbose, color="green")
+        result = await self.sub_agents[label].arun(message)
+        return await self._afinish(result, [(action, result)])
+
+    def _learn(self, message: str, vector: Any, steps: Optional[List[Any]]):
+        """Log the request if the agent answered it with exactly one of the sub-agents."""
+        if not steps:
+            return
+        labels = set(action.tool for action, _ in steps)
+        if len(labels) != 1:
+            return
+        label = labels.pop()
+        if label not in self.sub_agents:
+            return
+        if self.request_log is not None:
+            self.request_log.append(message, label)
+        if self.classifier is not None and vector is not None:
+            self.classifier.add_vectors([vector], [label])
+
+
+def with_conversation(message: str, inputs: Dict[str, str], conversation_key: str = "conversation") -> str:
+    """Wrap the request in the conversation so far, if there is one."""
+    conversation = inputs.get(conversation_key)
+    if not conversation:
+        return message
+    return CONVERSATION_CONTEXT.format(conversation=conversation, input=message)
@@ -0,0 +1,205 @@
+"""Run scoped memoization of tool observations, shared by an agent and all of its sub-agents."""
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain.agents.agent import AgentExecutor
+from langchain.schema import AgentAction, AgentFinish
+from langchain.tools.base import BaseTool
+
+from agent.deadline import STOPPED_OUTPUT_PREFIX, arun_with_deadline, expired, partial_answer, run_with_deadline
+from agent.metrics import observe_tool
+from tools.cache import normalize_input
+
+# tools with side effects are never memoized, and running one forgets everything observed so far
+WRITE_TOOL_NAMES = frozenset([
+    "k8s_create_namespace",
+    "slack_send_message",
+    "gitlab_agent",
+    "gitlab_change_issue_label",
+    "gitlab_create_issue",
+    "gitlab_comment_on_issue",
+    "gitlab_reply_to_issue_comment",
+    "gitlab_create_merge_request",
+    "gitlab_comment_on_merge_request",
+    "gitlab_reply_to_merge_request_comment",
+])
+WRITE_TOOL_PREFIXES = ("git_repository_",)
+
+REUSED_NOTE = "(Reused the result of an earlier identical {tool} call in this run.)"
+
+_run_memo: contextvars.ContextVar[Optional[Dict[Tuple[str, str], str]]] = contextvars.ContextVar("run_memo", default=None)
+_observations: contextvars.ContextVar[Optional[List[Tuple[str, str, str]]]] = contextvars.ContextVar("observations", default=None)
+_writes: contextvars.ContextVar[Optional[List[Tuple[str, str]]]] = contextvars.ContextVar("writes", default=None)
+
+
+@contextmanager
+def run_memo() -> Iterator[Dict[Tuple[str, str], str]]:
+    """Open a memo table for the current run, or join the one opened by an enclosing run.
+
+    The table is discarded when the outermost run exits, so nothing leaks across conversations.
+    """
+    memo = _run_memo.get()
+    if memo is not None:
+        yield memo
+        return
+    memo = {}
+    token = _run_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _run_memo.reset(token)
+
+
+@contextmanager
+def record_observations() -> Iterator[List[Tuple[str, str, str]]]:
+    """Collect the (tool, input, observation) of every tool call made inside the block, including by sub-agents."""
+    observations = []
+    token = _observations.set(observations)
+    try:
+        yield observations
+    finally:
+        _observations.reset(token)
+
+
+def record(tool_name: str, tool_input: str, observation: str):
+    observations = _observations.get()
+    if observations is not None:
+        # a reused observation is recorded as the tool returned it, the note is only meant for the agent
+        if isinstance(observation, str):
+            observation = observation.removesuffix(f"\n{REUSED_NOTE.format(tool=tool_name)}")
+        observations.append((tool_name, tool_input, observation))
+
+
+@contextmanager
+def track_writes() -> Iterator[List[Tuple[str, str]]]:
+    """Collect the (tool, input) of every write tool run inside the block, including by sub-agents.
+
+    Blocks can nest, and an enclosing block also sees the writes of the blocks inside it.
+    """
+    parent = _writes.get()
+    writes = []
+    token = _writes.set(writes)
+    try:
+        yield writes
+    finally:
+        _writes.reset(token)
+        if parent is not None:
+            parent.extend(writes)
+
+
+def record_write(tool_name: str, tool_input: str):
+    writes = _writes.get()
+    if writes is not None:
+        writes.append((tool_name, tool_input))
+
+
+def is_write_tool(name: str) -> bool:
+    return name in WRITE_TOOL_NAMES or name.startswith(WRITE_TOOL_PREFIXES)
+
+
+def memoized_observation(tool_name: str, tool_input: str, run: Callable[[str], str]) -> str:
+    """Return the earlier observation for (tool, input) in this run, or run the tool and remember it."""
+    if is_write_tool(tool_name):
+        record_write(tool_name, tool_input)
+    memo = _run_memo.get()
+    if memo is None:
+        return run(tool_input)
+    if is_write_tool(tool_name):
+        memo.clear()
+        return run(tool_input)
+    key = (tool_name, normalize_input(tool_input))
+    if key in memo:
+        return f"{memo[key]}\n{REUSED_NOTE.format(tool=tool_name)}"
+    observation = run(tool_input)
+    if isinstance(observation, str) and not observation.startswith("Error"):
+        memo[key] = observation
+    return observation
+
+
+async def amemoized_observation(tool_name: str, tool_input: str, arun: Callable[[str], Awaitable[str]]) -> str:
+    """Async version of memoized_observation."""
+    if is_write_tool(tool_name):
+        record_write(tool_name, tool_input)
+    memo = _run_memo.get()
+    if memo is None:
+        return await arun(tool_input)
+    if is_write_tool(tool_name):
+        memo.clear()
+        return await arun(tool_input)
+    key = (tool_name, normalize_input(tool_input))
+    if key in memo:
+        return f"{memo[key]}\n{REUSED_NOTE.format(tool=tool_name)}"
+    observation = await arun(tool_input)
+    if isinstance(observation, str) and not observation.startswith("Error"):
+        memo[key] = observation
+    return observation
+
+
+class MemoizedTool(BaseTool):
+    """Wraps a tool so repeated calls within a run reuse the earlier observation."""
+    tool: BaseTool
+
+    @classmethod
+    def from_tool(cls, tool: BaseTool) -> "MemoizedTool":
+        return cls(tool=tool, name=tool.name, description=tool.description, return_direct=tool.return_direct,
+                   verbose=tool.verbose, callback_manager=tool.callback_manager)
+
+    def _run(self, tool_input: str) -> str:
+        """Run the wrapped tool, or reuse its earlier observation."""
+        start = time.perf_counter()
+        observation = memoized_observation(self.tool.name, tool_input,
+                                           functools.partial(run_with_deadline, self.tool.name, self.tool._run,
+                                                             write=is_write_tool(self.tool.name)))
+        observe_tool(self.tool.name, time.perf_counter() - start, observation)
+        record(self.tool.name, tool_input, observation)
+        return observation
+
+    async def _arun(self, tool_input: str) -> str:
+        """Run the wrapped tool, or reuse its earlier observation."""
+        start = time.perf_counter()
+        observation = await amemoized_observation(self.tool.name, tool_input,
+                                                  functools.partial(arun_with_deadline, self.tool.name, self.tool._arun,
+                                                                    write=is_write_tool(self.tool.name)))
+        observe_tool(self.tool.name, time.perf_counter() - start, observation)
+        record(self.tool.name, tool_input, observation)
+        return observation
+
+
+def memoize_tools(tools: List[BaseTool]) -> List[BaseTool]:
+    """Wrap every tool in the list with a MemoizedTool."""
+    return [MemoizedTool.from_tool(tool) for tool in tools]
+
+
+class MemoizedAgentExecutor(AgentExecutor):
+    """AgentExecutor that scopes a run memo around each run; nested executors share the outermost memo.
+
+    It also stops iterating when the request's deadline passes, and answers with what it found so far.
+    """
+
+    def _call(self, inputs: Dict[str, str]) -> Dict[str, Any]:
+        with run_memo():
+            return super()._call(inputs)
+
+    async def _acall(self, inputs: Dict[str, str]) -> Dict[str, Any]:
+        # the memo lives in a context variable, so it follows the run across awaits and into its tasks
+        with run_memo():
+            return await super()._acall(inputs)
+
+    def _should_continue(self, iterations: int, time_elapsed: float) -> bool:
+        return not expired() and super()._should_continue(iterations, time_elapsed)
+
+    def _return(self, output: AgentFinish, intermediate_steps: List[Tuple[AgentAction, str]]) -> Dict[str, Any]:
+        return super()._return(self._deadline_output(output, intermediate_steps), intermediate_steps)
+
+    async def _areturn(self, output: AgentFinish, intermediate_steps: List[Tuple[AgentAction, str]]) -> Dict[str, Any]:
+        return await super()._areturn(self._deadline_output(output, intermediate_steps), intermediate_steps)
+
+    def _deadline_output(self, output: AgentFinish, intermediate_steps: List[Tuple[AgentAction, str]]) -> AgentFinish:
+        """Replace the stopped response with a partial answer when the agent was stopped by the deadline."""
+        if expired() and str(output.return_values.get("output", "")).startswith(STOPPED_OUTPUT_PREFIX):
+            answer = partial_answer(intermediate_steps)
+            return AgentFinish({"output": answer}, answer)
+        return output
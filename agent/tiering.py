@@ -0,0 +1,159 @@
+"""Runs sub-agents on a fast model and escalates to the strong model when the fast one struggles."""
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.agents.agent import AgentExecutor
+from langchain.chains.base import Chain
+from langchain.schema import AgentAction
+from pydantic import Field
+
+from agent.deadline import expired, partial_answer
+from agent.run_memo import track_writes
+
+LOW_CONFIDENCE_MARKERS = ("i don't know", "i do not know", "agent stopped due to")
+
+
+class TierStats:
+    """Process wide latency and escalation counters per sub-agent and model tier."""
+    calls: Dict[Tuple[str, str], int]
+    seconds: Dict[Tuple[str, str], float]
+    escalations: Dict[Tuple[str, str], int]
+    lock: threading.Lock
+
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+        self.escalations = {}
+        self.lock = threading.Lock()
+
+    def record_call(self, agent: str, tier: str, seconds: float):
+        with self.lock:
+            key = (agent, tier)
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self.seconds[key] = self.seconds.get(key, 0.0) + seconds
+
+    def record_escalation(self, agent: str, reason: str):
+        with self.lock:
+            key = (agent, reason)
+            self.escalations[key] = self.escalations.get(key, 0) + 1
+
+    def report(self) -> Dict[str, Any]:
+        """Return calls, average latency and escalation rate per sub-agent."""
+        with self.lock:
+            report = {}
+            for (agent, tier), calls in self.calls.items():
+                entry = report.setdefault(agent, {"tiers": {}, "escalations": {}, "escalation_rate": 0.0})
+                entry["tiers"][tier] = {"calls": calls, "avg_seconds": self.seconds[(agent, tier)] / calls}
+            for (agent, reason), count in self.escalations.items():
+                entry = report.setdefault(agent, {"tiers": {}, "escalations": {}, "escalation_rate": 0.0})
+                entry["escalations"][reason] = count
+            for agent, entry in report.items():
+                fast_calls = entry["tiers"].get("fast", {}).get("calls", 0)
+                if fast_calls:
+                    entry["escalation_rate"] = sum(entry["escalations"].values()) / fast_calls
+            return report
+
+
+TIER_STATS = TierStats()
+
+
+class EscalatingAgent(Chain):
+    """Runs the fast agent, and reruns the request on the strong agent on parse failures, loops or low confidence answers.
+
+    The fast agent must return its intermediate steps, so loops can be detected. A fast run that already ran a
+    write tool is never rerun, since the strong agent would make the same changes again.
+    """
+    name: str
+    fast_agent: AgentExecutor
+    strong_agent: AgentExecutor
+    stats: TierStats = Field(default_factory=lambda: TIER_STATS)
+    input_key: str = "input"
+    output_key: str = "output"
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def input_keys(self) -> List[str]:
+        return [self.input_key]
+
+    @property
+    def output_keys(self) -> List[str]:
+        return [self.output_key]
+
+    def _call(self, inputs: Dict[str, str]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        outputs, error = None, None
+        with track_writes() as writes:
+            try:
+                outputs = self.fast_agent(inputs)
+            except Exception as e:
+                # the MRKL output parser raises when the model doesn't follow the format
+                error = e
+        self.stats.record_call(self.name, "fast", time.perf_counter() - start)
+        answer = self.fast_answer(outputs, error, writes)
+        if answer is not None:
+            return {self.output_key: answer}
+        start = time.perf_counter()
+        try:
+            outputs = self.strong_agent(inputs)
+        finally:
+            self.stats.record_call(self.name, "strong", time.perf_counter() - start)
+        return {self.output_key: outputs[self.output_key]}
+
+    async def _acall(self, inputs: Dict[str, str]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        outputs, error = None, None
+        with track_writes() as writes:
+            try:
+                outputs = await self.fast_agent.acall(inputs)
+            except Exception as e:
+                error = e
+        self.stats.record_call(self.name, "fast", time.perf_counter() - start)
+        answer = self.fast_answer(outputs, error, writes)
+        if answer is not None:
+            return {self.output_key: answer}
+        start = time.perf_counter()
+        try:
+            outputs = await self.strong_agent.acall(inputs)
+        finally:
+            self.stats.record_call(self.name, "strong", time.perf_counter() - start)
+        return {self.output_key: outputs[self.output_key]}
+
+    def fast_answer(self, outputs: Optional[Dict[str, Any]], error: Optional[Exception], writes: List[Tuple[str, str]]) -> Optional[str]:
+        """The answer to keep from the fast run, or None to escalate, in which case the escalation is counted.
+
+        The fast run is kept when there is no time left to rerun the request, or rerunning it would repeat its writes.
+        """
+        if error is not None:
+            print(f"Error running {self.name} on the fast model: {error}")
+            reason = "error"
+        else:
+            reason = escalation_reason(outputs[self.output_key], outputs.get("intermediate_steps", []))
+        if reason is None:
+            return outputs[self.output_key]
+        if expired():
+            return partial_answer([]) if error is not None else outputs[self.output_key]
+        if writes:
+            return failed_after_writes(self.name, error, writes) if error is not None else outputs[self.output_key]
+        self.stats.record_escalation(self.name, reason)
+        return None
+
+
+def failed_after_writes(name: str, error: Exception, writes: List[Tuple[str, str]]) -> str:
+    """The answer of a run that failed after making changes, which are listed so they can be checked before retrying."""
+    changes = "\n".join(f"- {tool}({tool_input})" for tool, tool_input in writes)
+    return f"Error: {name} failed ({error}) after it made these changes, so it wasn't retried:\n{changes}"
+
+
+def escalation_reason(output: str, intermediate_steps: List[Tuple[AgentAction, str]]) -> Optional[str]:
+    """Return why the fast agent's answer should not be trusted, or None if it looks fine."""
+    if not output or not output.strip():
+        return "empty"
+    if any(marker in output.lower() for marker in LOW_CONFIDENCE_MARKERS):
+        return "low_confidence"
+    actions = [(action.tool, action.tool_input) for action, _ in intermediate_steps]
+    if any(previous == current for previous, current in zip(actions, actions[1:])):
+        return "loop"
+    return None
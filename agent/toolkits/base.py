@@ -7,6 +7,9 @@ from langchain.callbacks.base import BaseCallbackManager
 from langchain.agents.mrkl.base import ZeroShotAgent
 from langchain.agents.mrkl.prompt import FORMAT_INSTRUCTIONS
 from agent.mkrl_chat.agent import ZeroShotChatAgent
+from agent.run_memo import MemoizedAgentExecutor, memoize_tools
+from agent.plan_execute.agent import PlanAndExecuteChain, PlanExecutor, create_planner_prompt, create_synthesizer_prompt
+from langchain.tools.base import BaseTool
 
 from agent.toolkits.prompt import K8S_ENGINEER_PREFIX, K8S_ENGINEER_SUFFIX
 from agent.toolkits.toolkit import K8sEngineerToolkit
@@ -37,5 +40,23 @@ def create_k8s_engineer_agent(
     tool_names = [tool.name for tool in tools]
     agent = ZeroShotChatAgent(llm_chain=llm_chain,
                           allowed_tools=tool_names, return_intermediate_steps=True, **kwargs)
-    return AgentExecutor.from_agent_and_tools(agent=agent, tools=toolkit.get_tools(), verbose=verbose, callback_manager=callback_manager, return_intermediate_steps=True,)
-    
\ No newline at end of file
+    return MemoizedAgentExecutor.from_agent_and_tools(agent=agent, tools=memoize_tools(tools), verbose=verbose, callback_manager=callback_manager, return_intermediate_steps=True,)
+
+
+def create_k8s_planner_agent(
+        llm: BaseLLM,
+        tools: List[BaseTool],
+        callback_manager: Optional[BaseCallbackManager] = None,
+        max_parallel_tools: int = 4,
+        max_replans: int = 1,
+        verbose: bool = False,
+) -> PlanAndExecuteChain:
+    """Create a plan-and-execute agent for kubernetes engineering tasks.
+
+    Unlike create_k8s_engineer_agent, tools should be leaf tools (e.g. the explorer and SME tools), not sub-agents.
+    """
+    planner_chain = LLMChain(llm=llm, prompt=create_planner_prompt(tools), callback_manager=callback_manager)
+    synthesizer_chain = LLMChain(llm=llm, prompt=create_synthesizer_prompt(), callback_manager=callback_manager)
+    executor = PlanExecutor(tools={tool.name: tool for tool in memoize_tools(tools)}, max_workers=max_parallel_tools)
+    return PlanAndExecuteChain(planner_chain=planner_chain, synthesizer_chain=synthesizer_chain, executor=executor,
+                               max_replans=max_replans, callback_manager=callback_manager, verbose=verbose)
@@ -7,6 +7,7 @@ from langchain.callbacks.base import BaseCallbackManager
 from langchain.agents.mrkl.base import ZeroShotAgent
 from langchain.agents.mrkl.prompt import FORMAT_INSTRUCTIONS
 from agent.mkrl_chat.agent import ZeroShotChatAgent
+from agent.run_memo import MemoizedAgentExecutor, memoize_tools
 from agent.toolkits.git_integrator.prompt import GIT_PREFIX, GIT_SUFFIX
 
 from agent.toolkits.git_integrator.toolkit import GitIntegratorToolkit
@@ -37,4 +38,4 @@ def create_git_integration_toolkit(
     tool_names = [tool.name for tool in tools]
     agent = ZeroShotChatAgent(llm_chain=llm_chain,
                           allowed_tools=tool_names, **kwargs)
-    return AgentExecutor.from_agent_and_tools(agent=agent, tools=toolkit.get_tools(), callback_manager=callback_manager, verbose=verbose)
\ No newline at end of file
+    return MemoizedAgentExecutor.from_agent_and_tools(agent=agent, tools=memoize_tools(tools), callback_manager=callback_manager, verbose=verbose)
\ No newline at end of file
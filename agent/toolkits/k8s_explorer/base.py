@@ -6,7 +6,11 @@ from langchain.llms.base import BaseLLM
 from langchain.callbacks.base import BaseCallbackManager
 from langchain.agents.mrkl.base import ZeroShotAgent
 from langchain.agents.mrkl.prompt import FORMAT_INSTRUCTIONS
-from agent.mkrl_chat.agent import ZeroShotChatAgent
+from agent.mkrl_chat.agent import MultiActionZeroShotChatAgent, ZeroShotChatAgent
+from agent.mkrl_chat.executor import ParallelAgentExecutor
+from agent.mkrl_chat.prompt import MULTI_ACTION_FORMAT_INSTRUCTIONS
+from agent.mkrl_chat.tool_selection import ToolSelector
+from agent.run_memo import MemoizedAgentExecutor, memoize_tools
 from agent.toolkits.k8s_explorer.prompt import K8S_PREFIX, K8S_SUFFIX
 
 from agent.toolkits.k8s_explorer.toolkit import K8sExplorerToolkit
@@ -21,11 +25,22 @@ def create_k8s_explorer_agent(
         format_instructions: str = FORMAT_INSTRUCTIONS,
         input_variables: Optional[List[str]] = None,
         verbose: bool = False,
+        max_parallel_actions: int = 1,
+        tool_selector: Optional[ToolSelector] = None,
         **kwargs: Any,
 ) -> AgentExecutor:
-    """Create an agent for exploring a kubernetes cluster."""
+    """Create an agent for exploring a kubernetes cluster.
+
+    With max_parallel_actions > 1 the agent may emit several independent actions per step, which run concurrently.
+    With a tool_selector, each request's prompt only describes the tools selected for it.
+    """
     tools = toolkit.get_tools()
-    prompt = ZeroShotChatAgent.create_chat_prompt(tools=tools,
+    agent_cls = ZeroShotChatAgent
+    if max_parallel_actions > 1:
+        agent_cls = MultiActionZeroShotChatAgent
+        if format_instructions == FORMAT_INSTRUCTIONS:
+            format_instructions = MULTI_ACTION_FORMAT_INSTRUCTIONS
+    prompt = agent_cls.create_chat_prompt(tools=tools,
                                          prefix=prefix,
                                          suffix=suffix,
                                          format_instructions=format_instructions,
@@ -36,6 +51,11 @@ def create_k8s_explorer_agent(
                          callback_manager=callback_manager,
                          )
     tool_names = [tool.name for tool in tools]
-    agent = ZeroShotChatAgent(llm_chain=llm_chain,
+    if tool_selector is not None:
+        kwargs.update(tool_selector=tool_selector, tools=tools,
+                      prompt_kwargs=dict(prefix=prefix, suffix=suffix, format_instructions=format_instructions))
+    agent = agent_cls(llm_chain=llm_chain,
                           allowed_tools=tool_names, **kwargs)
-    return AgentExecutor.from_agent_and_tools(agent=agent, tools=toolkit.get_tools(), callback_manager=callback_manager, verbose=verbose)
+    if max_parallel_actions > 1:
+        return ParallelAgentExecutor.from_agent_and_tools(agent=agent, tools=memoize_tools(tools), callback_manager=callback_manager, verbose=verbose, max_parallel_actions=max_parallel_actions)
+    return MemoizedAgentExecutor.from_agent_and_tools(agent=agent, tools=memoize_tools(tools), callback_manager=callback_manager, verbose=verbose)
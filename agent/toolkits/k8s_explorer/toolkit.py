@@ -1,4 +1,4 @@
-from typing import List
+from typing import Any, List, Optional
 from tools.k8s_explorer.tool import KubernetesGetAvailableNamespacesTool, KubernetesGetAvailableOperationsTool, KubernetesGetObjectNamesTool, KubernetesGetAvailableResourceTypesTool, KubernetesGetPodLogsTool, KubernetesGetPodNameLikeTool, KubernetesGetResourceTool, KubernetesOpsModel
 
 from langchain.agents.agent_toolkits.base import BaseToolkit
@@ -11,6 +11,8 @@ class K8sExplorerToolkit(BaseToolkit):
 
     model: KubernetesOpsModel
     callback_manager: BaseCallbackManager | None
+    # an AsyncKubernetesOpsModel, used by the tools when the agent runs on the asyncio path
+    async_model: Optional[Any] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -18,12 +20,12 @@ class K8sExplorerToolkit(BaseToolkit):
     def get_tools(self) -> List[BaseTool]:
         """Return a list of tools."""
         return [
-            KubernetesGetAvailableResourceTypesTool(model=self.model, callback_manager=self.callback_manager),
-            KubernetesGetAvailableNamespacesTool(model=self.model, callback_manager=self.callback_manager),
-            KubernetesGetObjectNamesTool(model=self.model, callback_manager=self.callback_manager),
-            KubernetesGetPodNameLikeTool(model=self.model, callback_manager=self.callback_manager),
-            KubernetesGetPodLogsTool(model=self.model, callback_manager=self.callback_manager),
-            KubernetesGetAvailableOperationsTool(model=self.model, callback_manager=self.callback_manager),
-            KubernetesGetResourceTool(model=self.model, callback_manager=self.callback_manager),
+            KubernetesGetAvailableResourceTypesTool(model=self.model, async_model=self.async_model, callback_manager=self.callback_manager),
+            KubernetesGetAvailableNamespacesTool(model=self.model, async_model=self.async_model, callback_manager=self.callback_manager),
+            KubernetesGetObjectNamesTool(model=self.model, async_model=self.async_model, callback_manager=self.callback_manager),
+            KubernetesGetPodNameLikeTool(model=self.model, async_model=self.async_model, callback_manager=self.callback_manager),
+            KubernetesGetPodLogsTool(model=self.model, async_model=self.async_model, callback_manager=self.callback_manager),
+            KubernetesGetAvailableOperationsTool(model=self.model, async_model=self.async_model, callback_manager=self.callback_manager),
+            KubernetesGetResourceTool(model=self.model, async_model=self.async_model, callback_manager=self.callback_manager),
         ]
     
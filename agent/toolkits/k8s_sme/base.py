@@ -7,6 +7,7 @@ from langchain.callbacks.base import BaseCallbackManager
 from langchain.agents.mrkl.base import ZeroShotAgent
 from langchain.agents.mrkl.prompt import FORMAT_INSTRUCTIONS
 from agent.mkrl_chat.agent import ZeroShotChatAgent
+from agent.run_memo import MemoizedAgentExecutor, memoize_tools
 
 from agent.toolkits.k8s_sme.prompt import K8S_SME_PREFIX, K8S_SME_SUFFIX
 from agent.toolkits.k8s_sme.toolkit import KubernetesSMEToolkit
@@ -37,4 +38,4 @@ def create_k8s_sme_agent(
     tool_names = [tool.name for tool in tools]
     agent = ZeroShotChatAgent(llm_chain=llm_chain,
                           allowed_tools=tool_names, **kwargs)
-    return AgentExecutor.from_agent_and_tools(agent=agent, tools=toolkit.get_tools(), verbose=verbose, callback_manager=callback_manager)
\ No newline at end of file
+    return MemoizedAgentExecutor.from_agent_and_tools(agent=agent, tools=memoize_tools(tools), verbose=verbose, callback_manager=callback_manager)
\ No newline at end of file
@@ -4,7 +4,7 @@ from langchain.agents.agent_toolkits.base import BaseToolkit
 from langchain.callbacks.base import BaseCallbackManager
 from langchain.tools import BaseTool
 
-from tools.k8s_sme.tools import KubernetesSMEModel, KubernetesSMETool
+from tools.k8s_sme.tools import KubernetesSchemaTool, KubernetesSMEModel, KubernetesSMETool
 
 class KubernetesSMEToolkit(BaseToolkit):
     """Toolkit for interacting with git repositories."""
@@ -17,6 +17,9 @@ class KubernetesSMEToolkit(BaseToolkit):
 
     def get_tools(self) -> List[BaseTool]:
         """Return a list of tools."""
-        return [
+        tools = [
             KubernetesSMETool(model=self.model, callback_manager=self.callback_manager),
-        ]
\ No newline at end of file
+        ]
+        if self.model.schema_model is not None:
+            tools.append(KubernetesSchemaTool(model=self.model.schema_model, callback_manager=self.callback_manager))
+        return tools
\ No newline at end of file
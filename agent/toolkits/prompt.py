@@ -19,6 +19,13 @@ Question: {input}
 Thought: I should figure out what I need to do.
 {agent_scratchpad}"""
 
+CONVERSATION_CONTEXT = """This request is a follow-up in an ongoing conversation.
+Use what the conversation already established instead of looking it up again, unless it may have changed since.
+
+{conversation}
+
+Current request: {input}"""
+
 DESCRIPTION = """Can be used to perform operations and engineering tasks related to Kubernetes.
 Example inputs to this tool:
     'create a new namespace called test-1'
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
 
-from typing import Any, List
+from typing import Any, Callable, Dict, List
 from agent.toolkits.git_integrator.base import create_git_integration_toolkit
 from agent.toolkits.git_integrator.prompt import GIT_AGENT_DESCRIPTION
 from agent.toolkits.git_integrator.toolkit import GitIntegratorToolkit
 from agent.toolkits.gitlab_integration.prompt import GITLAB_AGENT_DESCRIPTION
 from agent.toolkits.gitlab_integration.toolkit import GitlabIntegrationToolkit
+from agent.mkrl_chat.tool_selection import ToolSelector
+from agent.tiering import EscalatingAgent
 from agent.toolkits.k8s_explorer.base import create_k8s_explorer_agent
 from agent.toolkits.k8s_explorer.prompt import K8S_EXPLORER_AGENT_DESCRIPTION
 from agent.toolkits.k8s_explorer.toolkit import K8sExplorerToolkit
@@ -14,6 +16,7 @@ from agent.toolkits.k8s_explorer.toolkit import K8sExplorerToolkit
 from langchain.llms.base import BaseLLM
 from langchain.agents.agent import AgentExecutor
 from langchain.agents.agent_toolkits.base import BaseToolkit
+from langchain.chains.base import Chain
 from langchain.tools import BaseTool
 from langchain.agents.tools import Tool
 from langchain.callbacks.base import BaseCallbackManager
@@ -23,6 +26,7 @@ from agent.toolkits.k8s_sme.toolkit import KubernetesSMEToolkit
 
 from tools.git_integrator.tool import GitModel
 from tools.gitlab_integration.tool import GitlabModel
+from tools.k8s_explorer.async_model import AsyncKubernetesOpsModel
 from tools.k8s_explorer.tool import KubernetesOpsModel
 from tools.k8s_sme.tools import KubernetesSMEModel
 from tools.slack_integration.tool import SlackModel, SlackSendMessageTool
@@ -31,10 +35,10 @@ from tools.slack_integration.tool import SlackModel, SlackSendMessageTool
 class K8sEngineerToolkit(BaseToolkit):
     """Toolkit for performing engineering tasks related to kubernetes."""
 
-    git_agent: AgentExecutor
-    gitlab_agent: AgentExecutor
-    k8s_explorer_agent: AgentExecutor
-    k8s_sme_agent: AgentExecutor
+    git_agent: Chain
+    gitlab_agent: Chain
+    k8s_explorer_agent: Chain
+    k8s_sme_agent: Chain
     slack_tool: BaseTool
 
     def get_tools(self) -> List[BaseTool]:
@@ -47,16 +51,19 @@ class K8sEngineerToolkit(BaseToolkit):
         k8s_explorer_agent_tool = Tool(
             name="k8s_explorer_agent",
             func=self.k8s_explorer_agent.run,
+            coroutine=self.k8s_explorer_agent.arun,
             description=K8S_EXPLORER_AGENT_DESCRIPTION,
         )
         gitlab_agent_tool = Tool(
             name="gitlab_agent",
             func=self.gitlab_agent.run,
+            coroutine=self.gitlab_agent.arun,
             description=GITLAB_AGENT_DESCRIPTION,
         )
         k8s_sme_agent_tool = Tool(
             name="k8s_sme_agent",
             func=self.k8s_sme_agent.run,
+            coroutine=self.k8s_sme_agent.arun,
             description=K8S_SME_AGENT_DESCRIPTION,
         )
         return [k8s_explorer_agent_tool, gitlab_agent_tool, k8s_sme_agent_tool, self.slack_tool]
@@ -70,20 +77,41 @@ class K8sEngineerToolkit(BaseToolkit):
         gitlab_model: GitlabModel,
         slack_model: SlackModel,
         k8s_sme_model: KubernetesSMEModel,
+        k8s_async_model: AsyncKubernetesOpsModel = None,
         callback_manager: BaseCallbackManager = None,
         slack_channel: str = None,
         slack_thread_ts: str = None,
         verbose: bool = False,
+        max_parallel_actions: int = 1,
+        tool_selector: ToolSelector = None,
+        sub_agent_llms: Dict[str, BaseLLM] = None,
         **kwargs: Any,
     ) -> K8sEngineerToolkit:
-        """Create a toolkit from an LLM."""
+        """Create a toolkit from an LLM.
+
+        sub_agent_llms maps sub-agent names to a faster model to run them on; they escalate to llm when it struggles.
+        """
+        sub_agent_llms = sub_agent_llms or {}
+
+        def tiered(name: str, create_agent: Callable[..., AgentExecutor], make_toolkit: Callable[[], BaseToolkit], **agent_kwargs: Any) -> Chain:
+            strong_agent = create_agent(llm=llm, toolkit=make_toolkit(), verbose=verbose, callback_manager=callback_manager, **agent_kwargs)
+            if sub_agent_llms.get(name) is None:
+                return strong_agent
+            fast_agent = create_agent(llm=sub_agent_llms[name], toolkit=make_toolkit(), verbose=verbose, callback_manager=callback_manager, **agent_kwargs)
+            fast_agent.return_intermediate_steps = True
+            # a fast agent that needs many iterations is struggling, give up early and escalate
+            fast_agent.max_iterations = 6
+            return EscalatingAgent(name=name, fast_agent=fast_agent, strong_agent=strong_agent, callback_manager=callback_manager)
+
         git_agent = create_git_integration_toolkit(
             llm=llm, toolkit=GitIntegratorToolkit(model=git_model, callback_manager=callback_manager), verbose=verbose, callback_manager=callback_manager, **kwargs)
-        k8s_explorer_agent = create_k8s_explorer_agent(
-            llm=llm, toolkit=K8sExplorerToolkit(model=k8s_model, callback_manager=callback_manager), verbose=verbose, callback_manager=callback_manager, **kwargs)
+        k8s_explorer_agent = tiered("k8s_explorer_agent", create_k8s_explorer_agent,
+                                    lambda: K8sExplorerToolkit(model=k8s_model, async_model=k8s_async_model, callback_manager=callback_manager),
+                                    max_parallel_actions=max_parallel_actions, tool_selector=tool_selector, **kwargs)
+        # the GitLab agent mostly writes (issues, comments, merge requests), so it always runs on the strong model
         gitlab_agent = create_git_integration_toolkit(
             llm=llm, toolkit=GitlabIntegrationToolkit(model=gitlab_model, callback_manager=callback_manager), verbose=verbose, callback_manager=callback_manager, **kwargs)
-        k8s_sme_agent = create_k8s_sme_agent(
-            llm=llm, toolkit=KubernetesSMEToolkit(model=k8s_sme_model, callback_manager=callback_manager), verbose=verbose, callback_manager=callback_manager, **kwargs)
+        k8s_sme_agent = tiered("k8s_sme_agent", create_k8s_sme_agent,
+                               lambda: KubernetesSMEToolkit(model=k8s_sme_model, callback_manager=callback_manager), **kwargs)
         slack_tool = SlackSendMessageTool(model = slack_model, channel=slack_channel, thread_ts=slack_thread_ts, verbose=verbose, callback_manager=callback_manager, **kwargs)
         return cls(git_agent=git_agent, k8s_explorer_agent=k8s_explorer_agent, gitlab_agent=gitlab_agent, k8s_sme_agent=k8s_sme_agent, slack_tool=slack_tool, **kwargs)
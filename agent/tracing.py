@@ -0,0 +1,392 @@
+"""Per-request tracing: nested spans for the run, chains, LLM calls, tools and HTTP calls.
+
+Tracing is on when K8S_TRACE_DIR is set. Every traced request appends its spans to spans.jsonl in that
+directory, and writes <run id>.trace.json in the Chrome trace event format, which chrome://tracing and
+https://ui.perfetto.dev show as a flamegraph. When it is off, no handler is installed, and the client hooks
+that also record metrics skip the span with a single context variable lookup.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Union
+from urllib.parse import urlparse
+
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.schema import AgentAction, AgentFinish, LLMResult
+
+from agent.metrics import APISERVER_REQUESTS, APISERVER_SECONDS, GITLAB_REQUESTS, GITLAB_SECONDS, apiserver_resource
+from tools.aio import parent_task_scope, task_scope
+
+_tracer: contextvars.ContextVar[Optional["Tracer"]] = contextvars.ContextVar("tracer", default=None)
+# runs finish concurrently, and their spans share one file
+_spans_file_lock = threading.Lock()
+
+
+def trace_dir() -> Optional[str]:
+    return os.getenv("K8S_TRACE_DIR")
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "kind", "name", "lane", "start", "end", "attributes")
+
+    def __init__(self, span_id: int, parent_id: Optional[int], kind: str, name: str, lane: int, attributes: Dict[str, Any]):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.kind = kind
+        self.name = name
+        self.lane = lane
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+
+    def to_dict(self, run_id: str, epoch: float) -> Dict[str, Any]:
+        return {
+            "run_id": run_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "name": self.name,
+            "start_ms": round((self.start - epoch) * 1000, 3),
+            "duration_ms": round(((self.end or self.start) - self.start) * 1000, 3),
+            **self.attributes,
+        }
+
+
+class Tracer:
+    """The spans of one request.
+
+    Spans nest within a lane, the task scope of tools.aio, so the actions an agent runs concurrently each get
+    their own lane. The first span of a lane is the child of whatever is open in the lane that started it.
+    """
+    run_id: str
+    directory: str
+    epoch: float
+    spans: List[Span]
+    stacks: Dict[int, List[Span]]
+    lane_parents: Dict[int, int]
+    lock: threading.Lock
+
+    def __init__(self, directory: str):
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.directory = directory
+        self.epoch = time.perf_counter()
+        self.spans = []
+        self.stacks = {}
+        self.lane_parents = {}
+        self.lock = threading.Lock()
+
+    def open_span(self, lane: int) -> Optional[Span]:
+        """The innermost open span of the lane, or of the lanes that started it."""
+        seen = set()
+        while lane not in seen:
+            seen.add(lane)
+            stack = self.stacks.get(lane)
+            if stack:
+                return stack[-1]
+            if lane not in self.lane_parents:
+                return None
+            lane = self.lane_parents[lane]
+        return None
+
+    def start(self, kind: str, name: str, **attributes: Any) -> Span:
+        lane = task_scope()
+        with self.lock:
+            if lane not in self.stacks:
+                self.stacks[lane] = []
+                if lane:
+                    self.lane_parents[lane] = parent_task_scope()
+            parent = self.open_span(lane)
+            span = Span(len(self.spans) + 1, parent.span_id if parent else None, kind, name, lane, attributes)
+            self.spans.append(span)
+            self.stacks[lane].append(span)
+        return span
+
+    def finish(self, span: Span, **attributes: Any):
+        span.end = time.perf_counter()
+        span.attributes.update(attributes)
+        with self.lock:
+            stack = self.stacks.get(span.lane, [])
+            if span in stack:
+                stack.remove(span)
+
+    def current(self, kind: str) -> Optional[Span]:
+        """The innermost open span of the given kind in the current lane."""
+        with self.lock:
+            for span in reversed(self.stacks.get(task_scope(), [])):
+                if span.kind == kind:
+                    return span
+        return None
+
+    def end(self, kind: str, **attributes: Any) -> Optional[Span]:
+        """Finish the innermost open span of the given kind in the current lane."""
+        span = self.current(kind)
+        if span is not None:
+            self.finish(span, **attributes)
+        return span
+
+    def write(self):
+        """Append the spans to spans.jsonl, and write the run's Chrome trace."""
+        os.makedirs(self.directory, exist_ok=True)
+        spans = [span.to_dict(self.run_id, self.epoch) for span in self.spans]
+        with _spans_file_lock, open(os.path.join(self.directory, "spans.jsonl"), "a") as f:
+            for span in spans:
+                f.write(json.dumps(span, default=str) + "\n")
+        events = [{
+            "name": span.name,
+            "cat": span.kind,
+            "ph": "X",
+            "ts": round((span.start - self.epoch) * 1e6, 1),
+            "dur": round(((span.end or span.start) - span.start) * 1e6, 1),
+            "pid": 1,
+            "tid": span.lane,
+            "args": span.attributes,
+        } for span in self.spans]
+        with open(os.path.join(self.directory, f"{self.run_id}.trace.json"), "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"run_id": self.run_id}}, f, default=str)
+
+    def handler(self, asynchronous: bool = False) -> BaseCallbackHandler:
+        return AsyncTracingCallbackHandler(self) if asynchronous else TracingCallbackHandler(self)
+
+
+def current_tracer() -> Optional[Tracer]:
+    return _tracer.get()
+
+
+@contextmanager
+def trace_run(name: str, directory: Optional[str] = None, **attributes: Any) -> Iterator[Optional[Tracer]]:
+    """Trace everything run inside the block as one request, if tracing is on. Yields the tracer, or None."""
+    directory = directory or trace_dir()
+    if not directory:
+        yield None
+        return
+    tracer = Tracer(directory)
+    token = _tracer.set(tracer)
+    root = tracer.start("run", name, **attributes)
+    try:
+        yield tracer
+    except BaseException as e:
+        root.attributes["error"] = repr(e)
+        raise
+    finally:
+        tracer.finish(root)
+        _tracer.reset(token)
+        try:
+            tracer.write()
+        except OSError as e:
+            print(f"Error writing trace {tracer.run_id}: {e}")
+
+
+@contextmanager
+def span(kind: str, name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time the block as a span of the current request's trace. Yields None when the request isn't traced."""
+    tracer = _tracer.get()
+    if tracer is None:
+        yield None
+        return
+    s = tracer.start(kind, name, **attributes)
+    try:
+        yield s
+    except BaseException as e:
+        s.attributes["error"] = repr(e)
+        raise
+    finally:
+        tracer.finish(s)
+
+
+def payload_size(payload: Any) -> int:
+    if payload is None:
+        return 0
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    if isinstance(payload, str):
+        return len(payload.encode())
+    try:
+        return len(json.dumps(payload, default=str).encode())
+    except (TypeError, ValueError):
+        return 0
+
+
+def instrument_kubernetes_client(api_client: Any) -> Any:
+    """Record metrics, and a span when the request is traced, for every request the kubernetes (or kubernetes_asyncio) api client makes."""
+    request = api_client.request
+
+    def attributes(method: str, url: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {"service": "kubernetes", "verb": method, "path": urlparse(url).path,
+                "request_bytes": payload_size(kwargs.get("body"))}
+
+    def record(s: Optional[Span], method: str, url: str, start: float, response: Any = None, error: Any = None):
+        resource = apiserver_resource(urlparse(url).path)
+        status = getattr(response, "status", None) or getattr(error, "status", None) or "error"
+        APISERVER_REQUESTS.labels(method, resource, status).add(1)
+        APISERVER_SECONDS.labels(method, resource).observe(time.perf_counter() - start)
+        if s is not None and response is not None:
+            s.attributes["response_bytes"] = payload_size(getattr(response, "data", None))
+            s.attributes["status"] = status
+
+    if asyncio.iscoroutinefunction(request):
+        async def traced_request(method: str, url: str, *args: Any, **kwargs: Any) -> Any:
+            with span("http", f"kubernetes {method}", **attributes(method, url, kwargs)) as s:
+                start = time.perf_counter()
+                try:
+                    response = await request(method, url, *args, **kwargs)
+                except Exception as e:
+                    record(s, method, url, start, error=e)
+                    raise
+                record(s, method, url, start, response)
+                return response
+    else:
+        def traced_request(method: str, url: str, *args: Any, **kwargs: Any) -> Any:
+            with span("http", f"kubernetes {method}", **attributes(method, url, kwargs)) as s:
+                start = time.perf_counter()
+                try:
+                    response = request(method, url, *args, **kwargs)
+                except Exception as e:
+                    record(s, method, url, start, error=e)
+                    raise
+                record(s, method, url, start, response)
+                return response
+    api_client.request = traced_request
+    return api_client
+
+
+def instrument_gitlab_client(gl: Any) -> Any:
+    """Record metrics, and a span when the request is traced, for every request the python-gitlab client makes."""
+    http_request = gl.http_request
+
+    def traced_http_request(verb: str, path: str, *args: Any, **kwargs: Any) -> Any:
+        verb = verb.upper()
+        with span("http", f"gitlab {verb}", service="gitlab", verb=verb, path=path,
+                  request_bytes=payload_size(kwargs.get("post_data") or kwargs.get("json"))) as s:
+            start = time.perf_counter()
+            try:
+                response = http_request(verb.lower(), path, *args, **kwargs)
+            except Exception as e:
+                GITLAB_REQUESTS.labels(verb, getattr(e, "response_code", None) or "error").add(1)
+                GITLAB_SECONDS.labels(verb).observe(time.perf_counter() - start)
+                raise
+            GITLAB_REQUESTS.labels(verb, response.status_code).add(1)
+            GITLAB_SECONDS.labels(verb).observe(time.perf_counter() - start)
+            if s is not None:
+                s.attributes["response_bytes"] = len(response.content or b"")
+                s.attributes["status"] = response.status_code
+            return response
+    gl.http_request = traced_http_request
+    return gl
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Turns the callback events of chains, LLMs and tools into spans of a Tracer."""
+    tracer: Tracer
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+
+    @property
+    def always_verbose(self) -> bool:
+        # trace every chain, LLM and tool, not just the verbose ones
+        return True
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> Any:
+        self.tracer.start("llm", serialized.get("name", "llm"), prompts=len(prompts),
+                          prompt_bytes=sum(payload_size(prompt) for prompt in prompts), streamed_tokens=0)
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> Any:
+        span = self.tracer.current("llm")
+        if span is not None:
+            span.attributes["streamed_tokens"] += 1
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+        # streaming completions don't report token usage, streamed_tokens counts the completion tokens instead
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        self.tracer.end("llm", completion_bytes=sum(payload_size(generation.text)
+                                                    for generations in response.generations for generation in generations),
+                        **{key: value for key, value in token_usage.items()})
+
+    def on_llm_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> Any:
+        self.tracer.end("llm", error=repr(error))
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any) -> Any:
+        name = serialized.get("name", "chain")
+        self.tracer.start("agent" if name.endswith("Executor") else "chain", name, input_bytes=payload_size(inputs))
+
+    def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> Any:
+        self.end_chain(output_bytes=payload_size(outputs))
+
+    def on_chain_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> Any:
+        self.end_chain(error=repr(error))
+
+    def end_chain(self, **attributes: Any):
+        # chains and agents share the lane, the innermost of the two is the one ending
+        chain, agent = self.tracer.current("chain"), self.tracer.current("agent")
+        span = max((s for s in (chain, agent) if s is not None), key=lambda s: s.span_id, default=None)
+        if span is not None:
+            self.tracer.finish(span, **attributes)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> Any:
+        self.tracer.start("tool", serialized.get("name", "tool"), input_bytes=payload_size(input_str))
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> Any:
+        self.tracer.end("tool", output_bytes=payload_size(output))
+
+    def on_tool_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> Any:
+        self.tracer.end("tool", error=repr(error))
+
+    def on_text(self, text: str, **kwargs: Any) -> Any:
+        """Run on arbitrary text."""
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
+        """Run on agent action."""
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> Any:
+        """Run on agent end."""
+
+
+class AsyncTracingCallbackHandler(AsyncCallbackHandler):
+    """Async version of TracingCallbackHandler.
+
+    The async callback manager runs sync handlers on a thread pool, outside the task's context, so the lane
+    of an event would be lost. Async handlers run as tasks that copy the context.
+    """
+    handler: TracingCallbackHandler
+
+    def __init__(self, tracer: Tracer):
+        self.handler = TracingCallbackHandler(tracer)
+
+    @property
+    def always_verbose(self) -> bool:
+        return True
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self.handler.on_llm_start(serialized, prompts, **kwargs)
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.handler.on_llm_new_token(token, **kwargs)
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.handler.on_llm_end(response, **kwargs)
+
+    async def on_llm_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        self.handler.on_llm_error(error, **kwargs)
+
+    async def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any) -> None:
+        self.handler.on_chain_start(serialized, inputs, **kwargs)
+
+    async def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> None:
+        self.handler.on_chain_end(outputs, **kwargs)
+
+    async def on_chain_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        self.handler.on_chain_error(error, **kwargs)
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        self.handler.on_tool_start(serialized, input_str, **kwargs)
+
+    async def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        self.handler.on_tool_end(output, **kwargs)
+
+    async def on_tool_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        self.handler.on_tool_error(error, **kwargs)
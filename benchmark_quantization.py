@@ -0,0 +1,76 @@
+"""Recall@k against memory for the quantization modes of the numpy vector store.
+
+The vectors come from an existing docs index, the Kubernetes reference by default (run update_index.py first).
+A sample of them is held out as queries, the rest is written to a store per mode, and each mode's top k is
+compared with the exact top k of the float32 store, with and without re-ranking.
+
+    python benchmark_quantization.py [--index k8s_index] [--queries 200] [--k 4] [--rerank 64]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from doc_indexes.vector_store import NumpyVectorStore, is_numpy_store, normalize
+
+
+def load_vectors(directory: str) -> np.ndarray:
+    if is_numpy_store(directory):
+        return np.asarray(NumpyVectorStore(directory, None).vectors, dtype=np.float32)
+    from langchain.vectorstores import Chroma
+    embeddings = Chroma(persist_directory=directory)._collection.get(include=["embeddings"])["embeddings"]
+    if not embeddings:
+        raise SystemExit(f"No index in {directory}, build it with update_index.py first")
+    return normalize(np.asarray(embeddings, dtype=np.float32))
+
+
+def store_bytes(directory: str, names) -> int:
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in names if os.path.exists(os.path.join(directory, name)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", default="k8s_index")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--rerank", type=int, default=64)
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.index)
+    rng = np.random.default_rng(0)
+    held_out = rng.choice(len(vectors), min(args.queries, len(vectors) // 10), replace=False)
+    queries = vectors[held_out]
+    corpus = np.delete(vectors, held_out, axis=0)
+    ids = [str(i) for i in range(len(corpus))]
+    print(f"{len(corpus)} vectors of {corpus.shape[1]} dimensions, {len(queries)} held out queries, recall@{args.k}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        exact = NumpyVectorStore(os.path.join(directory, "exact"), None)
+        exact.upsert(ids, corpus, [""] * len(ids), [{}] * len(ids))
+        truth = [{row for row, _ in exact.search(query, args.k)} for query in queries]
+
+        print(f"{'mode':<10}{'scanned B/vec':>14}{'scanned MB':>12}{'recall':>8}{'reranked':>10}{'p50 ms':>8}")
+        for mode in (None, "int8", "pq"):
+            store_dir = os.path.join(directory, mode or "float32")
+            store = NumpyVectorStore(store_dir, None, quantization=mode, rerank=args.rerank)
+            store.upsert(ids, corpus, [""] * len(ids), [{}] * len(ids))
+            # the bytes a query has to read: the codes and codebook if quantized, the vectors otherwise
+            scanned = store_bytes(store.generation_directory, ("codes.npy", "codebook.npy") if mode else ("vectors.npy",))
+            recall = {}
+            latencies = []
+            for rerank in (0, args.rerank):
+                hits = 0
+                for query, expected in zip(queries, truth):
+                    start = time.perf_counter()
+                    found = {row for row, _ in store.search(query, args.k, rerank=rerank)}
+                    latencies.append(time.perf_counter() - start)
+                    hits += len(found & expected)
+                recall[rerank] = hits / (len(queries) * args.k)
+            print(f"{mode or 'float32':<10}{scanned / len(corpus):>14.1f}{scanned / 2 ** 20:>12.2f}{recall[0]:>8.3f}"
+                  f"{recall[args.rerank]:>10.3f}{np.percentile(latencies, 50) * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
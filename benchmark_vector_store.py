@@ -0,0 +1,113 @@
+"""Compare the Chroma and numpy vector stores on startup time, query latency and memory.
+
+Both stores are built from the same random vectors in a temporary directory, then each is opened and queried
+in a fresh process, so startup and RSS aren't skewed by the other store or by building it.
+
+    python benchmark_vector_store.py [--rows 20000] [--dim 512] [--queries 200] [--k 4]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+
+class FixedEmbeddings(Embeddings):
+    """Returns the vectors it was given, so the stores are timed and not the embeddings."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.queries = iter(())
+
+    def embed_documents(self, texts):
+        raise NotImplementedError("the benchmark adds precomputed vectors")
+
+    def embed_query(self, text):
+        return next(self.queries)
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def build(directory: str, rows: int, dim: int):
+    vectors = np.random.default_rng(0).standard_normal((rows, dim), dtype=np.float32)
+    ids = [str(i) for i in range(rows)]
+    texts = [f"chunk {i}" for i in ids]
+    metadatas = [{"source": "benchmark"}] * rows
+
+    from doc_indexes.vector_store import NumpyVectorStore
+    for dtype in ("float32", "float16"):
+        NumpyVectorStore(os.path.join(directory, dtype), FixedEmbeddings(dim), dtype=dtype).upsert(ids, vectors, texts, metadatas)
+
+    from langchain.vectorstores import Chroma
+    chroma = Chroma(persist_directory=os.path.join(directory, "chroma"), embedding_function=FixedEmbeddings(dim))
+    for i in range(0, rows, 1000):
+        chroma._collection.add(ids=ids[i:i + 1000], embeddings=vectors[i:i + 1000].tolist(),
+                               documents=texts[i:i + 1000], metadatas=metadatas[i:i + 1000])
+    chroma.persist()
+
+
+def worker(store: str, directory: str, dim: int, queries: int, k: int):
+    """Open one store, query it, and print the measurements as JSON."""
+    embeddings = FixedEmbeddings(dim)
+    baseline = rss_mb()
+    start = time.perf_counter()
+    if store == "chroma":
+        from langchain.vectorstores import Chroma
+        db = Chroma(persist_directory=os.path.join(directory, "chroma"), embedding_function=embeddings)
+    else:
+        from doc_indexes.vector_store import NumpyVectorStore
+        db = NumpyVectorStore(os.path.join(directory, store), embeddings)
+    embeddings.queries = iter(np.random.default_rng(1).standard_normal((queries + 1, dim)).tolist())
+    db.similarity_search("", k=k)
+    startup = time.perf_counter() - start
+    latencies = []
+    for _ in range(queries):
+        start = time.perf_counter()
+        db.similarity_search("", k=k)
+        latencies.append(time.perf_counter() - start)
+    print(json.dumps({"store": store, "startup_ms": startup * 1000,
+                      "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+                      "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+                      "rss_mb": rss_mb() - baseline}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker, args.directory, args.dim, args.queries, args.k)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Building {args.rows} vectors of {args.dim} dimensions")
+        build(directory, args.rows, args.dim)
+        print(f"{'store':<10}{'startup ms':>12}{'p50 ms':>10}{'p95 ms':>10}{'RSS MB':>10}")
+        for store in ("chroma", "float32", "float16"):
+            output = subprocess.run([sys.executable, __file__, "--worker", store, "--directory", directory,
+                                     "--dim", str(args.dim), "--queries", str(args.queries), "--k", str(args.k)],
+                                    capture_output=True, text=True, check=True).stdout
+            # chroma prints its own messages, the measurements are the last line
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{result['store']:<10}{result['startup_ms']:>12.1f}{result['p50_ms']:>10.2f}"
+                  f"{result['p95_ms']:>10.2f}{result['rss_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Embedding backends for the doc indexes.
+
+"openai" calls the OpenAI API. "hashed" runs locally on the CPU with no model download, so indexes can be built
+and queried offline. "sentence-transformers" runs a small local transformer, if the package is installed.
+"""
+import os
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+BACKENDS = ("openai", "hashed", "sentence-transformers")
+TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+
+
+class HashedNgramEmbeddings(Embeddings):
+    """Word unigrams and bigrams and character trigrams, hashed straight into dim signed buckets.
+
+    Counts are dampened with 1 + log(tf) and the vector is L2 normalized, so cosine similarity rewards shared
+    terms. Character trigrams match field names split or inflected differently, like "podSpec" and "pod spec".
+    There are no corpus statistics, so a text's vector never changes as the corpus does and incremental indexing
+    stays valid.
+    """
+    dim: int
+    model_name: str
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.model_name = f"hashed-ngram-{dim}"
+
+    def features(self, text: str) -> List[bytes]:
+        # split camelCase before lowercasing, so "progressDeadlineSeconds" also matches "progress deadline seconds"
+        words = TOKEN_REGEX.findall(re.sub(r"([a-z])([A-Z])", r"\1 \2", text).lower())
+        features = [word.encode() for word in words]
+        features += [f"{a} {b}".encode() for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [f"#{padded[i:i + 3]}".encode() for i in range(len(padded) - 2)]
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(feature) for feature in self.features(text)), dtype=np.uint32)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if hashes.size == 0:
+            return vector
+        # the low bits pick the bucket, the top bit the sign, so collisions tend to cancel out rather than add up
+        buckets, counts = np.unique(hashes, return_counts=True)
+        signs = np.where(buckets >> 31, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, buckets % self.dim, signs * (1.0 + np.log(counts)).astype(np.float32))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return np.stack([self.embed(text) for text in texts]).tolist() if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed(text).tolist()
+
+
+def new_embeddings(backend: Optional[str] = None) -> Embeddings:
+    """Create the embeddings of a backend, K8S_EMBEDDING_BACKEND by default."""
+    backend = backend or os.getenv("K8S_EMBEDDING_BACKEND", "openai")
+    if backend == "openai":
+        from langchain.embeddings import OpenAIEmbeddings
+        return OpenAIEmbeddings()
+    if backend == "hashed":
+        return HashedNgramEmbeddings(dim=int(os.getenv("K8S_HASHED_EMBEDDING_DIM", "512")))
+    if backend == "sentence-transformers":
+        # HuggingFaceEmbeddings imports sentence_transformers itself, and raises if it is missing
+        from langchain.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=os.getenv("K8S_SENTENCE_TRANSFORMER_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    raise ValueError(f"Unknown embedding backend {backend}, expected one of {', '.join(BACKENDS)}")
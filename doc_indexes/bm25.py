@@ -0,0 +1,127 @@
+"""BM25 inverted index over the chunks of a doc index, for questions that hinge on an exact token like a field name.
+
+Postings are kept in flat arrays (CSR style): the postings of term t are postings[offsets[t]:offsets[t + 1]], with
+the term's frequency in each chunk at the same positions in freqs. A lookup is a dict access and two slices,
+and the arrays are memory mapped when loaded.
+"""
+import json
+import os
+import re
+import shutil
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+WORD_REGEX = re.compile(r"[A-Za-z0-9]+")
+CAMEL_REGEX = re.compile(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words, plus the parts of camelCase words, so "progressDeadlineSeconds" matches as a whole and in parts."""
+    tokens = []
+    for word in WORD_REGEX.findall(text):
+        tokens.append(word.lower())
+        parts = CAMEL_REGEX.findall(word)
+        if len(parts) > 1:
+            tokens += [part.lower() for part in parts]
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over chunks identified by their ids. It's rebuilt as a whole when the chunks change."""
+    ids: List[str]
+    terms: Dict[str, int]
+    offsets: np.ndarray
+    postings: np.ndarray
+    freqs: np.ndarray
+    lengths: np.ndarray
+    idf: np.ndarray
+    norms: np.ndarray
+    k1: float
+    b: float
+
+    def __init__(self, ids: List[str], terms: Dict[str, int], offsets: np.ndarray, postings: np.ndarray, freqs: np.ndarray,
+                 lengths: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.ids = ids
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        self.freqs = freqs
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        # everything that doesn't depend on the query is computed once
+        document_freqs = np.diff(offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (len(ids) - document_freqs + 0.5) / (document_freqs + 0.5)).astype(np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 1.0
+        self.norms = (k1 * (1.0 - b + b * lengths / max(average_length, 1.0))).astype(np.float32)
+
+    @classmethod
+    def build(cls, ids: List[str], texts: Iterable[str]) -> "BM25Index":
+        terms: Dict[str, int] = {}
+        term_ids, doc_ids, freqs, lengths = [], [], [], []
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                term_ids.append(terms.setdefault(term, len(terms)))
+                doc_ids.append(doc)
+                freqs.append(freq)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        # a stable sort keeps each term's postings in chunk order
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=offsets[1:])
+        return cls(list(ids), terms, offsets, np.asarray(doc_ids, dtype=np.int32)[order],
+                   np.minimum(np.asarray(freqs, dtype=np.int64)[order], np.iinfo(np.uint16).max).astype(np.uint16),
+                   np.asarray(lengths, dtype=np.int32))
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[str, float]]:
+        """The ids of the k best chunks for the query and their scores, best first. Chunks matching no term are left out."""
+        term_ids = {self.terms[token] for token in tokenize(query) if token in self.terms}
+        if not term_ids:
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for t in term_ids:
+            start, end = self.offsets[t], self.offsets[t + 1]
+            docs = self.postings[start:end]
+            freqs = self.freqs[start:end].astype(np.float32)
+            # a term occurs once per chunk in its postings, so this never adds twice to the same chunk
+            scores[docs] += self.idf[t] * freqs * (self.k1 + 1.0) / (freqs + self.norms[docs])
+        matched = np.flatnonzero(scores)
+        k = min(k, len(matched))
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[doc], float(scores[doc])) for doc in top]
+
+    def save(self, directory: str):
+        """Write the index to directory, replacing whatever is there."""
+        tmp = directory.rstrip("/") + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        with open(os.path.join(tmp, "ids.json"), "w") as f:
+            json.dump(self.ids, f)
+        with open(os.path.join(tmp, "terms.json"), "w") as f:
+            # terms in id order, so the ids needn't be stored
+            json.dump(sorted(self.terms, key=self.terms.get), f)
+        for name in ("offsets", "postings", "freqs", "lengths"):
+            np.save(os.path.join(tmp, f"{name}.npy"), getattr(self, name))
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["BM25Index"]:
+        """The index in directory, or None if there is none."""
+        try:
+            with open(os.path.join(directory, "ids.json")) as f:
+                ids = json.load(f)
+            with open(os.path.join(directory, "terms.json")) as f:
+                terms = {term: i for i, term in enumerate(json.load(f))}
+        except FileNotFoundError:
+            return None
+        arrays = [np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in ("offsets", "postings", "freqs", "lengths")]
+        return cls(ids, terms, *arrays)
+
+    def __len__(self) -> int:
+        return len(self.ids)
@@ -0,0 +1,129 @@
+"""Chunking that follows the layout of the Kubernetes API reference.
+
+The reference is a sequence of type sections, each headed by the type's name alone on a line ("Deployment",
+"DeploymentSpec", ...), and a section lists its fields as "name (type)" or "name (type), required" lines
+followed by their description. A section is a parent: what the SME reads. Its fields, grouped up to
+child_size characters, are the children: what gets embedded and matched. Each child is prefixed with its
+section's name, so a field's chunk still says which type it belongs to.
+
+Text outside any section, all of it in documents without that layout, is cut into parent_size windows, with
+child_size children.
+"""
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from doc_indexes.manifest import chunk_id
+
+# bump when the chunks change, so existing indexes are re-chunked on their next update
+CHUNKING = "reference-sections-1"
+HEADING_REGEX = re.compile(r"^[A-Z][A-Za-z0-9]{2,60}$")
+FIELD_REGEX = re.compile(r"^[\s•*-]*[a-zA-Z$][\w$.-]* \((?:[^()]|\([^()]*\))+\)(, required)?\s*$")
+API_VERSION_REGEX = re.compile(r"^apiVersion: \S+$")
+
+
+class ReferenceSplitter:
+    child_size: int
+    parent_size: int
+
+    def __init__(self, child_size: int = 1000, parent_size: int = 4000):
+        self.child_size = child_size
+        self.parent_size = parent_size
+
+    def sections(self, text: str, resource: str = "") -> List[Tuple[str, str, str]]:
+        """(resource, title, text) of each type section, resource being the page the text before it was on.
+
+        Text before the first heading is a section with an empty title.
+        """
+        lines = [line.rstrip() for line in text.splitlines() if line.strip()]
+        sections: List[Tuple[str, str, List[str]]] = [(resource, "", [])]
+        for i, line in enumerate(lines):
+            following = lines[i + 1] if i + 1 < len(lines) else ""
+            # a heading is a lone type name starting a section: its description, which starts with the name, its
+            # apiVersion or its first field. A type name wrapped onto a line of its own in a description isn't one
+            if HEADING_REGEX.match(line) and (following.startswith(line) or API_VERSION_REGEX.match(following)
+                                              or FIELD_REGEX.match(following)):
+                previous = resource
+                if API_VERSION_REGEX.match(following) or following.startswith(f"{line} "):
+                    resource = line
+                title = line if not resource or line.startswith(resource) else f"{resource} {line}"
+                sections.append((previous, title, []))
+            sections[-1][2].append(line)
+        return [(resource, title, "\n".join(body)) for resource, title, body in sections if body]
+
+    def fields(self, text: str) -> List[str]:
+        """The text of a section cut at its field lines, and grouped up to child_size characters."""
+        entries: List[List[str]] = [[]]
+        for line in text.splitlines():
+            if FIELD_REGEX.match(line) and entries[-1]:
+                entries.append([])
+            entries[-1].append(line)
+        children, current = [], ""
+        for entry in ("\n".join(lines) for lines in entries if lines):
+            if current and len(current) + len(entry) + 1 > self.child_size:
+                children.append(current)
+                current = ""
+            current = f"{current}\n{entry}" if current else entry
+        if current:
+            children.append(current)
+        # a single field with a very long description is still split, so its vector isn't diluted, and every
+        # piece keeps the field's line
+        pieces = []
+        for child in children:
+            if len(child) <= self.child_size:
+                pieces.append(child)
+                continue
+            head, _, rest = child.partition("\n")
+            head = head if FIELD_REGEX.match(head) else ""
+            splitter = RecursiveCharacterTextSplitter(chunk_size=self.child_size - len(head) - 1, chunk_overlap=50, length_function=len)
+            pieces += [f"{head}\n{piece}" if head else piece for piece in splitter.split_text(rest if head else child)]
+        return pieces
+
+    def split_section(self, title: str, text: str, metadata: Dict[str, Any]) -> Tuple[Dict[str, Document], List[Document]]:
+        """The parents and children of one section."""
+        if title:
+            windows, pieces = [text], self.fields
+        else:
+            windows = RecursiveCharacterTextSplitter(chunk_size=self.parent_size, chunk_overlap=0, length_function=len).split_text(text)
+            pieces = RecursiveCharacterTextSplitter(chunk_size=self.child_size, chunk_overlap=50, length_function=len).split_text
+        parents: Dict[str, Document] = {}
+        children: List[Document] = []
+        for window in windows:
+            parent_id = chunk_id(metadata.get("source", ""), window)
+            parent_metadata = {**metadata, "section": title}
+            parents[parent_id] = Document(page_content=window, metadata=parent_metadata)
+            for piece in pieces(window):
+                content = f"{title}\n{piece}" if title and not piece.startswith(title) else piece
+                children.append(Document(page_content=content, metadata={**parent_metadata, "parent_id": parent_id}))
+        return parents, children
+
+    def split_stream(self, texts: Iterable[str], metadata: Dict[str, Any]) -> Iterator[Tuple[Dict[str, Document], List[Document]]]:
+        """Split a document arriving in consecutive pieces, like batches of pages, yielding each piece's complete sections.
+
+        The last section of a piece may continue in the next one, so it's held back until the next heading.
+        """
+        pending, resource = "", ""
+        for text in texts:
+            sections = self.sections(f"{pending}\n{text}" if pending else text, resource)
+            resource, title, pending = sections[-1] if sections else (resource, "", "")
+            # text outside any section would otherwise be held back until the end
+            if not title and len(pending) > 2 * self.parent_size:
+                pending = ""
+            else:
+                sections = sections[:-1]
+            for _, section_title, section_text in sections:
+                yield self.split_section(section_title, section_text, metadata)
+        if pending:
+            yield self.split_section(title, pending, metadata)
+
+    def split(self, documents: List[Document]) -> Tuple[Dict[str, Document], List[Document]]:
+        """The parents by id, and the children, each with the id of its parent in its parent_id metadata."""
+        parents: Dict[str, Document] = {}
+        children: List[Document] = []
+        for document in documents:
+            for section_parents, section_children in self.split_stream([document.page_content], document.metadata):
+                parents.update(section_parents)
+                children += section_children
+        return parents, children
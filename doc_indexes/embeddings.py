@@ -0,0 +1,248 @@
+"""Embedding pipeline for the doc indexes: token sized batches, run concurrently under a rate limit, with an on-disk cache.
+
+The cache keeps the vectors of one model in a float32 file that is memory mapped for reads and appended to
+for writes, with the text hashes in a sidecar, so any index built with the same model reuses earlier work.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+try:
+    import tiktoken
+except ImportError:
+    # the batch sizes only need to be roughly right, so without tiktoken tokens are estimated from the length
+    tiktoken = None
+
+# recent query vectors kept in memory, so a query embedded to look up a cache isn't embedded again to search
+QUERY_CACHE_SIZE = 64
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def model_name(embeddings: Embeddings) -> str:
+    """Name of the model behind an Embeddings, so vectors of different models never share a cache."""
+    for attribute in ("document_model_name", "model_name", "model"):
+        name = getattr(embeddings, attribute, None)
+        if isinstance(name, str) and name:
+            return name
+    return type(embeddings).__name__
+
+
+class EmbeddingCache:
+    """Vectors keyed by text hash, for one model.
+
+    <model>.f32 holds the rows, <model>.keys the hash of each row, one per line, and <model>.json the dimension.
+    Rows are only ever appended, and a row is written before its key, so an interrupted write is ignored on load,
+    and cut off both files so the next rows are appended right after the last complete one.
+    """
+    directory: str
+    model: str
+    dim: Optional[int]
+    rows: Dict[str, int]
+    matrix: Optional[np.ndarray]
+    lock: threading.Lock
+
+    def __init__(self, directory: str, model: str):
+        self.directory = directory
+        self.model = model
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        self.vectors_path = os.path.join(directory, f"{slug}.f32")
+        self.keys_path = os.path.join(directory, f"{slug}.keys")
+        self.meta_path = os.path.join(directory, f"{slug}.json")
+        self.dim = None
+        self.rows = {}
+        self.matrix = None
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path) as f:
+            self.dim = json.load(f)["dim"]
+        row_bytes = 4 * self.dim
+        complete_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        keys_bytes = 0
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "rb") as f:
+                for line in f:
+                    # a key without its newline was cut off mid-write
+                    if len(self.rows) >= complete_rows or not line.endswith(b"\n"):
+                        break
+                    self.rows[line.decode().strip()] = len(self.rows)
+                    keys_bytes += len(line)
+        # drop what an interrupted write left behind, or the rows appended next wouldn't line up with their keys
+        for path, size in ((self.vectors_path, len(self.rows) * row_bytes), (self.keys_path, keys_bytes)):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def mapped(self) -> np.ndarray:
+        """The matrix memory mapped, remapped when rows were appended since."""
+        if self.matrix is None or len(self.matrix) < len(self.rows):
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.rows), self.dim))
+        return self.matrix
+
+    def get_many(self, hashes: Sequence[str]) -> List[Optional[np.ndarray]]:
+        with self.lock:
+            if not self.rows:
+                return [None] * len(hashes)
+            matrix = self.mapped()
+            return [np.array(matrix[self.rows[h]]) if h in self.rows else None for h in hashes]
+
+    def put_many(self, hashes: Sequence[str], vectors: Sequence[Sequence[float]]):
+        rows = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            if self.dim is None:
+                self.dim = rows.shape[1]
+                with open(self.meta_path, "w") as f:
+                    json.dump({"model": self.model, "dim": self.dim}, f)
+            new = [(h, row) for h, row in zip(hashes, rows) if h not in self.rows]
+            if not new:
+                return
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.stack([row for _, row in new]).astype(np.float32).tobytes())
+            with open(self.keys_path, "a") as f:
+                f.write("".join(f"{h}\n" for h, _ in new))
+            for h, _ in new:
+                self.rows[h] = len(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class RateLimiter:
+    """Token bucket allowing rate units per second, in bursts of up to capacity."""
+    rate: float
+    capacity: float
+    available: float
+    updated: float
+    lock: threading.Lock
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        """Block until amount units are available. More than capacity is allowed, it just waits for a full bucket."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.rate
+            time.sleep(wait)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that run through the cache, and embed what it misses in token sized batches.
+
+    Batches of about batch_tokens tokens run max_concurrency at a time, limited to tokens_per_minute, and a batch
+    that fails is retried up to max_retries times with exponential backoff.
+    """
+    embeddings: Embeddings
+    cache: EmbeddingCache
+    batch_tokens: int
+    max_concurrency: int
+    max_retries: int
+    limiter: Optional[RateLimiter]
+    count_tokens: Callable[[str], int]
+    queries: "OrderedDict[str, List[float]]"
+    queries_lock: threading.Lock
+
+    def __init__(self, embeddings: Embeddings, cache_dir: Optional[str] = None, batch_tokens: int = None,
+                 max_concurrency: int = None, tokens_per_minute: int = None, max_retries: int = 6):
+        self.embeddings = embeddings
+        self.cache = EmbeddingCache(cache_dir or os.getenv("K8S_EMBEDDING_CACHE", "embedding_cache"), model_name(embeddings))
+        self.batch_tokens = batch_tokens or int(os.getenv("K8S_EMBEDDING_BATCH_TOKENS", "8000"))
+        self.max_concurrency = max_concurrency or int(os.getenv("K8S_EMBEDDING_CONCURRENCY", "4"))
+        tokens_per_minute = tokens_per_minute or int(os.getenv("K8S_EMBEDDING_TOKENS_PER_MINUTE", "1000000"))
+        self.limiter = RateLimiter(tokens_per_minute / 60.0, tokens_per_minute / 6.0)
+        self.max_retries = max_retries
+        self.count_tokens = token_counter(self.cache.model)
+        self.queries = OrderedDict()
+        self.queries_lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        vectors = self.cache.get_many(hashes)
+        # identical texts are embedded once
+        missing: Dict[str, str] = {}
+        for h, text, vector in zip(hashes, texts, vectors):
+            if vector is None:
+                missing.setdefault(h, text)
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed") as pool:
+                for batch in pool.map(self.embed_batch, self.batches(list(missing.items()))):
+                    self.cache.put_many([h for h, _ in batch[0]], batch[1])
+            vectors = self.cache.get_many(hashes)
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        # some models embed queries differently from documents, so queries aren't cached with them
+        with self.queries_lock:
+            if text in self.queries:
+                self.queries.move_to_end(text)
+                return self.queries[text]
+        vector = self.embeddings.embed_query(text)
+        with self.queries_lock:
+            self.queries[text] = vector
+            while len(self.queries) > QUERY_CACHE_SIZE:
+                self.queries.popitem(last=False)
+        return vector
+
+    def batches(self, items: List[tuple]) -> List[List[tuple]]:
+        """Group (hash, text) items into batches of about batch_tokens tokens."""
+        batches, batch, tokens = [], [], 0
+        for h, text in items:
+            n = self.count_tokens(text)
+            if batch and tokens + n > self.batch_tokens:
+                batches.append(batch)
+                batch, tokens = [], 0
+            batch.append((h, text))
+            tokens += n
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed_batch(self, batch: List[tuple]) -> tuple:
+        texts = [text for _, text in batch]
+        self.limiter.acquire(sum(self.count_tokens(text) for text in texts))
+        for attempt in range(self.max_retries + 1):
+            try:
+                return batch, self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+                print(f"Error embedding a batch of {len(texts)} texts, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+
+def token_counter(model: str) -> Callable[[str], int]:
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+            return lambda text: len(encoding.encode(text))
+        except KeyError:
+            pass
+    return lambda text: len(text) // 4 + 1
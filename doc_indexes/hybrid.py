@@ -0,0 +1,45 @@
+"""Retrieval that fuses the dense results of the vector store with the lexical results of the BM25 index."""
+import asyncio
+from typing import Callable, Dict, Hashable, List, Sequence
+
+from langchain.schema import BaseRetriever, Document
+from langchain.vectorstores.base import VectorStore
+
+from doc_indexes.bm25 import BM25Index
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[Document]], key: Callable[[Document], Hashable] = lambda d: d.page_content,
+                           k: int = 60) -> List[Document]:
+    """Merge rankings by the sum of 1 / (k + rank) of each document, so agreeing rankings win without comparing their scores."""
+    scores: Dict[Hashable, float] = {}
+    documents: Dict[Hashable, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            documents.setdefault(key(document), document)
+            scores[key(document)] = scores.get(key(document), 0.0) + 1.0 / (k + rank + 1)
+    return [documents[id] for id in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever(BaseRetriever):
+    """The best k of fetch_k dense and fetch_k lexical results. get_documents looks chunks up by id for the lexical side."""
+    vectordb: VectorStore
+    lexical: BM25Index
+    get_documents: Callable[[List[str]], List[Document]]
+    k: int
+    fetch_k: int
+
+    def __init__(self, vectordb: VectorStore, lexical: BM25Index, get_documents: Callable[[List[str]], List[Document]],
+                 k: int = 4, fetch_k: int = 20):
+        self.vectordb = vectordb
+        self.lexical = lexical
+        self.get_documents = get_documents
+        self.k = k
+        self.fetch_k = fetch_k
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        dense = self.vectordb.similarity_search(query, k=self.fetch_k)
+        lexical = self.get_documents([id for id, _ in self.lexical.search(query, self.fetch_k)])
+        return reciprocal_rank_fusion([dense, lexical])[:self.k]
+
+    async def aget_relevant_documents(self, query: str) -> List[Document]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_relevant_documents, query)
@@ -0,0 +1,83 @@
+"""Streaming ingestion of large PDFs.
+
+Pages are parsed in batches by a process pool with pdfminer (the parser unstructured uses for PDFs), with a
+bounded number of batches in flight and their text handed on in page order as it's ready. That way splitting
+and embedding start after the first batch, and memory holds a few batches rather than the whole document.
+"""
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+
+def page_count(path: str) -> int:
+    from pdfminer.pdfpage import PDFPage
+    with open(path, "rb") as f:
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+
+def extract_pages(path: str, first: int, last: int) -> str:
+    """Text of pages first to last - 1. Runs in the worker processes, so it opens the file itself."""
+    from pdfminer.high_level import extract_text
+    return extract_text(path, page_numbers=range(first, last))
+
+
+def iter_page_batches(path: str, batch_pages: Optional[int] = None, workers: Optional[int] = None) -> Iterator[str]:
+    """Text of path batch_pages pages at a time, in order, parsed by workers processes.
+
+    Up to two batches per worker are parsed ahead of the one being consumed, and no more, so a slow consumer
+    holds the parsing back instead of piling text up.
+    """
+    batch_pages = batch_pages or int(os.getenv("K8S_INGEST_BATCH_PAGES", "20"))
+    workers = workers or int(os.getenv("K8S_INGEST_WORKERS", "0")) or os.cpu_count() or 1
+    pages = page_count(path)
+    ranges = iter([(first, min(first + batch_pages, pages)) for first in range(0, pages, batch_pages)])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for first, last in ranges:
+            pending.append(pool.submit(extract_pages, path, first, last))
+            if len(pending) == 2 * workers:
+                break
+        while pending:
+            text = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(pool.submit(extract_pages, path, *next_range))
+            yield text
+
+
+def consume_in_background(items: Iterable[Any], handle: Callable[[Any], None], max_pending: int = 4):
+    """Call handle on each of items in a background thread, while items keeps being produced in this one.
+
+    At most max_pending items wait for handle, after which producing them blocks. An error in handle stops
+    both sides, and is raised here.
+    """
+    pending: "queue.Queue" = queue.Queue(maxsize=max_pending)
+    done = object()
+    errors: List[BaseException] = []
+
+    def consume():
+        while True:
+            item = pending.get()
+            if item is done:
+                return
+            if not errors:
+                try:
+                    handle(item)
+                except BaseException as e:
+                    errors.append(e)
+
+    thread = threading.Thread(target=consume, name="ingest-consumer", daemon=True)
+    thread.start()
+    try:
+        for item in items:
+            if errors:
+                break
+            pending.put(item)
+    finally:
+        pending.put(done)
+        thread.join()
+    if errors:
+        raise errors[0]
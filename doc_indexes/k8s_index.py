@@ -1,26 +1,304 @@
+import hashlib
+import os
+from tempfile import NamedTemporaryFile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import requests
 from langchain.indexes import VectorstoreIndexCreator
 from langchain.indexes.vectorstore import VectorStoreIndexWrapper
-from langchain.document_loaders import UnstructuredPDFLoader, OnlinePDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.schema import BaseRetriever, Document
 from langchain.vectorstores import Chroma
-from langchain.embeddings import OpenAIEmbeddings
+from langchain.vectorstores.base import VectorStore
+
+from doc_indexes.backends import new_embeddings
+from doc_indexes.bm25 import BM25Index
+from doc_indexes.chunking import CHUNKING, ReferenceSplitter
+from doc_indexes.embeddings import CachedEmbeddings, token_counter
+from doc_indexes.hybrid import HybridRetriever
+from doc_indexes.ingestion import consume_in_background, iter_page_batches
+from doc_indexes.manifest import IndexManifest, chunk_id
+from doc_indexes.parents import ParentDocumentRetriever, ParentStore
+from doc_indexes.vector_store import NumpyVectorStore, is_numpy_store
+
+# chunks are written to the store in batches of this many, after they have all been embedded
+ADD_BATCH_SIZE = 1000
+# new chunks are handed to the embeddings this many at a time, which batch them further by tokens
+EMBED_BATCH_SIZE = 256
+STORES = ("chroma", "numpy")
+
 
 class KubernetesIndex():
-    vectordb: Chroma
+    """The reference docs in a vector store.
+
+    backend is the embedding backend (see doc_indexes.backends). An existing index is always queried with the
+    backend that built it; updating it with another backend re-embeds every chunk.
+    store is "chroma" or "numpy" (see doc_indexes.vector_store), K8S_VECTOR_STORE by default. An existing
+    index keeps the store it was built in, and switching stores re-embeds nothing, the vectors come from the cache.
+    The numpy store is quantized with K8S_VECTOR_QUANTIZATION ("int8" or "pq") from the next update.
+    A BM25 index of the same chunks is kept in bm25/, and retrieval fuses both unless K8S_HYBRID_SEARCH is false.
+    The chunks are small pieces of the reference's sections (see doc_indexes.chunking), and retrieval returns
+    the sections they were cut from, up to K8S_SME_CONTEXT_TOKENS tokens.
+    An index updated by another process is picked up by refresh().
+    """
+    vectordb: VectorStore
+    lexical: Optional[BM25Index]
+    parents: ParentStore
+    manifest_stat: Optional[Tuple[int, int]] = None
+    manifest_hash: str = "empty"
+    loaded_version: str
+    embeddings: CachedEmbeddings
+    backend: str
+    store: str
     persistence_path: str
     doc_url: str
-    def __init__(self, doc_url: str, persistence_path: str = "k8s_index"):
+    def __init__(self, doc_url: str, persistence_path: str = "k8s_index", backend: Optional[str] = None, store: Optional[str] = None):
         self.doc_url = doc_url
         self.persistence_path = persistence_path
-        self.vectordb = Chroma(persist_directory=persistence_path, embedding_function=OpenAIEmbeddings())
-        
-    def update_index(self):
-        loader = OnlinePDFLoader(self.doc_url)
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=50,
-            length_function=len,
-        )
-        split_docs = text_splitter.split_documents(loader.load())
-        embedding = OpenAIEmbeddings()
-        self.vectordb = Chroma.from_documents(documents=split_docs, embedding=embedding, persist_directory=self.persistence_path)
+        manifest = IndexManifest.load(persistence_path)
+        built_with = built_with_backend(manifest)
+        self.backend = backend or built_with or os.getenv("K8S_EMBEDDING_BACKEND", "openai")
+        if built_with is not None and self.backend != built_with:
+            print(f"The index in {persistence_path} was built with the {built_with} embeddings, it has to be updated before it can be queried with {self.backend}")
+        self.embeddings = CachedEmbeddings(new_embeddings(self.backend))
+        self.store = store or built_in_store(persistence_path) or os.getenv("K8S_VECTOR_STORE", "chroma")
+        if self.store not in STORES:
+            raise ValueError(f"Unknown vector store {self.store}, expected one of {', '.join(STORES)}")
+        self.loaded_version = self.version()
+        self.vectordb = self.open_store()
+        self.lexical = BM25Index.load(os.path.join(persistence_path, "bm25"))
+        self.parents = ParentStore(persistence_path)
+
+    def open_store(self) -> VectorStore:
+        if self.store == "chroma":
+            return Chroma(persist_directory=self.persistence_path, embedding_function=self.embeddings)
+        return NumpyVectorStore(self.persistence_path, self.embeddings, dtype=os.getenv("K8S_VECTOR_DTYPE", "float32"),
+                                quantization=os.getenv("K8S_VECTOR_QUANTIZATION") or None,
+                                rerank=int(os.getenv("K8S_VECTOR_RERANK", "64")))
+
+    def refresh(self) -> bool:
+        """Reopen the store, BM25 index and parents if the index changed since they were opened. Returns whether it did.
+
+        The numpy store is reopened in place, so retrievers made by as_retriever() see its new rows; they still
+        hold the old BM25 index and parents, and should be made again.
+        """
+        version = self.version()
+        if version == self.loaded_version:
+            return False
+        if isinstance(self.vectordb, NumpyVectorStore):
+            self.vectordb.refresh()
+        else:
+            # Chroma loads its collections when it's created
+            self.vectordb = self.open_store()
+        self.lexical = BM25Index.load(os.path.join(self.persistence_path, "bm25"))
+        self.parents = ParentStore(self.persistence_path)
+        self.loaded_version = version
+        return True
+
+    def as_retriever(self, k: int = 4) -> BaseRetriever:
+        """Hybrid retrieval when there is a BM25 index, dense retrieval otherwise, returning the matches' parent sections."""
+        # a parent usually has several matching children, so more children are fetched than parents returned
+        child_k = 2 * k if len(self.parents) else k
+        if self.lexical is None or os.getenv("K8S_HYBRID_SEARCH", "true").lower() == "false":
+            retriever = self.vectordb.as_retriever(search_kwargs={"k": child_k})
+        else:
+            retriever = HybridRetriever(self.vectordb, self.lexical, self.get_documents, k=child_k)
+        if not len(self.parents):
+            return retriever
+        return ParentDocumentRetriever(retriever, self.parents, token_counter("gpt-3.5-turbo"), k=k,
+                                       max_tokens=int(os.getenv("K8S_SME_CONTEXT_TOKENS", "3000")))
+
+    def get_documents(self, ids: List[str]) -> List[Document]:
+        if isinstance(self.vectordb, NumpyVectorStore):
+            return self.vectordb.get_by_ids(ids)
+        if not ids:
+            return []
+        found = self.vectordb._collection.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {id: Document(page_content=text, metadata=metadata or {})
+                 for id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])}
+        return [by_id[id] for id in ids if id in by_id]
+
+    def rebuild_lexical(self):
+        """Rebuild the BM25 index from the chunks in the store."""
+        if isinstance(self.vectordb, NumpyVectorStore):
+            records = self.vectordb.read_rows(range(len(self.vectordb)))
+            ids, texts = [r["id"] for r in records], [r["text"] for r in records]
+        else:
+            stored = self.vectordb._collection.get(include=["documents"])
+            ids, texts = stored["ids"], stored["documents"]
+        self.lexical = BM25Index.build(ids, texts)
+        self.lexical.save(os.path.join(self.persistence_path, "bm25"))
+
+    def version(self) -> str:
+        """Changes whenever an update changes the index, even one made by another process."""
+        try:
+            stat = os.stat(os.path.join(self.persistence_path, "manifest.json"))
+        except FileNotFoundError:
+            return "empty"
+        # the manifest is rewritten by every update that changes anything, so its hash identifies the content
+        if (stat.st_mtime_ns, stat.st_size) != self.manifest_stat:
+            self.manifest_stat = (stat.st_mtime_ns, stat.st_size)
+            self.manifest_hash = file_hash(os.path.join(self.persistence_path, "manifest.json"))[:16]
+        return self.manifest_hash
+
+    def embedding_record(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "model": self.embeddings.cache.model}
+
+    def update_index(self, force: bool = False) -> Dict[str, Any]:
+        """Bring the index up to date with the document, embedding only the chunks that are new.
+
+        Chunks are identified by a hash of their normalized text, so unchanged chunks keep their vectors and
+        chunks that disappeared from the document are deleted. When the document's version (its ETag, or the
+        hash of its content) matches the manifest, nothing is downloaded again, parsed or embedded.
+        Returns the number of chunks added, removed and kept.
+        """
+        manifest = IndexManifest.load(self.persistence_path)
+        if manifest is None:
+            manifest = IndexManifest(os.path.join(self.persistence_path, "manifest.json"))
+            # an index built before the manifest existed holds vectors under random ids, often duplicated
+            existing = set(self.stored_ids())
+        elif built_with_backend(manifest) != self.backend or manifest.embedding not in (None, self.embedding_record()):
+            # vectors of different models can't be compared, so everything is embedded again
+            self.write_chunks([], [], {}, self.stored_ids())
+            manifest.documents.clear()
+            existing = set()
+        else:
+            entry = manifest.documents.get(self.doc_url)
+            # a store switched to since the last update starts out empty
+            existing = set(entry.chunk_ids) & set(self.stored_ids()) if entry else set()
+        manifest.embedding = self.embedding_record()
+        previous = manifest.documents.get(self.doc_url)
+        # a store that is missing chunks of the manifest, or chunked differently, needs the document again even if it didn't change
+        complete = previous is not None and existing == set(previous.chunk_ids) and manifest.chunking == CHUNKING
+        path, version = fetch_document(self.doc_url, previous.version if complete and not force else None)
+        if path is None:
+            if isinstance(self.vectordb, NumpyVectorStore):
+                self.vectordb.requantize()
+            if self.lexical is None:
+                self.rebuild_lexical()
+            return {"source": self.doc_url, "version": version, "unchanged": True, "added": 0, "removed": 0, "kept": len(existing)}
+        parents: Dict[str, Document] = {}
+        by_id: Dict[str, Document] = {}
+        added: List[str] = []
+        vectors: List[np.ndarray] = []
+
+        def new_chunks() -> Iterator[Tuple[List[str], List[str]]]:
+            """Split the document as its pages are parsed, and yield the ids and texts of new chunks in embedding batches."""
+            ids: List[str] = []
+            for section_parents, section_chunks in self.split_pages(self.load_pages(path)):
+                parents.update(section_parents)
+                for chunk in section_chunks:
+                    id = chunk_id(self.doc_url, chunk.page_content)
+                    # identical chunks of the same document share an id, so only the first is kept
+                    if id in by_id:
+                        continue
+                    by_id[id] = chunk
+                    if id not in existing:
+                        ids.append(id)
+                if len(ids) >= EMBED_BATCH_SIZE:
+                    yield ids, [by_id[id].page_content for id in ids]
+                    ids = []
+            if ids:
+                yield ids, [by_id[id].page_content for id in ids]
+
+        def embed(batch: Tuple[List[str], List[str]]):
+            ids, texts = batch
+            vectors.append(np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32))
+            added.extend(ids)
+
+        try:
+            # parsing, splitting and embedding overlap, the embedding running in a thread of its own
+            consume_in_background(new_chunks(), embed)
+        finally:
+            if path != self.doc_url:
+                os.remove(path)
+        removed = [id for id in existing if id not in by_id]
+        self.write_chunks(added, np.concatenate(vectors) if vectors else [], by_id, removed)
+        self.rebuild_lexical()
+        self.parents.replace_source(self.doc_url, parents)
+        manifest.chunking = CHUNKING
+        manifest.set(self.doc_url, version, list(by_id))
+        manifest.save()
+        return {"source": self.doc_url, "version": version, "unchanged": False,
+                "added": len(added), "removed": len(removed), "kept": len(by_id) - len(added)}
+
+    def stored_ids(self) -> List[str]:
+        if isinstance(self.vectordb, NumpyVectorStore):
+            return self.vectordb.ids()
+        return self.vectordb._collection.get(include=[])["ids"]
+
+    def write_chunks(self, added: List[str], vectors: Any, by_id: Dict[str, Document], removed: List[str]):
+        """Add the chunks in added with their vectors, and delete the ids in removed."""
+        if isinstance(self.vectordb, NumpyVectorStore):
+            # the numpy store is rewritten as a whole, so it's done in one go
+            self.vectordb.upsert(added, vectors, [by_id[id].page_content for id in added],
+                                 [by_id[id].metadata for id in added], delete=removed)
+            return
+        for i in range(0, len(added), ADD_BATCH_SIZE):
+            batch = added[i:i + ADD_BATCH_SIZE]
+            self.vectordb._collection.add(ids=batch, embeddings=np.asarray(vectors[i:i + ADD_BATCH_SIZE]).tolist(),
+                                          documents=[by_id[id].page_content for id in batch],
+                                          metadatas=[by_id[id].metadata for id in batch])
+        if removed:
+            self.vectordb._collection.delete(ids=removed)
+        self.vectordb.persist()
+
+    def load_pages(self, path: str) -> Iterator[str]:
+        """The text of the PDF at path, a batch of pages at a time."""
+        return iter_page_batches(path)
+
+    def split_pages(self, pages: Iterable[str]) -> Iterator[Tuple[Dict[str, Document], List[Document]]]:
+        """The parent sections by id and the chunks to index, as the pages come in."""
+        return ReferenceSplitter(child_size=1000, parent_size=4000).split_stream(pages, {"source": self.doc_url})
+
+
+def built_in_store(persistence_path: str) -> Optional[str]:
+    """The store an existing index was built in, None if there is no index yet."""
+    if is_numpy_store(persistence_path):
+        return "numpy"
+    if os.path.exists(os.path.join(persistence_path, "chroma-collections.parquet")):
+        return "chroma"
+    return None
+
+
+def built_with_backend(manifest: Optional[IndexManifest]) -> Optional[str]:
+    """The embedding backend that built the index. Manifests from before backends were recorded are all openai."""
+    if manifest is None:
+        return None
+    return manifest.embedding["backend"] if manifest.embedding else "openai"
+
+
+def fetch_document(source: str, previous_version: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """Return a local path to the document and its version, or (None, version) if it still has previous_version.
+
+    source is a URL or a local path. A downloaded document is spooled to a temporary file the caller removes;
+    a local path is returned as is.
+    """
+    if not source.startswith(("http://", "https://")):
+        version = f"sha256:{file_hash(source)}"
+        return (None, version) if version == previous_version else (source, version)
+    headers = {}
+    if previous_version and previous_version.startswith("etag:"):
+        headers["If-None-Match"] = previous_version[len("etag:"):]
+    with requests.get(source, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 304:
+            return None, previous_version
+        response.raise_for_status()
+        with NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            for block in response.iter_content(1 << 20):
+                f.write(block)
+            path = f.name
+        etag = response.headers.get("ETag")
+    version = f"etag:{etag}" if etag else f"sha256:{file_hash(path)}"
+    if version == previous_version:
+        os.remove(path)
+        return None, version
+    return path, version
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
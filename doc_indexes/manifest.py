@@ -0,0 +1,79 @@
+"""Manifest of the documents in an index: their versions and the chunks they contributed."""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+
+class DocumentEntry:
+    """One indexed document. version is whatever identifies its content: an ETag, or a sha256 of the file."""
+    source: str
+    version: Optional[str]
+    chunk_ids: List[str]
+    indexed_at: float
+
+    def __init__(self, source: str, version: Optional[str] = None, chunk_ids: Optional[List[str]] = None, indexed_at: float = 0.0):
+        self.source = source
+        self.version = version
+        self.chunk_ids = chunk_ids or []
+        self.indexed_at = indexed_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"source": self.source, "version": self.version, "chunk_ids": self.chunk_ids, "indexed_at": self.indexed_at}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "DocumentEntry":
+        return cls(d["source"], d.get("version"), d.get("chunk_ids", []), d.get("indexed_at", 0.0))
+
+
+class IndexManifest:
+    """Kept as manifest.json next to the index, so an update knows what is already embedded without asking the store.
+
+    embedding records the backend and model that built the index, since it can only be queried with the same one.
+    chunking records how the documents were chunked, so a new chunker re-chunks documents that didn't change.
+    """
+    path: str
+    documents: Dict[str, DocumentEntry]
+    embedding: Optional[Dict[str, Any]]
+    chunking: Optional[str]
+
+    def __init__(self, path: str, documents: Optional[Dict[str, DocumentEntry]] = None, embedding: Optional[Dict[str, Any]] = None,
+                 chunking: Optional[str] = None):
+        self.path = path
+        self.documents = documents or {}
+        self.embedding = embedding
+        self.chunking = chunking
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["IndexManifest"]:
+        """Load the manifest of the index in directory, or None if the index has none yet."""
+        path = os.path.join(directory, "manifest.json")
+        try:
+            with open(path) as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(path, {source: DocumentEntry.from_dict(entry) for source, entry in d.get("documents", {}).items()},
+                   d.get("embedding"), d.get("chunking"))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # write and rename, so an interrupted update leaves the previous manifest in place
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"embedding": self.embedding, "chunking": self.chunking,
+                       "documents": {source: entry.to_dict() for source, entry in self.documents.items()}}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def set(self, source: str, version: Optional[str], chunk_ids: List[str]):
+        self.documents[source] = DocumentEntry(source, version, chunk_ids, time.time())
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace, so re-extracting the same text with different line breaks hashes the same."""
+    return " ".join(text.split())
+
+
+def chunk_id(source: str, text: str) -> str:
+    """Content hash of a chunk, scoped to its document so two documents never share a chunk."""
+    return hashlib.sha256(f"{source}\0{normalize_text(text)}".encode()).hexdigest()[:32]
@@ -0,0 +1,271 @@
+"""Index of the cluster's API schema, from the apiserver's /openapi/v2 document, CRDs included.
+
+Only the definitions are kept, trimmed to what describes a field: type, format, $ref, items, additionalProperties,
+description, default, enum and required. They're saved as gzipped JSON with the ETag of the document, so a
+restart asks the apiserver whether the schema changed instead of downloading it again.
+A kind is found with one dict lookup, and a field path with one lookup per segment.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from kubernetes.client.exceptions import ApiException
+
+from tools.k8s_explorer.tool import singular_resource_type
+
+FIELD_KEYS = ("type", "format", "$ref", "description", "default", "enum")
+FORMAT_VERSION = 1
+VERSION_REGEX = re.compile(r"^v(\d+)(?:(alpha|beta)(\d+))?$")
+
+
+def trim_property(schema: Dict[str, Any]) -> Dict[str, Any]:
+    trimmed = {key: schema[key] for key in FIELD_KEYS if key in schema}
+    for key in ("items", "additionalProperties"):
+        if isinstance(schema.get(key), dict):
+            trimmed[key] = trim_property(schema[key])
+    return trimmed
+
+
+def trim_definition(definition: Dict[str, Any]) -> Dict[str, Any]:
+    trimmed = trim_property(definition)
+    if "required" in definition:
+        trimmed["required"] = definition["required"]
+    if "properties" in definition:
+        trimmed["properties"] = {name: trim_property(schema) for name, schema in definition["properties"].items()}
+    return trimmed
+
+
+def version_rank(version: str) -> Tuple[int, int, int]:
+    """Sort key putting stable versions first, then beta, then alpha, newest first within each."""
+    match = VERSION_REGEX.match(version)
+    if match is None:
+        return (3, 0, 0)
+    major, stage, minor = match.groups()
+    return ({None: 0, "beta": 1, "alpha": 2}[stage], -int(major), -int(minor or 0))
+
+
+class SchemaField:
+    """What the schema says about one field."""
+    kind: str
+    group_version: str
+    path: str
+    type: str
+    description: str
+    required: bool
+    default: Any
+    enum: Optional[List[Any]]
+    children: Dict[str, Dict[str, Any]]
+    required_children: List[str]
+
+    def __init__(self, kind: str, group_version: str, path: str, schema: Dict[str, Any], required: bool,
+                 definition: Optional[Dict[str, Any]], type_name: str):
+        self.kind = kind
+        self.group_version = group_version
+        self.path = path
+        self.type = type_name
+        self.description = schema.get("description") or (definition or {}).get("description", "")
+        self.required = required
+        self.default = schema.get("default")
+        self.enum = schema.get("enum")
+        self.children = (definition or {}).get("properties", {})
+        self.required_children = (definition or {}).get("required", [])
+
+    def to_text(self) -> str:
+        name = f"{self.kind}.{self.path}" if self.path else self.kind
+        lines = [f"{name} ({self.group_version}): {self.type}{', required' if self.required else ''}"]
+        if self.default is not None:
+            lines.append(f"Default: {json.dumps(self.default)}")
+        if self.enum:
+            lines.append(f"One of: {', '.join(str(value) for value in self.enum)}")
+        if self.description:
+            lines.append(self.description)
+        if self.children:
+            lines.append("Fields:")
+            lines += [f"  {child}{' (required)' if child in self.required_children else ''}: {schema_type(schema)}"
+                      for child, schema in sorted(self.children.items())]
+        return "\n".join(lines)
+
+
+def schema_type(schema: Dict[str, Any]) -> str:
+    if "$ref" in schema:
+        return schema["$ref"].rsplit(".", 1)[-1]
+    if schema.get("type") == "array":
+        return "[]" + schema_type(schema.get("items", {}))
+    if schema.get("type") == "object" and "additionalProperties" in schema:
+        return "map[string]" + schema_type(schema["additionalProperties"])
+    type_name = schema.get("type", "object")
+    return f"{type_name} ({schema['format']})" if "format" in schema else type_name
+
+
+class OpenAPISchemaIndex:
+    """The trimmed definitions of one cluster's schema, and its kinds by lowercased name and by group/version/kind."""
+    etag: Optional[str]
+    definitions: Dict[str, Dict[str, Any]]
+    kinds: Dict[str, str]
+    kinds_by_name: Dict[str, List[Tuple[str, str]]]
+
+    def __init__(self, etag: Optional[str], definitions: Dict[str, Dict[str, Any]], kinds: Dict[str, str]):
+        self.etag = etag
+        self.definitions = definitions
+        self.kinds = kinds
+        self.kinds_by_name = {}
+        for gvk in kinds:
+            group_version, kind = gvk.rsplit("/", 1)
+            self.kinds_by_name.setdefault(kind.lower(), []).append((group_version, gvk))
+        for candidates in self.kinds_by_name.values():
+            # core first, then the most stable version, so "deployment" is apps/v1 and not a beta
+            candidates.sort(key=lambda c: (version_rank(c[0].rsplit("/", 1)[-1]), "/" in c[0], c[0]))
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any], etag: Optional[str] = None) -> "OpenAPISchemaIndex":
+        definitions = {name: trim_definition(definition) for name, definition in document.get("definitions", {}).items()}
+        kinds = {}
+        for name, definition in document.get("definitions", {}).items():
+            for gvk in definition.get("x-kubernetes-group-version-kind", []):
+                group_version = f"{gvk['group']}/{gvk['version']}" if gvk.get("group") else gvk["version"]
+                key = f"{group_version}/{gvk['kind']}"
+                # the shared meta types (DeleteOptions, WatchEvent) claim a kind in every group, a group's own definition wins
+                if name.startswith("io.k8s.apimachinery.pkg.apis.meta."):
+                    kinds.setdefault(key, name)
+                else:
+                    kinds[key] = name
+        return cls(etag, definitions, kinds)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with gzip.open(path + ".tmp", "wt") as f:
+            json.dump({"format": FORMAT_VERSION, "etag": self.etag, "kinds": self.kinds, "definitions": self.definitions},
+                      f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["OpenAPISchemaIndex"]:
+        try:
+            with gzip.open(path, "rt") as f:
+                d = json.load(f)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        if d.get("format") != FORMAT_VERSION:
+            return None
+        return cls(d["etag"], d["definitions"], d["kinds"])
+
+    def resolve_kind(self, kind: str) -> Optional[str]:
+        """The group/version/kind of "Deployment", "deployments", "apps/v1/Deployment" or "v1/Pod", None if unknown."""
+        if kind in self.kinds:
+            return kind
+        group_version, _, name = kind.rpartition("/")
+        name = name.lower()
+        singular = singular_resource_type(name, self.kinds_by_name)
+        candidates = self.kinds_by_name[singular] if singular else []
+        for candidate_group_version, gvk in candidates:
+            if not group_version or candidate_group_version.lower() == group_version.lower():
+                return gvk
+        return None
+
+    def lookup(self, kind: str, path: str = "") -> Optional[SchemaField]:
+        """The field at the dotted path of kind, or the kind itself for an empty path. None if either is unknown.
+
+        Array and map fields are walked through to their items, so "spec.containers.image" and
+        "spec.containers[0].image" both work.
+        """
+        gvk = self.resolve_kind(kind)
+        if gvk is None:
+            return None
+        group_version, kind_name = gvk.rsplit("/", 1)
+        schema: Dict[str, Any] = {"$ref": f"#/definitions/{self.kinds[gvk]}"}
+        definition = self.definitions[self.kinds[gvk]]
+        required = False
+        segments = [segment for segment in re.sub(r"\[[^\]]*\]", "", path).split(".") if segment]
+        for segment in segments:
+            properties = definition.get("properties", {}) if definition else {}
+            if segment not in properties:
+                # field names are camelCase, but questions often aren't
+                matches = [name for name in properties if name.lower() == segment.lower()]
+                if not matches:
+                    return None
+                segment = matches[0]
+            required = segment in definition.get("required", [])
+            schema = properties[segment]
+            definition = self.definition_of(schema)
+        return SchemaField(kind_name, group_version, ".".join(segments), schema, required, definition,
+                           schema_type(schema) if segments else kind_name)
+
+    def definition_of(self, schema: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The object definition a field leads to, through arrays and maps."""
+        while True:
+            if "$ref" in schema:
+                return self.definitions.get(schema["$ref"].rsplit("/", 1)[-1])
+            if "properties" in schema:
+                return schema
+            if "items" in schema:
+                schema = schema["items"]
+            elif isinstance(schema.get("additionalProperties"), dict):
+                schema = schema["additionalProperties"]
+            else:
+                return None
+
+
+def fetch_openapi(api_client: Any, etag: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """The apiserver's /openapi/v2 document and its ETag, or (None, etag) if it still has etag."""
+    headers = {"Accept": "application/json"}
+    if etag:
+        headers["If-None-Match"] = etag
+    try:
+        response, _, response_headers = api_client.call_api("/openapi/v2", "GET", header_params=headers,
+                                                            auth_settings=["BearerToken"], _preload_content=False,
+                                                            _request_timeout=120)
+    except ApiException as e:
+        if e.status == 304:
+            return None, etag
+        raise
+    body = response.data
+    new_etag = response_headers.get("ETag") or f'"sha256:{hashlib.sha256(body).hexdigest()}"'
+    if new_etag == etag:
+        return None, etag
+    return json.loads(body), new_etag
+
+
+class ClusterSchema:
+    """The schema index of a cluster, loaded from disk, checked against the apiserver at most every refresh_seconds."""
+    api_client: Any
+    path: str
+    refresh_seconds: float
+    index: Optional[OpenAPISchemaIndex]
+    checked_at: float
+    lock: threading.Lock
+
+    def __init__(self, api_client: Any, path: Optional[str] = None, refresh_seconds: Optional[float] = None):
+        self.api_client = api_client
+        host = getattr(getattr(api_client, "configuration", None), "host", "") or ""
+        self.path = path or os.path.join(os.getenv("K8S_SCHEMA_INDEX_DIR", "openapi_index"),
+                                         f"{hashlib.sha256(host.encode()).hexdigest()[:16]}.json.gz")
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else float(os.getenv("K8S_SCHEMA_REFRESH_SECONDS", "3600"))
+        self.index = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self) -> OpenAPISchemaIndex:
+        with self.lock:
+            if self.index is None:
+                self.index = OpenAPISchemaIndex.load(self.path)
+            if self.index is None or time.monotonic() - self.checked_at > self.refresh_seconds:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    if self.index is None:
+                        raise
+                    # a stale schema is much better than none
+                    print(f"Error refreshing the API schema, using the one from {self.path}: {e}")
+                self.checked_at = time.monotonic()
+            return self.index
+
+    def refresh(self):
+        document, etag = fetch_openapi(self.api_client, self.index.etag if self.index else None)
+        if document is not None:
+            self.index = OpenAPISchemaIndex.from_document(document, etag)
+            self.index.save(self.path)
@@ -0,0 +1,97 @@
+"""Parent documents: the sections the indexed chunks were cut from, and the retriever that returns them."""
+import asyncio
+import json
+import os
+from typing import Callable, Dict, List, Optional
+
+from langchain.schema import BaseRetriever, Document
+
+
+class ParentStore:
+    """Parent sections by id, in parents.json next to the index. They're few and small enough to keep in memory."""
+    path: str
+    parents: Dict[str, Document]
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, "parents.json")
+        self.parents = {}
+        try:
+            with open(self.path) as f:
+                self.parents = {id: Document(page_content=p["text"], metadata=p["metadata"]) for id, p in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+
+    def replace_source(self, source: str, parents: Dict[str, Document]):
+        """Replace the parents of source with parents, and save."""
+        self.parents = {id: parent for id, parent in self.parents.items() if parent.metadata.get("source") != source}
+        self.parents.update(parents)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({id: {"text": p.page_content, "metadata": p.metadata} for id, p in self.parents.items()}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def get(self, id: str) -> Optional[Document]:
+        return self.parents.get(id)
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+
+class ParentDocumentRetriever(BaseRetriever):
+    """Matches chunks with child_retriever, and returns their parents instead, best first and each once.
+
+    The parents returned add up to at most max_tokens. A parent that doesn't fit in what's left is cut down
+    to a window around the chunk that matched, and chunks without a parent are returned as they are.
+    """
+    child_retriever: BaseRetriever
+    parents: ParentStore
+    k: int
+    max_tokens: int
+    count_tokens: Callable[[str], int]
+
+    def __init__(self, child_retriever: BaseRetriever, parents: ParentStore, count_tokens: Callable[[str], int],
+                 k: int = 4, max_tokens: int = 3000):
+        self.child_retriever = child_retriever
+        self.parents = parents
+        self.count_tokens = count_tokens
+        self.k = k
+        self.max_tokens = max_tokens
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        return self.parents_of(self.child_retriever.get_relevant_documents(query))
+
+    async def aget_relevant_documents(self, query: str) -> List[Document]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_relevant_documents, query)
+
+    def parents_of(self, children: List[Document]) -> List[Document]:
+        documents, seen, budget = [], set(), self.max_tokens
+        for child in children:
+            parent_id = child.metadata.get("parent_id")
+            # chunks without a parent are each their own document
+            if parent_id:
+                if parent_id in seen:
+                    continue
+                seen.add(parent_id)
+            document = self.parents.get(parent_id) if parent_id else None
+            document = document or child
+            tokens = self.count_tokens(document.page_content)
+            if tokens > budget:
+                document = window(document, child, len(document.page_content) * budget // tokens)
+                tokens = self.count_tokens(document.page_content)
+            if not document.page_content:
+                break
+            documents.append(document)
+            budget -= tokens
+            if len(documents) == self.k or budget <= 0:
+                break
+        return documents
+
+
+def window(parent: Document, child: Document, size: int) -> Document:
+    """size characters of parent around where child's text starts in it, or from its start if it isn't found."""
+    text = parent.page_content
+    # children carry their section's title on the first line, which isn't repeated in the parent at that spot
+    needle = child.page_content.split("\n", 1)[-1][:200]
+    at = max(text.find(needle), 0)
+    start = max(0, min(at - size // 4, len(text) - size))
+    return Document(page_content=text[start:start + max(size, 0)], metadata=parent.metadata)
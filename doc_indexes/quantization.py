@@ -0,0 +1,136 @@
+"""Compressed codes for the vectors of a NumpyVectorStore, searched with asymmetric distance.
+
+"int8" scales each dimension into a signed byte, 4x smaller than float32. "pq" (product quantization) splits
+vectors into subspaces and stores, per subspace, the byte index of the nearest of 256 centroids learned with
+k-means, so a 512 dimension vector takes 64 bytes with the default 8 dimensions per subspace.
+Queries stay float32 and are scored against the codes as they are, without decoding the vectors.
+"""
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+QUANTIZATIONS = ("int8", "pq")
+# codes are scored in blocks of this many rows, so the float32 temporaries stay small
+BLOCK_ROWS = 65536
+
+
+class ScalarQuantizer:
+    """One scale per dimension, mapping the largest magnitude seen in training to 127."""
+    mode = "int8"
+    scale: Optional[np.ndarray]
+
+    def __init__(self, scale: Optional[np.ndarray] = None):
+        self.scale = scale
+
+    def train(self, vectors: np.ndarray):
+        peak = np.abs(vectors).max(axis=0)
+        self.scale = (np.where(peak == 0, 1.0, peak) / 127.0).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # folding the scale into the query scores the codes without decoding them
+        scaled = query * self.scale
+        return np.concatenate([codes[i:i + BLOCK_ROWS].astype(np.float32) @ scaled
+                               for i in range(0, len(codes), BLOCK_ROWS)])
+
+    def config(self) -> dict:
+        return {"mode": self.mode}
+
+    def codebook(self) -> np.ndarray:
+        return self.scale
+
+    @classmethod
+    def load(cls, config: dict, codebook: np.ndarray) -> "ScalarQuantizer":
+        return cls(codebook)
+
+
+class ProductQuantizer:
+    """subspaces codebooks of up to 256 centroids. Vectors are zero padded to a multiple of subspaces."""
+    mode = "pq"
+    subspaces: int
+    centroids: Optional[np.ndarray]  # (subspaces, centroids, sub_dim)
+
+    def __init__(self, subspaces: int, centroids: Optional[np.ndarray] = None):
+        self.subspaces = subspaces
+        self.centroids = centroids
+
+    def split(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, dim) to (subspaces, n, sub_dim)."""
+        n, dim = vectors.shape
+        sub_dim = -(-dim // self.subspaces)
+        padded = np.zeros((n, sub_dim * self.subspaces), dtype=np.float32)
+        padded[:, :dim] = vectors
+        return padded.reshape(n, self.subspaces, sub_dim).transpose(1, 0, 2)
+
+    def train(self, vectors: np.ndarray, iterations: int = 20, max_training_rows: int = 65536):
+        rng = np.random.default_rng(0)
+        if len(vectors) > max_training_rows:
+            vectors = vectors[np.sort(rng.choice(len(vectors), max_training_rows, replace=False))]
+        self.centroids = np.stack([kmeans(part, min(256, len(vectors)), iterations, rng) for part in self.split(vectors)])
+
+    def nearest(self, part: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (centroids ** 2).sum(axis=1) - 2 * part @ centroids.T
+        return distances.argmin(axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self.split(vectors)
+        return np.stack([self.nearest(part, centroids) for part, centroids in zip(parts, self.centroids)], axis=1).astype(np.uint8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # the dot product of the query with every centroid, then each row's score is a sum of table lookups
+        table = np.einsum("mkd,md->mk", self.centroids, self.split(query[None, :])[:, 0, :])
+        subspaces = np.arange(self.subspaces)
+        return np.concatenate([table[subspaces, codes[i:i + BLOCK_ROWS]].sum(axis=1)
+                               for i in range(0, len(codes), BLOCK_ROWS)])
+
+    def config(self) -> dict:
+        return {"mode": self.mode, "subspaces": self.subspaces}
+
+    def codebook(self) -> np.ndarray:
+        return self.centroids
+
+    @classmethod
+    def load(cls, config: dict, codebook: np.ndarray) -> "ProductQuantizer":
+        return cls(config["subspaces"], codebook)
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = ((centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T).argmin(axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        # a centroid that lost all its vectors stays where it was
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def new_quantizer(mode: str, dim: int, subspaces: Optional[int] = None):
+    if mode == "int8":
+        return ScalarQuantizer()
+    if mode == "pq":
+        return ProductQuantizer(subspaces or int(os.getenv("K8S_PQ_SUBSPACES", "0")) or max(1, dim // 8))
+    raise ValueError(f"Unknown quantization {mode}, expected one of {', '.join(QUANTIZATIONS)}")
+
+
+def save_quantizer(quantizer, directory: str):
+    with open(os.path.join(directory, "quantization.json"), "w") as f:
+        json.dump(quantizer.config(), f)
+    np.save(os.path.join(directory, "codebook.npy"), quantizer.codebook())
+
+
+def load_quantizer(directory: str):
+    """The quantizer of the store in directory, None if it isn't quantized."""
+    try:
+        with open(os.path.join(directory, "quantization.json")) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return None
+    codebook = np.load(os.path.join(directory, "codebook.npy"))
+    return {"int8": ScalarQuantizer, "pq": ProductQuantizer}[config["mode"]].load(config, codebook)
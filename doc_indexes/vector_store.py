@@ -0,0 +1,257 @@
+"""Read optimized vector store for indexes that are written rarely and queried often.
+
+A store is a directory holding generations, each written once and never changed, and a CURRENT file naming
+the generation to read. A generation is a directory holding:
+  vectors.npy    the L2 normalized vectors, float32 or float16, memory mapped on open
+  documents.jsonl one JSON line per row with its id, text and metadata, memory mapped on open
+  offsets.npy    the byte offset of each line in documents.jsonl, so a result is read without loading the rest
+Opening a store maps the files and reads nothing else, and a query is one matrix-vector product and an argpartition.
+A write builds the next generation and then replaces CURRENT, so a reader in another process keeps the maps of
+the generation it opened, even once it's deleted, until it calls refresh(). Stores from before generations hold
+the files directly in the directory, and are read as they are until their next write.
+
+A quantized store (see doc_indexes.quantization) also holds codes.npy, codebook.npy and quantization.json.
+Queries then scan the codes, and only the rerank best candidates are read from vectors.npy and scored exactly.
+"""
+import json
+import mmap
+import os
+import shutil
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+from langchain.vectorstores.base import VectorStore
+
+from doc_indexes.quantization import load_quantizer, new_quantizer, save_quantizer
+
+# float16 rows are scored in blocks of this many, so the float32 copy stays small
+SCORE_BLOCK_ROWS = 65536
+QUANTIZATION_FILES = ("codes.npy", "codebook.npy", "quantization.json")
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact cosine search over a memory mapped matrix. Writes rewrite the store, they're meant for index updates.
+
+    quantization is "int8", "pq" or None, and applies from the next write. Until then the store is searched the
+    way it was written.
+    """
+    directory: str
+    embedding: Embeddings
+    dtype: np.dtype
+    quantization: Optional[str]
+    rerank: int
+    generation: str
+    vectors: np.ndarray
+    offsets: np.ndarray
+    records: Optional[mmap.mmap]
+    quantizer: Any
+    codes: Optional[np.ndarray]
+    rows_by_id: Optional[Dict[str, int]]
+
+    def __init__(self, directory: str, embedding: Embeddings, dtype: str = "float32", quantization: Optional[str] = None,
+                 rerank: int = 64):
+        self.directory = directory
+        self.embedding = embedding
+        self.dtype = np.dtype(dtype)
+        self.rerank = rerank
+        self.open()
+        self.quantization = quantization or (self.quantizer.mode if self.quantizer else None)
+
+    @property
+    def generation_directory(self) -> str:
+        """The directory holding the files of the generation that is open."""
+        return os.path.join(self.directory, self.generation)
+
+    def open(self):
+        """Map the files of the current generation."""
+        self.generation = current_generation(self.directory)
+        directory = self.generation_directory
+        vectors_path = os.path.join(directory, "vectors.npy")
+        self.records = None
+        if os.path.exists(vectors_path):
+            self.vectors = np.load(vectors_path, mmap_mode="r")
+            self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+            if len(self.offsets):
+                with open(os.path.join(directory, "documents.jsonl"), "rb") as f:
+                    self.records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.vectors = np.zeros((0, 0), dtype=self.dtype)
+            self.offsets = np.zeros(0, dtype=np.int64)
+        self.quantizer = load_quantizer(directory)
+        self.codes = np.load(os.path.join(directory, "codes.npy"), mmap_mode="r") if self.quantizer else None
+        self.rows_by_id = None
+
+    def refresh(self) -> bool:
+        """Open the current generation if another process wrote a newer one. Returns whether it did."""
+        if current_generation(self.directory) == self.generation:
+            return False
+        self.open()
+        return True
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def read_rows(self, rows: Iterable[int]) -> List[dict]:
+        """Read the id, text and metadata of the given rows."""
+        records = []
+        for row in rows:
+            start = int(self.offsets[row])
+            records.append(json.loads(self.records[start:self.records.find(b"\n", start)]))
+        return records
+
+    def ids(self) -> List[str]:
+        return [record["id"] for record in self.read_rows(range(len(self)))]
+
+    def get_by_ids(self, ids: Sequence[str]) -> List[Document]:
+        """The documents with the given ids, in that order. Unknown ids are skipped."""
+        if self.rows_by_id is None:
+            self.rows_by_id = {id: row for row, id in enumerate(self.ids())}
+        rows = [self.rows_by_id[id] for id in ids if id in self.rows_by_id]
+        return [document for document, _ in self.documents([(row, 0.0) for row in rows])]
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query with every row."""
+        if self.vectors.dtype == np.float32:
+            return self.vectors @ query
+        return np.concatenate([self.vectors[i:i + SCORE_BLOCK_ROWS].astype(np.float32) @ query
+                               for i in range(0, len(self.vectors), SCORE_BLOCK_ROWS)])
+
+    def search(self, vector: Sequence[float], k: int, rerank: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Return the k most similar rows and their scores, best first.
+
+        A quantized store re-ranks its best rerank candidates by their exact score. rerank=0 returns the
+        approximate scores of the codes as they are.
+        """
+        if len(self) == 0:
+            return []
+        query = normalize(np.asarray(vector, dtype=np.float32))
+        rerank = self.rerank if rerank is None else rerank
+        if self.quantizer is None:
+            return top_k(self.scores(query), k)
+        approximate = self.quantizer.scores(self.codes, query)
+        if rerank == 0:
+            return top_k(approximate, k)
+        # reading the candidates in row order keeps the reads on the memory map sequential
+        candidates = np.sort(np.array([row for row, _ in top_k(approximate, max(k, rerank))]))
+        exact = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+        return [(int(candidates[i]), score) for i, score in top_k(exact, k)]
+
+    def documents(self, hits: List[Tuple[int, float]]) -> List[Tuple[Document, float]]:
+        records = self.read_rows(row for row, _ in hits)
+        return [(Document(page_content=record["text"], metadata=record["metadata"]), score)
+                for record, (_, score) in zip(records, hits)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.documents(self.search(self.embedding.embed_query(query), k))
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.documents(self.search(embedding, k))]
+
+    def write(self, ids: Sequence[str], vectors: Sequence[Sequence[float]], texts: Sequence[str], metadatas: Sequence[dict],
+              keep: Optional[Iterable[int]] = None):
+        """Replace the store with the rows in keep, followed by the given rows. keep defaults to none."""
+        keep = list(keep or [])
+        kept_vectors = np.asarray(self.vectors[keep], dtype=np.float32) if keep else None
+        kept = self.read_rows(keep)
+        new = normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)) if len(ids) else None
+        matrix = np.concatenate([part for part in (kept_vectors, new) if part is not None]) if kept or len(ids) \
+            else np.zeros((0, 0), dtype=np.float32)
+        records = kept + [{"id": id, "text": text, "metadata": metadata or {}}
+                          for id, text, metadata in zip(ids, texts, metadatas)]
+
+        # build the next generation next to the current one and point CURRENT at it, so readers never see half a store
+        generation = next_generation(self.directory)
+        tmp = os.path.join(self.directory, generation + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "vectors.npy"), matrix.astype(self.dtype))
+        offsets = np.zeros(len(records), dtype=np.int64)
+        with open(os.path.join(tmp, "documents.jsonl"), "wb") as f:
+            for i, record in enumerate(records):
+                offsets[i] = f.tell()
+                f.write(json.dumps(record).encode() + b"\n")
+        np.save(os.path.join(tmp, "offsets.npy"), offsets)
+        if self.quantization and len(records):
+            quantizer = new_quantizer(self.quantization, matrix.shape[1])
+            quantizer.train(matrix)
+            np.save(os.path.join(tmp, "codes.npy"), quantizer.encode(matrix))
+            save_quantizer(quantizer, tmp)
+        os.replace(tmp, os.path.join(self.directory, generation))
+        with open(os.path.join(self.directory, "CURRENT.tmp"), "w") as f:
+            f.write(generation)
+        os.replace(os.path.join(self.directory, "CURRENT.tmp"), os.path.join(self.directory, "CURRENT"))
+        self.open()
+        remove_old_generations(self.directory, generation)
+
+    def requantize(self):
+        """Rewrite the store if it isn't quantized the way quantization says."""
+        if self.quantization != (self.quantizer.mode if self.quantizer else None):
+            self.write([], [], [], [], keep=range(len(self)))
+
+    def upsert(self, ids: Sequence[str], vectors: Sequence[Sequence[float]], texts: Sequence[str], metadatas: Sequence[dict],
+               delete: Iterable[str] = ()):
+        """Add rows with precomputed vectors and delete rows by id, in one rewrite. Existing ids are replaced."""
+        drop = set(delete) | set(ids)
+        keep = [row for row, id in enumerate(self.ids()) if id not in drop]
+        self.write(ids, vectors, texts, metadatas, keep)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(len(self) + i) for i in range(len(texts))]
+        self.upsert(ids, self.embedding.embed_documents(texts), texts, metadatas or [{}] * len(texts))
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   persist_directory: str = "numpy_index", **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas)
+        return store
+
+
+def is_numpy_store(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, "CURRENT")) or os.path.exists(os.path.join(directory, "vectors.npy"))
+
+
+def current_generation(directory: str) -> str:
+    """The generation CURRENT names, "" for a store without generations (or no store) whose files are in directory."""
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def next_generation(directory: str) -> str:
+    current = current_generation(directory)
+    return f"{int(current) + 1 if current else 1:06d}"
+
+
+def remove_old_generations(directory: str, generation: str):
+    """Delete the generations before generation, and the files of a store from before generations.
+
+    Readers that still have them open keep their maps, the files are only gone once they're closed.
+    """
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.split(".")[0].isdigit() and name != generation and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name in ("documents.jsonl", "offsets.npy", "vectors.npy") + QUANTIZATION_FILES:
+            os.remove(path)
+
+
+def top_k(scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(row), float(scores[row])) for row in top]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
@@ -1,6 +1,31 @@
+import os
+from contextlib import contextmanager
+from typing import ContextManager, Iterator, Optional
+
+from agent.deadline import deadline_scope
 from agent.factory import AgentFactory
+from agent.metrics import measure_request
+from agent.tracing import trace_run
 
 class AgentListener:
     factory: AgentFactory
-    def __init__(self, factory: AgentFactory):
-        self.factory = factory
\ No newline at end of file
+    # seconds each request may take, after which the agent answers with what it has found so far
+    request_timeout: Optional[float]
+
+    def __init__(self, factory: AgentFactory, request_timeout: Optional[float] = None):
+        self.factory = factory
+        self.request_timeout = request_timeout or float(os.getenv("K8S_REQUEST_TIMEOUT", "120"))
+
+    def deadline(self) -> ContextManager:
+        """Scope a request's agent creation and run to request_timeout."""
+        return deadline_scope(self.request_timeout)
+
+    def trace(self, message: str) -> ContextManager:
+        """Trace a request's agent creation and run, if K8S_TRACE_DIR is set."""
+        return trace_run(type(self).__name__, input=message[:200])
+
+    @contextmanager
+    def request(self, message: str) -> Iterator[None]:
+        """Scope a request's agent creation and run: its deadline, its trace and its metrics."""
+        with measure_request(type(self).__name__), self.deadline(), self.trace(message):
+            yield
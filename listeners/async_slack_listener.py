@@ -0,0 +1,208 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+from weakref import WeakValueDictionary
+
+from slack_sdk.web.async_client import AsyncWebClient
+from slack_sdk.socket_mode.aiohttp import SocketModeClient
+from slack_sdk.socket_mode.response import SocketModeResponse
+from slack_sdk.socket_mode.request import SocketModeRequest
+from agent.factory import AgentFactory
+from listeners.agent_listener import AgentListener
+from agent.metrics import queued
+from agent.run_memo import record_observations
+from listeners.slack_listener import SlackThreadStore, SlackTokenStream, create_action_block, create_output_block, thread_key
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.schema import AgentAction, AgentFinish, LLMResult
+from tools.aio import run_blocking, task_scope
+
+
+class AsyncSlackListener(AgentListener):
+    """Slack listener that runs every conversation as a task on one event loop.
+
+    At most max_conversations agents run at once; further messages wait for a free slot.
+    """
+    def __init__(self, factory: AgentFactory, max_conversations: int = None):
+        self.app_token = os.environ.get("SLACK_APP_TOKEN")
+        self.bot_token = os.environ.get("SLACK_BOT_TOKEN")
+        self.max_conversations = max_conversations or int(os.getenv("K8S_MAX_CONVERSATIONS", "200"))
+        self.client: Optional[SocketModeClient] = None
+        self.bot_user_id: Optional[str] = None
+        self.conversations: Optional[asyncio.Semaphore] = None
+        # keep references to the running conversations, so they aren't garbage collected mid-run
+        self.tasks: Set[asyncio.Task] = set()
+        self.threads = SlackThreadStore()
+        # asyncio locks per thread, the SlackThread locks would block the loop; dropped along with their tasks
+        self.thread_locks: "WeakValueDictionary[Tuple[str, str], asyncio.Lock]" = WeakValueDictionary()
+        super().__init__(factory)
+
+    async def on_message(self, req: SocketModeRequest, message: str):
+        with queued(type(self).__name__):
+            await self.conversations.acquire()
+        try:
+            await send_slack_text_message(self.client, req, "Let me think about that...")
+            handler = AsyncSlackCallbackHandler(self.client, req)
+            key = thread_key(req)
+            # follow-ups in a thread wait for the previous message, so they see what it found
+            async with self.thread_lock(key):
+                # a miss loads the thread from disk
+                thread = await run_blocking(self.threads.get, *key)
+                # nothing else waits on the thread's own lock, the asyncio lock already serializes the thread,
+                # but holding it keeps the store from evicting the thread mid-answer
+                with thread.lock:
+                    try:
+                        with self.request(message), record_observations() as observations:
+                            agent = self.factory.new_k8s_engineer([handler], asynchronous=True)
+                            outputs = await agent.acall({"input": message, "conversation": thread.memory.context()})
+                        thread.memory.remember(message, outputs.get("output", ""), observations)
+                        await run_blocking(self.threads.save, thread)
+                    except Exception as e:
+                        await send_slack_text_message(self.client, req, f"Sorry, something went wrong: {e}")
+        finally:
+            self.conversations.release()
+
+    def thread_lock(self, key: Tuple[str, str]) -> asyncio.Lock:
+        lock = self.thread_locks.get(key)
+        if lock is None:
+            lock = self.thread_locks[key] = asyncio.Lock()
+        return lock
+
+    async def listen(self, interrupt: threading.Event):
+        # the clients and the semaphore have to be created inside the loop they run on
+        self.client = SocketModeClient(app_token=self.app_token, web_client=AsyncWebClient(token=self.bot_token))
+        self.conversations = asyncio.Semaphore(self.max_conversations)
+        self.bot_user_id = (await self.client.web_client.auth_test())["user_id"]
+        self.client.socket_mode_request_listeners.append(self.process)
+        await self.client.connect()
+        await asyncio.get_running_loop().run_in_executor(None, interrupt.wait)
+        await self.client.close()
+        # the kubernetes client's connection pool belongs to this loop
+        if self.factory.k8s_async_model is not None:
+            await self.factory.k8s_async_model.close()
+
+    def start(self) -> threading.Event:
+        # run the event loop in a separate thread
+        interrupt = threading.Event()
+        thread = threading.Thread(target=asyncio.run, args=(self.listen(interrupt),))
+        thread.start()
+        return interrupt
+
+    async def process(self, client: SocketModeClient, req: SocketModeRequest):
+        if req.type == "events_api":
+            # Acknowledge the request anyway
+            response = SocketModeResponse(envelope_id=req.envelope_id)
+            await client.send_socket_mode_response(response)
+
+            if req.payload["event"]["type"] == "message" or req.payload["event"]["type"] == "app_mention"\
+                and req.payload["event"].get("subtype") is None:
+                # ignore messages from the bot itself
+                if req.payload["event"].get("user") == self.bot_user_id:
+                    return
+
+                message = req.payload["event"]["text"]
+                # remove the bot mention
+                if req.payload["event"]["type"] == "app_mention":
+                    message = message.split(" ", 1)[1]
+                task = asyncio.create_task(self.on_message(req, message))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+
+async def send_slack_text_message(client: SocketModeClient, req: SocketModeRequest, message: str) -> Dict[str, Any]:
+    return await client.web_client.chat_postMessage(
+        channel=req.payload["event"]["channel"],
+        thread_ts=req.payload["event"]["ts"],
+        text=message)
+
+
+async def send_slack_block_message(client: SocketModeClient, req: SocketModeRequest, blocks: Sequence[dict]):
+    await client.web_client.chat_postMessage(
+        channel=req.payload["event"]["channel"],
+        thread_ts=req.payload["event"]["ts"],
+        blocks=blocks)
+
+
+async def update_slack_message(client: SocketModeClient, req: SocketModeRequest, ts: str, text: str, blocks: Optional[Sequence[dict]] = None):
+    """Edit a message previously posted in the thread. text is used as the notification fallback when blocks are given."""
+    await client.web_client.chat_update(
+        channel=req.payload["event"]["channel"],
+        ts=ts,
+        text=text,
+        blocks=blocks)
+
+
+class AsyncSlackCallbackHandler(AsyncCallbackHandler):
+    """Async version of SlackCallbackHandler, for agents run with acall."""
+    client: SocketModeClient
+    req: SocketModeRequest
+    min_update_interval: float
+    # one stream per task scope, so concurrently running sub-agents don't interleave their tokens
+    streams: Dict[int, SlackTokenStream]
+
+    def __init__(self, client: SocketModeClient, req: SocketModeRequest, min_update_interval: float = 1.2):
+        self.client = client
+        self.req = req
+        self.min_update_interval = min_update_interval
+        self.streams = {}
+
+    async def flush(self, stream: SlackTokenStream):
+        text = stream.text
+        if stream.ts is None:
+            response = await send_slack_text_message(self.client, self.req, text)
+            stream.ts = response["ts"]
+        else:
+            await update_slack_message(self.client, self.req, stream.ts, text)
+        stream.flushed_text = text
+        stream.last_flush = time.monotonic()
+
+    async def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
+    ) -> None:
+        """Run when LLM starts running."""
+        self.streams[task_scope()] = SlackTokenStream()
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        """Run on new LLM token. Only available when streaming is enabled."""
+        stream = self.streams.get(task_scope())
+        if stream is None:
+            return
+        stream.append(token)
+        if stream.should_flush(self.min_update_interval):
+            try:
+                await self.flush(stream)
+            except Exception as e:
+                print(f"Error streaming to slack: {e}")
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        """Run when LLM ends running."""
+        stream = self.streams.get(task_scope())
+        if stream is not None and stream.ts is not None and stream.text != stream.flushed_text:
+            try:
+                await update_slack_message(self.client, self.req, stream.ts, stream.text)
+            except Exception as e:
+                print(f"Error streaming to slack: {e}")
+
+    async def finish_stream(self, text: str, blocks: Sequence[dict]):
+        """Replace the streamed message with the formatted blocks, or post them if nothing was streamed."""
+        stream = self.streams.pop(task_scope(), None)
+        if stream is not None and stream.ts is not None:
+            await update_slack_message(self.client, self.req, stream.ts, text, blocks)
+        else:
+            await send_slack_block_message(self.client, self.req, blocks)
+
+    async def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
+    ) -> None:
+        """Run when LLM errors."""
+        self.streams.pop(task_scope(), None)
+
+    async def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        await send_slack_block_message(self.client, self.req, create_output_block(output))
+
+    async def on_agent_action(self, action: AgentAction, **kwargs: Any) -> None:
+        await self.finish_stream(f'Action: {action.tool}', create_action_block(action))
+
+    async def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> None:
+        await self.finish_stream(finish.log, create_output_block(finish.log))
@@ -9,8 +9,9 @@ class TerminalListener(AgentListener):
     def listen(self, interrupt: threading.Event):
         while not interrupt.is_set():
             message = input("Enter your message: ")
-            agent = self.factory.new_k8s_engineer(handlers=None)
-            agent({"input": message})
+            with self.request(message):
+                agent = self.factory.new_k8s_engineer(handlers=None)
+                agent({"input": message})
             del agent
 
     def start(self) -> threading.Event:
@@ -26,8 +26,9 @@ class VoiceListener(AgentListener):
             if message.count(self.wake_word) > 0:
                 self.ready_to_process.clear()
                 message = message.replace(self.wake_word, "")
-                agent = self.factory.new_k8s_engineer(handlers=[handler])
-                agent({"input": message})
+                with self.request(message):
+                    agent = self.factory.new_k8s_engineer(handlers=[handler])
+                    agent({"input": message})
             self.ready_to_process.set()
         
 
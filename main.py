@@ -1,4 +1,8 @@
+import os
+
 from agent.factory import AgentFactory
+from agent.metrics import start_metrics_server
+from listeners.async_slack_listener import AsyncSlackListener
 from listeners.slack_listener import SlackListener
 from listeners.terminal_listener import TerminalListener
 from listeners.voice_listener import VoiceListener
@@ -22,7 +26,21 @@ from pyttsx3.voice import Voice
 
 
 
-listener = VoiceListener(AgentFactory())
+# K8S_LISTENER picks where requests come from: voice (the default), terminal, slack, or async-slack to run the
+# slack conversations concurrently on one event loop
+LISTENERS = {
+    "voice": VoiceListener,
+    "terminal": TerminalListener,
+    "slack": SlackListener,
+    "async-slack": AsyncSlackListener,
+}
+listener_name = os.getenv("K8S_LISTENER", "voice")
+if listener_name not in LISTENERS:
+    raise SystemExit(f"Unknown listener {listener_name}, expected one of {', '.join(LISTENERS)}")
+
+# serves /metrics when K8S_METRICS_PORT is set
+start_metrics_server()
+listener = LISTENERS[listener_name](AgentFactory())
 interrupt = listener.start()
 # block until keyboard interrupt
 interrupt.wait()
@@ -0,0 +1,90 @@
+from typing import Optional
+
+import pytest
+from langchain.tools.base import BaseTool
+
+from agent.plan_execute.agent import PlanError, PlanExecutor, PlanStep, parse_plan, step_result
+
+TOOL_NAMES = ["get_pods", "get_logs"]
+
+
+class EchoTool(BaseTool):
+    name = "get_pods"
+    description = "Echoes its input."
+
+    def _run(self, tool_input: str, run_manager: Optional[object] = None) -> str:
+        return f"ran {tool_input}"
+
+    async def _arun(self, tool_input: str, run_manager: Optional[object] = None) -> str:
+        return self._run(tool_input)
+
+
+def test_parse_plan_adds_referenced_steps_to_dependencies():
+    steps = parse_plan('Plan: [{"id": "a", "tool": "get_pods", "input": "default"},'
+                       ' {"id": "b", "tool": "get_logs", "input": "{a}"}]', TOOL_NAMES)
+    assert [step.id for step in steps] == ["a", "b"]
+    assert steps[1].depends_on == ["a"]
+
+
+def test_parse_plan_rejects_unknown_tool():
+    with pytest.raises(PlanError, match="unknown tool"):
+        parse_plan('[{"id": "a", "tool": "delete_cluster"}]', TOOL_NAMES)
+
+
+def test_parse_plan_rejects_unknown_step_id():
+    with pytest.raises(PlanError, match="unknown steps"):
+        parse_plan('[{"id": "a", "tool": "get_pods", "depends_on": ["z"]}]', TOOL_NAMES)
+    with pytest.raises(PlanError, match="unknown steps"):
+        parse_plan('[{"id": "a", "tool": "get_logs", "input": "{z}"}]', TOOL_NAMES)
+
+
+def test_parse_plan_accepts_steps_from_an_earlier_plan():
+    steps = parse_plan('[{"id": "b", "tool": "get_logs", "input": "{a}"}]', TOOL_NAMES, known_ids=["a"])
+    assert steps[0].depends_on == ["a"]
+
+
+def test_parse_plan_rejects_cycles():
+    with pytest.raises(PlanError, match="cycle"):
+        parse_plan('[{"id": "a", "tool": "get_pods", "input": "{b}"},'
+                   ' {"id": "b", "tool": "get_logs", "input": "{a}"}]', TOOL_NAMES)
+    with pytest.raises(PlanError, match="cycle"):
+        parse_plan('[{"id": "a", "tool": "get_pods", "depends_on": ["a"]}]', TOOL_NAMES)
+
+
+def test_ready_steps_substitutes_references():
+    executor = PlanExecutor(tools={})
+    step = PlanStep(id="b", tool="get_logs", input="{a} in {ns}", depends_on=["a"])
+    pending = [step]
+    ready = executor.ready_steps(pending, {"a": " nginx-123\n"}, {})
+    # unknown references are left as they are
+    assert ready == [(step, "nginx-123 in {ns}")]
+    assert pending == []
+
+
+def test_ready_steps_waits_for_dependencies_and_skips_failed_ones():
+    executor = PlanExecutor(tools={})
+    waiting = PlanStep(id="b", tool="get_logs", depends_on=["a"])
+    skipped = PlanStep(id="c", tool="get_logs", depends_on=["x"])
+    independent = PlanStep(id="d", tool="get_pods")
+    pending = [waiting, skipped, independent]
+    failed = {"x": "Error: boom"}
+    ready = executor.ready_steps(pending, {}, failed)
+    assert ready == [(independent, "None")]
+    assert pending == [waiting]
+    assert "c" in failed
+
+
+def test_run_passes_results_to_dependent_steps():
+    executor = PlanExecutor(tools={"get_pods": EchoTool()})
+    steps = parse_plan('[{"id": "a", "tool": "get_pods", "input": "default"},'
+                       ' {"id": "b", "tool": "get_pods", "input": "{a}"}]', ["get_pods"])
+    results = {}
+    assert executor.run(steps, results) == {}
+    assert results == {"a": "ran default", "b": "ran ran default"}
+
+
+def test_step_result_treats_failed_lookups_as_failures():
+    assert step_result("Error: not found") == (False, "Error: not found")
+    assert step_result("No running pod found like nginx")[0] is False
+    assert step_result("Invalid resource type foos")[0] is False
+    assert step_result("nginx-123 Running")[0] is True
@@ -0,0 +1,132 @@
+"""Helpers for the asyncio path, so blocking clients never stall the event loop."""
+import asyncio
+import contextvars
+import functools
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+_task_scope: contextvars.ContextVar[int] = contextvars.ContextVar("task_scope", default=0)
+_parent_task_scope: contextvars.ContextVar[int] = contextvars.ContextVar("parent_task_scope", default=0)
+_task_scopes = itertools.count(1)
+
+# shared by every conversation on the loop, so the number of threads stays bounded however many requests are in flight
+BLOCKING_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("K8S_BLOCKING_POOL_SIZE", "32")), thread_name_prefix="blocking")
+
+
+class BlockingPoolStats:
+    """Calls of run_blocking waiting for a thread of the pool, and calls running on one."""
+    queued: int
+    active: int
+    lock: threading.Lock
+
+    def __init__(self):
+        self.queued = 0
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def wrap(self, func: Callable[[], T]) -> Tuple[Callable[[], T], Callable[[Any], None]]:
+        """Count func as queued, and return it wrapped to count it as active while it runs,
+        along with a done callback that stops counting it as queued if it was cancelled before it started."""
+        started = False
+        with self.lock:
+            self.queued += 1
+
+        def run() -> T:
+            nonlocal started
+            with self.lock:
+                # the caller may have given up on it just as it started
+                if not started:
+                    started = True
+                    self.queued -= 1
+                self.active += 1
+            try:
+                return func()
+            finally:
+                with self.lock:
+                    self.active -= 1
+
+        def done(_: Any):
+            nonlocal started
+            with self.lock:
+                if not started:
+                    started = True
+                    self.queued -= 1
+        return run, done
+
+
+BLOCKING_POOL_STATS = BlockingPoolStats()
+
+
+def no_timeout() -> Optional[float]:
+    """The default request_timeout of the models: no timeout but the client's own."""
+    return None
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking call on the shared pool, in a copy of the current context so the run memo is still visible."""
+    context = contextvars.copy_context()
+    run, done = BLOCKING_POOL_STATS.wrap(functools.partial(context.run, func, *args, **kwargs))
+    future = asyncio.get_running_loop().run_in_executor(BLOCKING_POOL, run)
+    future.add_done_callback(done)
+    return await future
+
+
+class BlockingModelAdapter:
+    """Exposes the methods of a blocking model as coroutines that run on the shared pool.
+
+    Used for clients that have no asyncio implementation, so tools can always await their model.
+    """
+    model: Any
+
+    def __init__(self, model: Any):
+        self.model = model
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.model, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await run_blocking(attr, *args, **kwargs)
+        return call
+
+
+async def emit(callback_manager: Any, event: str, *args: Any, **kwargs: Any):
+    """Fire a callback event on either a sync or an async callback manager."""
+    if callback_manager is None:
+        return
+    handler = getattr(callback_manager, event)
+    if callback_manager.is_async:
+        await handler(*args, **kwargs)
+    else:
+        handler(*args, **kwargs)
+
+
+def enter_task_scope():
+    """Give the current task its own scope id, so callback handlers can tell concurrently running actions apart.
+
+    Tasks get a copy of the context they are created in, including the tasks the async callback manager runs
+    handlers in, so a handler sees the scope of the action that fired the event.
+    """
+    _parent_task_scope.set(_task_scope.get())
+    _task_scope.set(next(_task_scopes))
+
+
+def in_task_scope(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Call func in a new task scope. For actions run concurrently on a thread pool."""
+    enter_task_scope()
+    return func(*args, **kwargs)
+
+
+def task_scope() -> int:
+    return _task_scope.get()
+
+
+def parent_task_scope() -> int:
+    """The scope that was current when the current one was entered."""
+    return _parent_task_scope.get()
@@ -0,0 +1,159 @@
+"""Result cache shared by the tool implementations."""
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+# observations that report a failed lookup rather than cluster state, so they're never cached
+FAILED_PREFIXES = ("Error", "Invalid resource type", "No pod found", "No running pod found")
+
+
+class CacheEntry:
+    """A cached tool observation."""
+    value: str
+    expires_at: Optional[float]
+    namespace: Optional[str]
+
+    def __init__(self, value: str, expires_at: Optional[float], namespace: Optional[str]):
+        self.value = value
+        self.expires_at = expires_at
+        self.namespace = namespace
+
+    def is_expired(self, now: float) -> bool:
+        return self.expires_at is not None and now >= self.expires_at
+
+
+class ToolResultCache:
+    """LRU cache of tool observations keyed by tool name and normalized input.
+
+    Entries without a ttl never expire and are never invalidated; they are meant for static answers.
+    Entries with a ttl describe live cluster state and are dropped by invalidate() when a write touches their namespace.
+    Live entries without a namespace (e.g. the namespace list itself) are dropped by every write.
+    """
+    max_size: int
+    entries: "OrderedDict[Tuple[str, str], CacheEntry]"
+    lock: threading.Lock
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tool_name: str, tool_input: str) -> Optional[str]:
+        """Return the cached observation, or None if there is no fresh entry."""
+        key = (tool_name, normalize_input(tool_input))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.is_expired(time.monotonic()):
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def set(self, tool_name: str, tool_input: str, value: str, ttl: Optional[float] = None, namespace: Optional[str] = None):
+        """Store an observation, evicting the least recently used entry if the cache is full."""
+        key = (tool_name, normalize_input(tool_input))
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            self.entries[key] = CacheEntry(value, expires_at, namespace)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, namespace: Optional[str] = None):
+        """Drop live entries for the namespace, plus all cluster scoped live entries."""
+        with self.lock:
+            for key in [key for key, entry in self.entries.items()
+                        if entry.expires_at is not None and (entry.namespace is None or entry.namespace == namespace)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def normalize_input(tool_input: str) -> str:
+    """Normalize the tool input so trivially different spellings share a cache entry."""
+    if tool_input is None:
+        return ""
+    tool_input = str(tool_input).strip().strip('"').strip("'")
+    return ",".join([part.strip() for part in tool_input.split(",")])
+
+
+def first_field(tool_input: str) -> Optional[str]:
+    """Return the first comma separated field of the input, which is the namespace for most k8s tools."""
+    namespace = normalize_input(tool_input).split(",")[0]
+    return namespace or None
+
+
+# process wide cache; tools are recreated for every agent, so the cache can't live on the tool
+TOOL_CACHE = ToolResultCache()
+
+
+def cached_run(ttl: Optional[float] = None, namespace: Callable[[str], Optional[str]] = None, cache: ToolResultCache = TOOL_CACHE):
+    """Decorate a BaseTool._run or _arun so its observations are cached.
+
+    Args:
+        ttl: Seconds to keep the observation. None keeps it forever.
+        namespace: Function extracting the namespace the input refers to, used for invalidation.
+        cache: The cache to store observations in.
+    """
+    def store(tool_name: str, tool_input: str, observation: str):
+        # never cache failures, the agent is likely to retry with a corrected input, or the object to show up
+        if isinstance(observation, str) and not observation.startswith(FAILED_PREFIXES):
+            cache.set(tool_name, tool_input, observation, ttl=ttl,
+                      namespace=namespace(tool_input) if namespace else None)
+
+    def decorator(run: Callable[..., str]) -> Callable[..., str]:
+        if asyncio.iscoroutinefunction(run):
+            @functools.wraps(run)
+            async def async_wrapper(self, tool_input: str) -> str:
+                observation = cache.get(self.name, tool_input)
+                if observation is None:
+                    observation = await run(self, tool_input)
+                    store(self.name, tool_input, observation)
+                return observation
+            return async_wrapper
+
+        @functools.wraps(run)
+        def wrapper(self, tool_input: str) -> str:
+            observation = cache.get(self.name, tool_input)
+            if observation is None:
+                observation = run(self, tool_input)
+                store(self.name, tool_input, observation)
+            return observation
+        return wrapper
+    return decorator
+
+
+def invalidates_run(namespace: Callable[[str], Optional[str]] = first_field, cache: ToolResultCache = TOOL_CACHE):
+    """Decorate the BaseTool._run or _arun of a write tool so it invalidates cached live state for the namespace it touches."""
+    def decorator(run: Callable[..., str]) -> Callable[..., str]:
+        if asyncio.iscoroutinefunction(run):
+            @functools.wraps(run)
+            async def async_wrapper(self, tool_input: str) -> str:
+                try:
+                    return await run(self, tool_input)
+                finally:
+                    cache.invalidate(namespace(tool_input))
+            return async_wrapper
+
+        @functools.wraps(run)
+        def wrapper(self, tool_input: str) -> str:
+            try:
+                return run(self, tool_input)
+            finally:
+                cache.invalidate(namespace(tool_input))
+        return wrapper
+    return decorator
@@ -2,6 +2,8 @@ from pydantic import BaseModel
 from langchain.tools.base import BaseTool
 import pygit2
 
+from tools.aio import run_blocking
+
 class GitModel(BaseModel):
     username: str
     password: str
@@ -120,7 +122,7 @@ class GitRepositoryCloneTool(BaseTool):
 
     async def _arun(self, tool_input: str) -> str:
         """Run the tool"""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitRepositoryCreateBranchTool(BaseTool):
     """Tool for creating a git branch"""
@@ -142,7 +144,7 @@ class GitRepositoryCreateBranchTool(BaseTool):
 
     async def _arun(self, tool_input: str) -> str:
         """Run the tool"""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
 
 class GitRepositoryCheckoutBranchTool(BaseTool):
     """Tool for checking out a git branch"""
@@ -164,7 +166,7 @@ class GitRepositoryCheckoutBranchTool(BaseTool):
 
     async def _arun(self, tool_input: str) -> str:
         """Run the tool"""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitRepositoryPullTool(BaseTool):
     """Tool for pulling from a git repository"""
@@ -182,7 +184,7 @@ class GitRepositoryPullTool(BaseTool):
 
     async def _arun(self, tool_input: str) -> str:
         """Run the tool"""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitRepositoryPushTool(BaseTool):
     """Tool for pushing to a git repository"""
@@ -200,7 +202,7 @@ class GitRepositoryPushTool(BaseTool):
 
     async def _arun(self, tool_input: str) -> str:
         """Run the tool"""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitRepositoryAddFileTool(BaseTool):
     """Tool for adding a file to a git repository"""
@@ -222,7 +224,7 @@ class GitRepositoryAddFileTool(BaseTool):
 
     async def _arun(self, tool_input: str) -> str:
         """Run the tool"""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
 
 class GitRepositoryCommitTool(BaseTool):
     """Tool for committing a git repository"""
@@ -243,7 +245,7 @@ class GitRepositoryCommitTool(BaseTool):
 
     async def _arun(self, tool_input: str) -> str:
         """Run the tool"""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitRepositoryGetFileContentTool(BaseTool):
     """Tool for getting the content of a file in a git repository"""
@@ -265,7 +267,7 @@ class GitRepositoryGetFileContentTool(BaseTool):
 
     async def _arun(self, tool_input: str) -> str:
         """Run the tool"""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
 
 class GitRepositoryWriteFileTool(BaseTool):
     """Tool for writing a file to a git repository"""
@@ -287,7 +289,7 @@ class GitRepositoryWriteFileTool(BaseTool):
 
     async def _arun(self, tool_input: str) -> str:
         """Run the tool"""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
 
 
 
@@ -2,6 +2,8 @@ from gitlab import Gitlab, GitlabDeleteError
 from langchain.tools.base import BaseTool
 from pydantic import BaseModel
 
+from tools.aio import run_blocking
+
 
 class GitlabModel(BaseModel):
     gl: Gitlab
@@ -146,7 +148,7 @@ class GitlabListProjectsTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitlabListGroupsTool(BaseTool):
     """Tool for listing all groups."""
@@ -164,7 +166,7 @@ class GitlabListGroupsTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
 
 class GitlabListIssuesTool(BaseTool):
     """Tool for listing all issues in a project."""
@@ -183,7 +185,7 @@ class GitlabListIssuesTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitlabChangeIssueLabelTool(BaseTool):
     """Tool for changing the label of an issue in a project."""
@@ -208,7 +210,7 @@ class GitlabChangeIssueLabelTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
 
 class GitlabListMergeRequestsTool(BaseTool):
     """Tool for listing all merge requests in a project."""
@@ -227,7 +229,7 @@ class GitlabListMergeRequestsTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
 
 class GitlabCreateIssueTool(BaseTool):
     """Tool for creating an issue in a project."""
@@ -251,7 +253,7 @@ class GitlabCreateIssueTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitlabCommentOnIssueTool(BaseTool):
     """Tool for commenting on an issue in a project."""
@@ -275,7 +277,7 @@ class GitlabCommentOnIssueTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitlabReplyToIssueCommentTool(BaseTool):
     """Tool for replying to a comment on an issue in a project."""
@@ -300,7 +302,7 @@ class GitlabReplyToIssueCommentTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitlabCreateMergeRequestTool(BaseTool):
     """Tool for creating a merge request in a project."""
@@ -326,7 +328,7 @@ class GitlabCreateMergeRequestTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitlabCommentOnMergeRequestTool(BaseTool):
     """Tool for commenting on a merge request in a project."""
@@ -350,7 +352,7 @@ class GitlabCommentOnMergeRequestTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
     
 class GitlabReplyToMergeRequestCommentTool(BaseTool):
     """Tool for replying to a comment on a merge request in a project."""
@@ -375,7 +377,7 @@ class GitlabReplyToMergeRequestCommentTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
 
     
         
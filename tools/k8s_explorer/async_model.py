@@ -0,0 +1,174 @@
+"""asyncio counterpart of KubernetesOpsModel, built on kubernetes_asyncio."""
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from tools.aio import no_timeout
+from tools.k8s_explorer.tool import KubernetesOpsModel, resource_to_yaml, singular_resource_type
+
+try:
+    from kubernetes_asyncio import client as async_client
+except ImportError:
+    # kubernetes_asyncio is optional, the async path falls back to running the blocking client on a thread pool
+    async_client = None
+
+# resource type -> (api, list method, read method, namespaced)
+RESOURCE_METHODS: Dict[str, Tuple[str, str, str, bool]] = {
+    "configmap": ("core_v1", "list_namespaced_config_map", "read_namespaced_config_map", True),
+    "namespace": ("core_v1", "list_namespace", "read_namespace", False),
+    "persistentvolume": ("core_v1", "list_persistent_volume", "read_persistent_volume", False),
+    "persistentvolumeclaim": ("core_v1", "list_namespaced_persistent_volume_claim", "read_namespaced_persistent_volume_claim", True),
+    "pod": ("core_v1", "list_namespaced_pod", "read_namespaced_pod", True),
+    "secret": ("core_v1", "list_namespaced_secret", "read_namespaced_secret", True),
+    "serviceaccount": ("core_v1", "list_namespaced_service_account", "read_namespaced_service_account", True),
+    "service": ("core_v1", "list_namespaced_service", "read_namespaced_service", True),
+    "node": ("core_v1", "list_node", "read_node", False),
+    "daemonset": ("apps_v1", "list_namespaced_daemon_set", "read_namespaced_daemon_set", True),
+    "deployment": ("apps_v1", "list_namespaced_deployment", "read_namespaced_deployment", True),
+    "replicaset": ("apps_v1", "list_namespaced_replica_set", "read_namespaced_replica_set", True),
+    "statefulset": ("apps_v1", "list_namespaced_stateful_set", "read_namespaced_stateful_set", True),
+    "job": ("batch_v1", "list_namespaced_job", "read_namespaced_job", True),
+    "cronjob": ("batch_v1", "list_namespaced_cron_job", "read_namespaced_cron_job", True),
+    "ingress": ("networking_v1", "list_namespaced_ingress", "read_namespaced_ingress", True),
+    "clusterrole": ("rbac_v1", "list_cluster_role", "read_cluster_role", False),
+    "clusterrolebinding": ("rbac_v1", "list_cluster_role_binding", "read_cluster_role_binding", False),
+    "role": ("rbac_v1", "list_namespaced_role", "read_namespaced_role", True),
+    "rolebinding": ("rbac_v1", "list_namespaced_role_binding", "read_namespaced_role_binding", True),
+}
+
+
+class AsyncKubernetesOpsModel(BaseModel):
+    """Non-blocking version of KubernetesOpsModel. Every method is a coroutine returning the same output as its blocking twin.
+
+    The api client is created on first use, inside the event loop, and all requests share its connection pool,
+    which holds at most configuration.connection_pool_maxsize connections.
+    """
+    configuration: Any
+    k8s_client: Optional[Any] = None
+    apis: Dict[str, Any] = {}
+    loop: Optional[Any] = None
+    # called before every request for its timeout, as in KubernetesOpsModel
+    request_timeout: Callable[[], Optional[float]] = no_timeout
+    # called with each api client created, to wrap it (with tracing, say)
+    instrument_client: Optional[Callable[[Any], Any]] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_configuration(cls, configuration: Any, **kwargs: Any):
+        """Create a new AsyncKubernetesOpsModel from a kubernetes_asyncio configuration."""
+        if async_client is None:
+            raise ImportError("kubernetes_asyncio is required for the async kubernetes model, install it with `pip install kubernetes_asyncio`")
+        return cls(configuration=configuration, **kwargs)
+
+    def api(self, name: str) -> Any:
+        # aiohttp sessions belong to the loop that created them
+        if self.k8s_client is None or self.loop is not asyncio.get_running_loop():
+            if self.k8s_client is not None:
+                self.close_stale_client()
+            self.loop = asyncio.get_running_loop()
+            self.k8s_client = async_client.ApiClient(configuration=self.configuration)
+            if self.instrument_client is not None:
+                self.instrument_client(self.k8s_client)
+            self.apis = {
+                "core_v1": async_client.CoreV1Api(self.k8s_client),
+                "apps_v1": async_client.AppsV1Api(self.k8s_client),
+                "batch_v1": async_client.BatchV1Api(self.k8s_client),
+                "networking_v1": async_client.NetworkingV1Api(self.k8s_client),
+                "rbac_v1": async_client.RbacAuthorizationV1Api(self.k8s_client),
+            }
+        return self.apis[name]
+
+    def close_stale_client(self):
+        """Close the api client of a previous event loop. Its session can only be closed on that loop, so it's closed there."""
+        stale_client, stale_loop = self.k8s_client, self.loop
+        self.k8s_client = None
+        self.apis = {}
+        if stale_loop.is_closed():
+            # nothing can run on it anymore, the connections are dropped along with the session
+            return
+        if stale_loop.is_running():
+            asyncio.run_coroutine_threadsafe(stale_client.close(), stale_loop)
+            return
+        # a stopped loop can't be run from this thread, which is running its own
+        thread = threading.Thread(target=stale_loop.run_until_complete, args=(stale_client.close(),), name="k8s-client-close")
+        thread.start()
+        thread.join()
+
+    async def close(self):
+        """Close the connection pool."""
+        if self.k8s_client is not None:
+            await self.k8s_client.close()
+            self.k8s_client = None
+            self.loop = None
+
+    async def get_operations(self) -> str:
+        """Return a comma separated list of available operations."""
+        return ",".join(KubernetesOpsModel.__fields__["available_operations"].default)
+
+    async def get_resources(self) -> str:
+        """Return a comma separated list of available resources."""
+        return ",".join(KubernetesOpsModel.__fields__["available_resource_types"].default)
+
+    async def get_namespaces(self) -> str:
+        """Return a comma separated list of available namespaces."""
+        namespace_list = await self.api("core_v1").list_namespace(_request_timeout=self.request_timeout())
+        return ",".join([namespace.metadata.name for namespace in namespace_list.items])
+
+    async def get_logs(self, namespace: str, pod_name: str) -> str:
+        """Get the logs for a pod."""
+        namespace = namespace.replace(" ", "")
+        pod_name = pod_name.replace(" ", "")
+        try:
+            return await self.api("core_v1").read_namespaced_pod_log(pod_name, namespace, tail_lines=50, _request_timeout=self.request_timeout())
+        except Exception as e:
+            return f"Error getting logs for pod {pod_name} in {namespace}: {e}"
+
+    async def create_namespace(self, namespace: str) -> str:
+        """Create a new namespace."""
+        try:
+            await self.api("core_v1").create_namespace(async_client.V1Namespace(
+                metadata=async_client.V1ObjectMeta(name=namespace)), _request_timeout=self.request_timeout())
+            return "Namespace created"
+        except Exception as e:
+            return f"Error: {e}"
+
+    async def get_resource_list(self, namespace: str, resource_type: str) -> List[Any]:
+        """Get a list of resources of a given type in a given namespace."""
+        namespace = namespace.replace(" ", "")
+        kind = singular_resource_type(resource_type, RESOURCE_METHODS)
+        if kind is None:
+            return "Invalid resource type"
+        api, list_method, _, namespaced = RESOURCE_METHODS[kind]
+        try:
+            method = getattr(self.api(api), list_method)
+            resource_list = await (method(namespace, _request_timeout=self.request_timeout()) if namespaced
+                                   else method(_request_timeout=self.request_timeout()))
+            return resource_list.items
+        except Exception as e:
+            return f"Error getting object names for {resource_type} in {namespace}: {e}"
+
+    async def get_resource_names(self, namespace: str, resource_type: str) -> str:
+        """Return a comma separated list of available resources."""
+        try:
+            return ",".join([resource.metadata.name for resource in await self.get_resource_list(namespace, resource_type)])
+        except Exception as e:
+            return f"Error getting object names for {resource_type} in {namespace}: {e}"
+
+    async def get_resource(self, namespace: str, resource_type: str, resource_name: str) -> str:
+        """Run a get for the specified resource in the specified namespace."""
+        namespace = namespace.replace(" ", "")
+        kind = singular_resource_type(resource_type, RESOURCE_METHODS)
+        if kind is None:
+            return "Invalid resource type"
+        api, _, read_method, namespaced = RESOURCE_METHODS[kind]
+        try:
+            method = getattr(self.api(api), read_method)
+            resource = await (method(resource_name, namespace, _request_timeout=self.request_timeout()) if namespaced
+                              else method(resource_name, _request_timeout=self.request_timeout()))
+            return resource_to_yaml(resource)
+        except Exception as e:
+            return f"Error getting {resource_type}/{resource_name} in {namespace}: {e}"
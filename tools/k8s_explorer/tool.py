@@ -1,9 +1,15 @@
-from typing import Any, Dict, List
+from typing import Any, Callable, Collection, Dict, List, Optional
 from langchain.tools.base import BaseTool
 from kubernetes import client
 from pydantic import BaseModel
 import yaml
 
+from tools.aio import BlockingModelAdapter, no_timeout
+from tools.cache import FAILED_PREFIXES, cached_run, first_field, invalidates_run, normalize_input
+
+# resource types that don't live in a namespace, so their listings are invalidated by every write
+CLUSTER_SCOPED_RESOURCE_TYPES = {"namespace", "persistentvolume", "node", "clusterrole", "clusterrolebinding"}
+
 
 class KubernetesOpsModel(BaseModel):
     """Base Representation of a Kubernetes Operation."""
@@ -48,14 +54,16 @@ class KubernetesOpsModel(BaseModel):
     batch_v1: client.BatchV1Api
     networking_v1: client.NetworkingV1Api
     rbac_v1: client.RbacAuthorizationV1Api
+    # called before every request for its timeout, so the agent can bound them by its deadline
+    request_timeout: Callable[[], Optional[float]] = no_timeout
 
     class Config:
         arbitrary_types_allowed = True
 
     @classmethod
-    def from_k8s_client(cls, k8s_client: client.ApiClient):
+    def from_k8s_client(cls, k8s_client: client.ApiClient, **kwargs: Any):
         """Create a new KubernetesOpsModel from a kubernetes client."""
-        return cls(k8s_client=k8s_client, core_v1=client.CoreV1Api(k8s_client), apps_v1=client.AppsV1Api(k8s_client), batch_v1=client.BatchV1Api(k8s_client), networking_v1=client.NetworkingV1Api(k8s_client), rbac_v1=client.RbacAuthorizationV1Api(k8s_client))
+        return cls(k8s_client=k8s_client, core_v1=client.CoreV1Api(k8s_client), apps_v1=client.AppsV1Api(k8s_client), batch_v1=client.BatchV1Api(k8s_client), networking_v1=client.NetworkingV1Api(k8s_client), rbac_v1=client.RbacAuthorizationV1Api(k8s_client), **kwargs)
 
     def get_operations(self) -> str:
         """Return a comma separated list of available operations."""
@@ -67,7 +75,7 @@ class KubernetesOpsModel(BaseModel):
 
     def get_namespaces(self) -> str:
         """Return a comma separated list of available namespaces."""
-        namespace_list = self.core_v1.list_namespace()
+        namespace_list = self.core_v1.list_namespace(_request_timeout=self.request_timeout())
         return ",".join([namespace.metadata.name for namespace in namespace_list.items])
     
     def get_logs(self, namespace: str, pod_name: str) -> str:
@@ -76,7 +84,7 @@ class KubernetesOpsModel(BaseModel):
         namespace = namespace.replace(" ", "")
         pod_name = pod_name.replace(" ", "")
         try:
-            return self.core_v1.read_namespaced_pod_log(pod_name, namespace, tail_lines=50)
+            return self.core_v1.read_namespaced_pod_log(pod_name, namespace, tail_lines=50, _request_timeout=self.request_timeout())
         except Exception as e:
             return f"Error getting logs for pod {pod_name} in {namespace}: {e}"
 
@@ -84,7 +92,7 @@ class KubernetesOpsModel(BaseModel):
         """Create a new namespace."""
         try:
             self.core_v1.create_namespace(client.V1Namespace(
-                metadata=client.V1ObjectMeta(name=namespace)))
+                metadata=client.V1ObjectMeta(name=namespace)), _request_timeout=self.request_timeout())
             return "Namespace created"
         except Exception as e:
             return f"Error: {e}"
@@ -97,54 +105,54 @@ class KubernetesOpsModel(BaseModel):
         try:
             if resource_type == "configmap" or resource_type == "configmaps":
                 resource_list = self.core_v1.list_namespaced_config_map(
-                    namespace)
+                    namespace, _request_timeout=self.request_timeout())
             elif resource_type == "namespace" or resource_type == "namespaces":
-                resource_list = self.core_v1.list_namespace()
+                resource_list = self.core_v1.list_namespace(_request_timeout=self.request_timeout())
             elif resource_type == "persistentvolume" or resource_type == "persistentvolumes":
-                resource_list = self.core_v1.list_persistent_volume()
+                resource_list = self.core_v1.list_persistent_volume(_request_timeout=self.request_timeout())
             elif resource_type == "persistentvolumeclaim" or resource_type == "persistentvolumeclaims":
                 resource_list = self.core_v1.list_namespaced_persistent_volume_claim(
-                    namespace)
+                    namespace, _request_timeout=self.request_timeout())
             elif resource_type == "pod" or resource_type == "pods":
-                resource_list = self.core_v1.list_namespaced_pod(namespace)
+                resource_list = self.core_v1.list_namespaced_pod(namespace, _request_timeout=self.request_timeout())
             elif resource_type == "secret" or resource_type == "secrets":
-                resource_list = self.core_v1.list_namespaced_secret(namespace)
+                resource_list = self.core_v1.list_namespaced_secret(namespace, _request_timeout=self.request_timeout())
             elif resource_type == "serviceaccount" or resource_type == "serviceaccounts":
                 resource_list = self.core_v1.list_namespaced_service_account(
-                    namespace)
+                    namespace, _request_timeout=self.request_timeout())
             elif resource_type == "service" or resource_type == "services":
-                resource_list = self.core_v1.list_namespaced_service(namespace)
+                resource_list = self.core_v1.list_namespaced_service(namespace, _request_timeout=self.request_timeout())
             elif resource_type == "node" or resource_type == "nodes":
-                resource_list = self.core_v1.list_node()
+                resource_list = self.core_v1.list_node(_request_timeout=self.request_timeout())
             elif resource_type == "daemonset" or resource_type == "daemonsets":
                 resource_list = self.apps_v1.list_namespaced_daemon_set(
-                    namespace)
+                    namespace, _request_timeout=self.request_timeout())
             elif resource_type == "deployment" or resource_type == "deployments":
                 resource_list = self.apps_v1.list_namespaced_deployment(
-                    namespace)
+                    namespace, _request_timeout=self.request_timeout())
             elif resource_type == "replicaset" or resource_type == "replicasets":
                 resource_list = self.apps_v1.list_namespaced_replica_set(
-                    namespace)
+                    namespace, _request_timeout=self.request_timeout())
             elif resource_type == "statefulset" or resource_type == "statefulsets":
                 resource_list = self.apps_v1.list_namespaced_stateful_set(
-                    namespace)
+                    namespace, _request_timeout=self.request_timeout())
             elif resource_type == "job" or resource_type == "jobs":
-                resource_list = self.batch_v1.list_namespaced_job(namespace)
+                resource_list = self.batch_v1.list_namespaced_job(namespace, _request_timeout=self.request_timeout())
             elif resource_type == "cronjob" or resource_type == "cronjobs":
                 resource_list = self.batch_v1.list_namespaced_cron_job(
-                    namespace)
+                    namespace, _request_timeout=self.request_timeout())
             elif resource_type == "ingress" or resource_type == "ingresses":
                 resource_list = self.networking_v1.list_namespaced_ingress(
-                    namespace)
+                    namespace, _request_timeout=self.request_timeout())
             elif resource_type == "clusterrole" or resource_type == "clusterroles":
-                resource_list = self.rbac_v1.list_cluster_role()
+                resource_list = self.rbac_v1.list_cluster_role(_request_timeout=self.request_timeout())
             elif resource_type == "clusterrolebinding" or resource_type == "clusterrolebindings":
-                resource_list = self.rbac_v1.list_cluster_role_binding()
+                resource_list = self.rbac_v1.list_cluster_role_binding(_request_timeout=self.request_timeout())
             elif resource_type == "role" or resource_type == "roles":
-                resource_list = self.rbac_v1.list_namespaced_role(namespace)
+                resource_list = self.rbac_v1.list_namespaced_role(namespace, _request_timeout=self.request_timeout())
             elif resource_type == "rolebinding" or resource_type == "rolebindings":
                 resource_list = self.rbac_v1.list_namespaced_role_binding(
-                    namespace)
+                    namespace, _request_timeout=self.request_timeout())
             else:
                 return "Invalid resource type"
             return resource_list.items
@@ -174,60 +182,60 @@ class KubernetesOpsModel(BaseModel):
         try:
             if resource_type == "configmap" or resource_type == "configmaps":
                 resource = self.core_v1.read_namespaced_config_map(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "namespace" or resource_type == "namespaces":
-                resource = self.core_v1.read_namespace(resource_name)
+                resource = self.core_v1.read_namespace(resource_name, _request_timeout=self.request_timeout())
             elif resource_type == "persistentvolume" or resource_type == "persistentvolumes":
-                resource = self.core_v1.read_persistent_volume(resource_name)
+                resource = self.core_v1.read_persistent_volume(resource_name, _request_timeout=self.request_timeout())
             elif resource_type == "persistentvolumeclaim" or resource_type == "persistentvolumeclaims":
                 resource = self.core_v1.read_namespaced_persistent_volume_claim(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "pod" or resource_type == "pods":
                 resource = self.core_v1.read_namespaced_pod(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "secret" or resource_type == "secrets":
                 resource = self.core_v1.read_namespaced_secret(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "serviceaccount" or resource_type == "serviceaccounts":
                 resource = self.core_v1.read_namespaced_service_account(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "service" or resource_type == "services":
                 resource = self.core_v1.read_namespaced_service(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "node" or resource_type == "nodes":
-                resource = self.core_v1.read_node(resource_name)
+                resource = self.core_v1.read_node(resource_name, _request_timeout=self.request_timeout())
             elif resource_type == "daemonset" or resource_type == "daemonsets":
                 resource = self.apps_v1.read_namespaced_daemon_set(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "deployment" or resource_type == "deployments":
                 resource = self.apps_v1.read_namespaced_deployment(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "replicaset" or resource_type == "replicasets":
                 resource = self.apps_v1.read_namespaced_replica_set(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "statefulset" or resource_type == "statefulsets":
                 resource = self.apps_v1.read_namespaced_stateful_set(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "job" or resource_type == "jobs":
                 resource = self.batch_v1.read_namespaced_job(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "cronjob" or resource_type == "cronjobs":
                 resource = self.batch_v1.read_namespaced_cron_job(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "ingress" or resource_type == "ingresses":
                 resource = self.networking_v1.read_namespaced_ingress(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "clusterrole" or resource_type == "clusterroles":
-                resource = self.rbac_v1.read_cluster_role(resource_name)
+                resource = self.rbac_v1.read_cluster_role(resource_name, _request_timeout=self.request_timeout())
             elif resource_type == "clusterrolebinding" or resource_type == "clusterrolebindings":
                 resource = self.rbac_v1.read_cluster_role_binding(
-                    resource_name)
+                    resource_name, _request_timeout=self.request_timeout())
             elif resource_type == "role" or resource_type == "roles":
                 resource = self.rbac_v1.read_namespaced_role(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             elif resource_type == "rolebinding" or resource_type == "rolebindings":
                 resource = self.rbac_v1.read_namespaced_role_binding(
-                    resource_name, namespace)
+                    resource_name, namespace, _request_timeout=self.request_timeout())
             else:
                 return "Invalid resource type"
             return self.resource_to_output(resource)
@@ -236,20 +244,30 @@ class KubernetesOpsModel(BaseModel):
 
     def resource_to_output(self, resource: Any) -> str:
         """Convert the resource to a yaml string."""
-        # first convert to_dict, then to yaml
-        d = resource.to_dict()
-        clean_resource = self.remove_managed_fields_from_metadata(d)
-        d = clean_dict(clean_resource)
-        yaml_src = yaml.dump(d)
-        # delete every line that contains null unless it has a - in it
-        yaml_src = "\n".join(
-            [line for line in yaml_src.splitlines() if "null" not in line or "-" in line])
-        return yaml_src
+        return resource_to_yaml(resource)
 
     def remove_managed_fields_from_metadata(self, resource: Dict[str, Any]) -> Dict[str, Any]:
         """Remove the managedFields key from the metadata of the resource."""
-        resource["metadata"]["managed_fields"] = None
-        return resource
+        return remove_managed_fields_from_metadata(resource)
+
+
+def resource_to_yaml(resource: Any) -> str:
+    """Convert a resource from either the blocking or the asyncio client to a yaml string."""
+    # first convert to_dict, then to yaml
+    d = resource.to_dict()
+    clean_resource = remove_managed_fields_from_metadata(d)
+    d = clean_dict(clean_resource)
+    yaml_src = yaml.dump(d)
+    # delete every line that contains null unless it has a - in it
+    yaml_src = "\n".join(
+        [line for line in yaml_src.splitlines() if "null" not in line or "-" in line])
+    return yaml_src
+
+
+def remove_managed_fields_from_metadata(resource: Dict[str, Any]) -> Dict[str, Any]:
+    """Remove the managedFields key from the metadata of the resource."""
+    resource["metadata"]["managed_fields"] = None
+    return resource
 
 # recursively remove none values from a dict, and anything where all of the values are none
 
@@ -271,7 +289,56 @@ def clean_dict(d: Dict[str, Any]) -> Dict[str, Any]:
     return clean
 
 
-class KubernetesGetAvailableOperationsTool(BaseTool):
+def resource_scope(tool_input: str) -> Optional[str]:
+    """The namespace a "namespace,resource type,..." input is cached under, None for a cluster scoped resource type.
+
+    "x,namespaces" lists namespaces whatever x is, so it has to be dropped when any namespace is created.
+    """
+    fields = normalize_input(tool_input).split(",")
+    if len(fields) > 1:
+        if singular_resource_type(fields[1], CLUSTER_SCOPED_RESOURCE_TYPES):
+            return None
+    return fields[0] or None
+
+
+def singular_resource_type(resource_type: str, resource_types: Collection[str]) -> Optional[str]:
+    """Map a possibly plural resource type, like "pods", "ingresses" or "networkpolicies", to its entry in resource_types."""
+    resource_type = resource_type.replace(" ", "").lower()
+    candidates = [resource_type]
+    if resource_type.endswith("s"):
+        candidates.append(resource_type[:-1])
+    if resource_type.endswith("es"):
+        candidates.append(resource_type[:-2])
+    if resource_type.endswith("ies"):
+        candidates.append(resource_type[:-3] + "y")
+    return next((candidate for candidate in candidates if candidate in resource_types), None)
+
+
+def find_pod_name_like(pods: List[Any], pod_name: str) -> str:
+    """Return the name of the first pod starting with pod_name."""
+    for name in [pod.metadata.name for pod in pods]:
+        if name.startswith(pod_name):
+            return name
+    return "No pod found with name like: " + pod_name
+
+
+def find_running_pod_name_like(pods: Any, pod_name: str) -> str:
+    """Return the name of the first running pod starting with pod_name. pods may be the error get_resource_list returned."""
+    if isinstance(pods, str):
+        return pods
+    return find_pod_name_like([pod for pod in pods if pod.status.phase == "Running"], pod_name)
+
+
+class KubernetesTool(BaseTool):
+    """Base for the explorer tools. _arun uses async_model when it is set, and otherwise runs model on the blocking pool."""
+    model: KubernetesOpsModel
+    async_model: Optional[Any] = None
+
+    def amodel(self) -> Any:
+        return self.async_model if self.async_model is not None else BlockingModelAdapter(self.model)
+
+
+class KubernetesGetAvailableOperationsTool(KubernetesTool):
     """Tool for getting determining available operations."""
     name = "k8s_determine_operations"
     description = """
@@ -280,16 +347,19 @@ class KubernetesGetAvailableOperationsTool(BaseTool):
     """
     model: KubernetesOpsModel
 
+    @cached_run()
     def _run(self, tool_input: str) -> str:
         """Run the tool."""
         return self.model.get_operations()
 
+    @cached_run()
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        # static answer, no need to leave the loop
+        return self.model.get_operations()
 
 
-class KubernetesGetAvailableResourceTypesTool(BaseTool):
+class KubernetesGetAvailableResourceTypesTool(KubernetesTool):
     """Tool for getting available resource types."""
     name = "k8s_get_available_resource_types"
     description = """
@@ -298,16 +368,19 @@ class KubernetesGetAvailableResourceTypesTool(BaseTool):
     """
     model: KubernetesOpsModel
 
+    @cached_run()
     def _run(self, tool_input: str) -> str:
         """Run the tool."""
         return self.model.get_resources()
 
+    @cached_run()
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        # static answer, no need to leave the loop
+        return self.model.get_resources()
 
 
-class KubernetesGetAvailableNamespacesTool(BaseTool):
+class KubernetesGetAvailableNamespacesTool(KubernetesTool):
     """Tool for getting  a list of available namespaces."""
     name = "k8s_get_available_namespaces"
     description = """
@@ -316,16 +389,18 @@ class KubernetesGetAvailableNamespacesTool(BaseTool):
     """
     model: KubernetesOpsModel
 
+    @cached_run(ttl=30)
     def _run(self, tool_input: str) -> str:
         """Run the tool."""
         return self.model.get_namespaces()
 
+    @cached_run(ttl=30)
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await self.amodel().get_namespaces()
 
 
-class KubernetesCreateNamespaceTool(BaseTool):
+class KubernetesCreateNamespaceTool(KubernetesTool):
     """Tool for creating a new namespace."""
     name = "k8s_create_namespace"
     description = """
@@ -335,16 +410,18 @@ class KubernetesCreateNamespaceTool(BaseTool):
     """
     model: KubernetesOpsModel
 
+    @invalidates_run()
     def _run(self, tool_input: str) -> str:
         """Run the tool."""
         return self.model.create_namespace(tool_input)
 
+    @invalidates_run()
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        return await self.amodel().create_namespace(tool_input)
 
 
-class KubernetesGetObjectNamesTool(BaseTool):
+class KubernetesGetObjectNamesTool(KubernetesTool):
     """Tool for getting the names of existing objects."""
     name = "k8s_get_object_names"
     description = """
@@ -355,6 +432,7 @@ class KubernetesGetObjectNamesTool(BaseTool):
     """
     model: KubernetesOpsModel
 
+    @cached_run(ttl=10, namespace=resource_scope)
     def _run(self, tool_input: str) -> str:
         """Run the tool."""
         try:
@@ -363,12 +441,17 @@ class KubernetesGetObjectNamesTool(BaseTool):
         except Exception as e:
             return f"Error getting resource names: {e}"
 
+    @cached_run(ttl=10, namespace=resource_scope)
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        try:
+            namespace, resource_type = tool_input.split(",")
+            return await self.amodel().get_resource_names(namespace, resource_type)
+        except Exception as e:
+            return f"Error getting resource names: {e}"
 
 
-class KubernetesGetResourceTool(BaseTool):
+class KubernetesGetResourceTool(KubernetesTool):
     """Tool for executing a get on a specific Kubernetes Resource."""
     name = "k8s_get_resource"
     description = """
@@ -379,6 +462,7 @@ class KubernetesGetResourceTool(BaseTool):
     """
     model: KubernetesOpsModel
 
+    @cached_run(ttl=5, namespace=resource_scope)
     def _run(self, tool_input: str) -> str:
         """Run the tool."""
         try:
@@ -387,11 +471,16 @@ class KubernetesGetResourceTool(BaseTool):
         except Exception as e:
             return f"Error: {e}"
 
+    @cached_run(ttl=5, namespace=resource_scope)
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        try:
+            namespace, resource_type, resource_name = tool_input.split(",")
+            return await self.amodel().get_resource(namespace, resource_type, resource_name)
+        except Exception as e:
+            return f"Error: {e}"
     
-class KubernetesGetPodNameLikeTool(BaseTool):
+class KubernetesGetPodNameLikeTool(KubernetesTool):
     """Tool for getting a pod with a name like the input."""
     name = "k8s_get_pod_name_like"
     description = """
@@ -402,6 +491,7 @@ class KubernetesGetPodNameLikeTool(BaseTool):
     """
     model: KubernetesOpsModel
 
+    @cached_run(ttl=10, namespace=first_field)
     def _run(self, tool_input: str) -> str:
         """Run the tool."""
         try:
@@ -409,20 +499,22 @@ class KubernetesGetPodNameLikeTool(BaseTool):
             # remove spaces
             pod_name = pod_name.replace(" ", "")
             resources = self.model.get_resource_list(namespace, "pods")
-            resource_names = ",".join([i.metadata.name for i in resources])
-
-            for name in resource_names.split(","):
-                if name.startswith(pod_name):
-                    return name
-            return "No pod found with name like: " + pod_name
+            return find_pod_name_like(resources, pod_name)
         except Exception as e:
             return f"Error: {e}"
 
+    @cached_run(ttl=10, namespace=first_field)
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
+        try:
+            namespace, pod_name = tool_input.split(",")
+            pod_name = pod_name.replace(" ", "")
+            resources = await self.amodel().get_resource_list(namespace, "pods")
+            return find_pod_name_like(resources, pod_name)
+        except Exception as e:
+            return f"Error: {e}"
 
-class KubernetesGetPodLogsTool(BaseTool):
+class KubernetesGetPodLogsTool(KubernetesTool):
     """Tool for getting the logs of a pod."""
     name = "k8s_get_pod_logs"
     description = """
@@ -440,18 +532,22 @@ class KubernetesGetPodLogsTool(BaseTool):
         try:
             namespace, pod_name = tool_input.split(",")
             resources = self.model.get_resource_list(namespace, "pods")
-            resource_names = self.model.get_running_pod_names(resources)
             # remove spaces
-            pod_name = pod_name.replace(" ", "")
-            for name in resource_names.split(","):
-                if name.startswith(pod_name):
-                    pod_name = name
-                else:
-                    return "No pod found with name like: " + pod_name
+            pod_name = find_running_pod_name_like(resources, pod_name.replace(" ", ""))
+            if pod_name.startswith(FAILED_PREFIXES):
+                return pod_name
             return self.model.get_logs(namespace, pod_name)
         except Exception as e:
             return f"Error: {e}"
 
     async def _arun(self, tool_input: str) -> str:
         """Run the tool."""
-        return self._run(tool_input)
\ No newline at end of file
+        try:
+            namespace, pod_name = tool_input.split(",")
+            resources = await self.amodel().get_resource_list(namespace, "pods")
+            pod_name = find_running_pod_name_like(resources, pod_name.replace(" ", ""))
+            if pod_name.startswith(FAILED_PREFIXES):
+                return pod_name
+            return await self.amodel().get_logs(namespace, pod_name)
+        except Exception as e:
+            return f"Error: {e}"
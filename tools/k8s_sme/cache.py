@@ -0,0 +1,97 @@
+"""Semantic cache of SME answers, so a question close enough to one already answered skips retrieval and the LLM."""
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+
+class CachedAnswer:
+    question: str
+    vector: np.ndarray
+    answer: str
+    sources: List[str]
+    index_version: str
+
+    def __init__(self, question: str, vector: np.ndarray, answer: str, sources: List[str], index_version: str):
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.sources = sources
+        self.index_version = index_version
+
+
+class SemanticAnswerCache:
+    """LRU cache of answers keyed by the normalized embedding of their question.
+
+    A lookup returns the answer to the most similar cached question, if its cosine similarity is at least
+    threshold and it was answered from the same index version. Answers from other index versions are dropped
+    as soon as a lookup sees a new version.
+    """
+    max_size: int
+    threshold: float
+    entries: "OrderedDict[str, CachedAnswer]"
+    index_version: Optional[str]
+    lock: threading.Lock
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int = 256, threshold: float = 0.95):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self.index_version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["SemanticAnswerCache"]:
+        """The cache configured by K8S_SME_CACHE_SIZE and K8S_SME_CACHE_THRESHOLD, None if the size is 0."""
+        max_size = int(os.getenv("K8S_SME_CACHE_SIZE", "256"))
+        if max_size <= 0:
+            return None
+        return cls(max_size, float(os.getenv("K8S_SME_CACHE_THRESHOLD", "0.95")))
+
+    def evict_versions(self, index_version: str):
+        """Drop the answers of other index versions. Called with the lock held."""
+        if index_version != self.index_version:
+            for question in [q for q, entry in self.entries.items() if entry.index_version != index_version]:
+                del self.entries[question]
+            self.index_version = index_version
+
+    def get(self, vector: np.ndarray, index_version: str) -> Optional[CachedAnswer]:
+        vector = normalize(vector)
+        with self.lock:
+            self.evict_versions(index_version)
+            if not self.entries:
+                self.misses += 1
+                return None
+            questions = list(self.entries)
+            similarities = np.stack([self.entries[q].vector for q in questions]) @ vector
+            best = int(similarities.argmax())
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(questions[best])
+            self.hits += 1
+            return self.entries[questions[best]]
+
+    def set(self, question: str, vector: np.ndarray, answer: str, sources: List[str], index_version: str):
+        with self.lock:
+            self.evict_versions(index_version)
+            self.entries[question] = CachedAnswer(question, normalize(vector), answer, sources, index_version)
+            self.entries.move_to_end(question)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
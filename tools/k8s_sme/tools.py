@@ -1,13 +1,65 @@
+from typing import List, Optional, Tuple
+
 from langchain import OpenAI
 from langchain.tools.base import BaseTool
 from langchain.chains import RetrievalQA
 from langchain.chat_models import ChatOpenAI
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, PrivateAttr
 
 from doc_indexes.k8s_index import KubernetesIndex
+from doc_indexes.openapi_index import ClusterSchema
+from tools.aio import run_blocking
+from tools.k8s_sme.cache import SemanticAnswerCache
+
+class KubernetesSchemaModel(BaseModel):
+    """Answers questions about API fields straight from the cluster's OpenAPI schema."""
+    schema_index: ClusterSchema
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_k8s_client(cls, k8s_client):
+        return cls(schema_index=ClusterSchema(k8s_client))
+
+    def describe(self, query: str) -> str:
+        kind, path = parse_schema_query(query)
+        if not kind:
+            return "Input should be a kind, optionally followed by a field path, like: deployment spec.progressDeadlineSeconds"
+        index = self.schema_index.get()
+        field = index.lookup(kind, path)
+        if field is not None:
+            return field.to_text()
+        if index.resolve_kind(kind) is None:
+            return f"No kind named {kind} in the cluster's API schema."
+        # show the deepest field that does exist, so the next lookup can pick the right child
+        segments = path.split(".")
+        for i in range(len(segments) - 1, -1, -1):
+            parent = index.lookup(kind, ".".join(segments[:i]))
+            if parent is not None:
+                return f"{kind} has no field {path}. " + parent.to_text()
+
+
+def parse_schema_query(query: str) -> Tuple[str, str]:
+    """Split "apps/v1/Deployment spec.replicas", "deployment.spec.replicas" or "Deployment" into a kind and a path."""
+    query = query.strip().strip("`'\"").replace(",", " ")
+    parts = query.split()
+    if not parts:
+        return "", ""
+    head, rest = parts[0], ".".join(part.strip(".") for part in parts[1:])
+    # the kind is the first dotted segment after the group/version, a group like networking.k8s.io has dots too
+    group_version, slash, kind_and_path = head.rpartition("/")
+    kind, _, path = kind_and_path.partition(".")
+    path = ".".join(segment for segment in (path, rest) if segment)
+    return f"{group_version}{slash}{kind}", path
+
 
 class KubernetesSMEModel(BaseModel):
     index: KubernetesIndex
+    # answers field questions exactly, when the SME runs against a cluster
+    schema_model: Optional[KubernetesSchemaModel] = None
+    answer_cache: Optional[SemanticAnswerCache] = Field(default_factory=SemanticAnswerCache.from_env)
+    _qa: Optional[RetrievalQA] = PrivateAttr(default=None)
 
     class Config:
         arbitrary_types_allowed = True
@@ -16,10 +68,42 @@ class KubernetesSMEModel(BaseModel):
     def from_index(cls, index: KubernetesIndex):
         return cls(index=index)
 
+    def qa(self) -> RetrievalQA:
+        """The chain answering queries, built on first use and again when the index changes."""
+        if self._qa is None:
+            self._qa = RetrievalQA.from_chain_type(llm=ChatOpenAI(), chain_type="stuff", retriever=self.index.as_retriever(),
+                                                   return_source_documents=True)
+        return self._qa
+
     def query(self, query: str) -> str:
-        retriever = self.index.vectordb.as_retriever()
-        qa =  RetrievalQA.from_chain_type(llm=ChatOpenAI(), chain_type="stuff", retriever=retriever)
-        return qa.run(query)
+        answer, sources = self.answer(query)
+        return f"{answer}\n\nSources: {', '.join(sources)}" if sources else answer
+
+    def answer(self, query: str) -> Tuple[str, List[str]]:
+        """The answer to query and the sections it was drawn from, from the answer cache when a similar query was answered."""
+        # pick up updates of the index made by another process; the chain's retriever holds the old BM25 index and parents
+        if self.index.refresh():
+            self._qa = None
+        if self.answer_cache is None:
+            return self.ask(query)
+        # the embeddings keep recent query vectors, so the retriever reuses this one on a miss
+        vector = self.index.embeddings.embed_query(query)
+        version = self.index.version()
+        cached = self.answer_cache.get(vector, version)
+        if cached is not None:
+            return cached.answer, cached.sources
+        answer, sources = self.ask(query)
+        self.answer_cache.set(query, vector, answer, sources, version)
+        return answer, sources
+
+    def ask(self, query: str) -> Tuple[str, List[str]]:
+        result = self.qa()({"query": query})
+        sources = []
+        for document in result["source_documents"]:
+            source = document.metadata.get("section") or document.metadata.get("source", "")
+            if source and source not in sources:
+                sources.append(source)
+        return result["result"], sources
     
 
 class KubernetesSMETool(BaseTool):
@@ -38,4 +122,26 @@ class KubernetesSMETool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Query the SME."""
-        return self._run(tool_input)
+        return await run_blocking(self._run, tool_input)
+
+
+class KubernetesSchemaTool(BaseTool):
+    name = "k8s_schema"
+    description = """
+    Tool for looking up the exact schema of a Kubernetes resource or field in the cluster's API, CRDs included.
+    Returns the field's type, whether it is required, its default and description, and the fields under it.
+    Input should be a kind, optionally followed by a dotted field path. Example inputs:
+        deployment spec.progressDeadlineSeconds
+        apps/v1/Deployment.spec.strategy
+        pod spec.containers.resources
+    """
+    model: KubernetesSchemaModel
+
+    def _run(self, tool_input: str) -> str:
+        """Look up the schema."""
+        return self.model.describe(tool_input)
+
+    async def _arun(self, tool_input: str) -> str:
+        """Look up the schema."""
+        # the first lookup may download the schema
+        return await run_blocking(self._run, tool_input)
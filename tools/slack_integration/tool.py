@@ -1,10 +1,19 @@
+import asyncio
+from typing import Callable, Optional
 from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
 from langchain.tools.base import BaseTool
 from pydantic import BaseModel
 
+from tools.aio import no_timeout, run_blocking
+
 class SlackModel(BaseModel):
     """Model for slack integration."""
     client: WebClient
+    # used on the asyncio path; without it async sends run the blocking client on a thread
+    async_client: Optional[AsyncWebClient] = None
+    # called before every async send for its timeout, so the agent can bound it by its deadline
+    request_timeout: Callable[[], Optional[float]] = no_timeout
 
     class Config:
         arbitrary_types_allowed = True
@@ -22,6 +31,17 @@ class SlackModel(BaseModel):
         except Exception as e:
             return f"Error sending slack message: {e}"
 
+    async def asend_message(self, message: str, channel: str, thread_ts: str | None = None) -> str:
+        """Send a message to slack without blocking the event loop."""
+        if self.async_client is None:
+            return await run_blocking(self.send_message, message, channel, thread_ts)
+        try:
+            await asyncio.wait_for(self.async_client.chat_postMessage(channel=channel, text=message, thread_ts=thread_ts),
+                                   timeout=self.request_timeout())
+            return "Message sent"
+        except Exception as e:
+            return f"Error sending slack message: {e}"
+
 class SlackSendMessageTool(BaseTool):
     """Tool for sending a message to slack."""
     name = "slack_send_message"
@@ -42,5 +62,6 @@ class SlackSendMessageTool(BaseTool):
     
     async def _arun(self, tool_input: str) -> str:
         """Send a message to slack."""
-        return self._run(tool_input)
+        tool_input = tool_input.replace("\\n", "\n")
+        return await self.model.asend_message(tool_input, self.channel, self.thread_ts)
     
\ No newline at end of file